@@ -9,17 +9,39 @@ from routes.reservations import router as reservations_router
 from routes.time_slots import router as time_slots_router
 from routes.users import router as users_router
 from routes.admin import router as admin_router
+from routes.waitlist import router as waitlist_router
 
 # 导入数据库模块
 from database import create_tables
+from database import crud
+from database.connection import SessionLocal
+from services.booking_queue import booking_queue
+from services.occupancy import occupancy_index
+from services.reference_cache import reference_cache
+from services.scheduler import reservation_scheduler
+from settings import settings
 
 @asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
     # 启动时执行
     create_tables()
+    # 加载房间、座位、时间段缓存
+    db = SessionLocal()
+    try:
+        reference_cache.load(db)
+        # 加载座位占用位图
+        occupancy_index.load(db)
+        # 补齐循环预约规则的滚动窗口
+        crud.expand_due_rules(db, settings.RULE_EXPANSION_DAYS)
+    finally:
+        db.close()
+    # 启动后台定时任务（释放未签到预约、展开循环预约）
+    reservation_scheduler.start()
     yield
     # 关闭时执行
-    pass
+    await reservation_scheduler.stop()
+    # 抢座模式的写入任务在第一次提交请求时启动
+    await booking_queue.stop()
 
 app = fastapi.FastAPI(lifespan=lifespan)
 
@@ -33,7 +55,8 @@ app.add_middleware(
     allow_origins=[FRONTEND_URL],  # 明确指定允许的前端源
     allow_credentials=True,  # 与前端的same-origin设置匹配
     allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],  # 明确指定允许的方法
-    allow_headers=["Content-Type", "Authorization", "X-Requested-With"],  # 明确指定允许的头部
+    allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Idempotency-Key", "If-None-Match"],  # 明确指定允许的头部
+    expose_headers=["ETag"],  # 前端需要读取 ETag 以便下次带上 If-None-Match
 )
 
 @app.get("/")
@@ -49,6 +72,7 @@ app.include_router(reservations_router, prefix="/api/reservations", tags=["reser
 app.include_router(time_slots_router, prefix="/api/time-slots", tags=["time-slots"])
 app.include_router(users_router, prefix="/api/users", tags=["users"])
 app.include_router(admin_router, prefix="/api/admin", tags=["admin"])
+app.include_router(waitlist_router, prefix="/api/waitlist", tags=["waitlist"])
 
 # 添加一个特定的路由用于位置数据
 # 这里我们复用rooms模块中的get_all_locations函数
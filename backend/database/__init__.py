@@ -1,8 +1,11 @@
 """
 Database module initialization.
 """
+from sqlalchemy import inspect
+
 from .connection import Base, engine, get_db
 from .models import *  # Import all models
+from .migrations import run_migrations, stamp_migrations, check_indexes
 
 # 创建所有表
 def create_tables():
@@ -10,4 +13,12 @@ def create_tables():
     创建数据库中的所有表
     """
     # Base.metadata.drop_all(bind=engine)  # 删除所有表
+    is_new_database = not inspect(engine).get_table_names()
     Base.metadata.create_all(bind=engine)
+    if is_new_database:
+        # 新建的数据库已经是最新结构，直接记录迁移版本
+        stamp_migrations(engine)
+    else:
+        # 对已有数据库补齐索引等结构变更
+        run_migrations(engine)
+    check_indexes(engine)
@@ -0,0 +1,31 @@
+"""
+归档历史预约（reservation_archive）
+
+预约日期早于 ARCHIVE_AFTER_DAYS 天之前的预约从 reservations 移入归档表，
+后台定时任务每天执行一次，也可以在 backend 路径下手动执行：
+
+    python -m database.archive [天数]
+"""
+import sys
+from datetime import date, timedelta
+
+from . import create_tables, crud
+from .connection import SessionLocal
+from settings import settings
+
+
+def archive(days: int = settings.ARCHIVE_AFTER_DAYS):
+    """
+    归档 days 天之前的预约
+    """
+    create_tables()
+    db = SessionLocal()
+    try:
+        rows = crud.archive_reservations(db, date.today() - timedelta(days=days))
+        print(f"已归档 {rows} 条预约")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    archive(int(sys.argv[1]) if len(sys.argv) > 1 else settings.ARCHIVE_AFTER_DAYS)
@@ -1,6 +1,8 @@
 """
 Database connection module.
 """
+import json
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -12,7 +14,9 @@ engine = create_engine(
     settings.DATABASE_URL, 
     connect_args= {
         "check_same_thread": False,  # 允许在多线程中使用同一连接
-    }
+    },
+    # JSON 字段保留中文原文，便于直接查看数据库
+    json_serializer=lambda value: json.dumps(value, ensure_ascii=False),
 )
 
 # 创建会话工厂
@@ -2,10 +2,15 @@
 CRUD operations for the database models.
 """
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any, Union
-from datetime import datetime
+from sqlalchemy import select, insert, update, delete, union_all, func, case, literal, tuple_, or_, exists
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import List, Optional, Dict, Any, Union, Tuple, NamedTuple
+from datetime import datetime, timedelta, date as date_type
+import re
+import uuid
 
 from . import models
+from .pagination import keyset_page
 
 
 # ==================== 用户相关操作 ====================
@@ -293,6 +298,74 @@ def get_seats_by_room(db: Session, room_id: int, skip: int = 0, limit: int = 100
     return db.query(models.Seat).filter(models.Seat.room_id == room_id).offset(skip).limit(limit).all()
 
 
+def get_usual_seat(db: Session, user_id: int, recent: int = 50) -> Optional[int]:
+    """
+    用户最常坐的座位：最近 recent 条预约中出现次数最多的座位（次数相同取最近预约过的）
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        recent: 统计的最近预约数
+        
+    Returns:
+        座位ID，没有预约记录时返回None
+    """
+    reservation = models.Reservation
+    # 按 ix_reservations_user_created 索引取最近的预约
+    recent_seats = db.query(
+        reservation.seat_id, reservation.created_at
+    ).filter(
+        reservation.user_id == user_id
+    ).order_by(reservation.created_at.desc(), reservation.id.desc()).limit(recent).subquery()
+    row = db.query(recent_seats.c.seat_id).group_by(recent_seats.c.seat_id).order_by(
+        func.count().desc(), func.max(recent_seats.c.created_at).desc()
+    ).first()
+    return int(row.seat_id) if row else None
+
+
+def seat_grid_position(seat_number: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    从 "A1"、"B12" 这样的座位编号推出座位图中的位置：字母为行（A 为第 0 行），数字为列（1 为第 0 列）
+    
+    Returns:
+        (行号, 列号)，编号不是这种格式时为 (None, None)
+    """
+    match = re.fullmatch(r"([A-Za-z]+)(\d+)", (seat_number or "").strip())
+    if not match or int(match.group(2)) < 1:
+        return None, None
+    row = 0
+    for letter in match.group(1).upper():
+        row = row * 26 + ord(letter) - ord("A") + 1
+    return row - 1, int(match.group(2)) - 1
+
+
+def get_seat_collection_version(db: Session, room_id: Optional[int] = None) -> str:
+    """
+    座位列表的版本：座位和房间的数量、最后修改时间及修改时间之和，增删改座位或房间后都会变化
+    （只用最后修改时间时，把某一行的修改时间改成较早的值不会被发现）
+    
+    Args:
+        db: 数据库会话
+        room_id: 只计算该房间的座位
+        
+    Returns:
+        版本字符串，用于生成 ETag
+    """
+    def summary(model):
+        return (
+            func.count(model.id),
+            func.max(model.updated_at),
+            func.total(func.julianday(model.updated_at)),
+        )
+
+    seats = db.query(*summary(models.Seat))
+    rooms = db.query(*summary(models.Room))
+    if room_id is not None:
+        seats = seats.filter(models.Seat.room_id == room_id)
+        rooms = rooms.filter(models.Room.id == room_id)
+    return ":".join(str(value) for value in (*seats.one(), *rooms.one()))
+
+
 def update_seat(db: Session, seat_id: int, seat_data: Dict[str, Any]) -> Optional[models.Seat]:
     """
     更新座位信息
@@ -486,13 +559,17 @@ def create_reservation(
         新创建的预约对象
     """
     db_reservation = models.Reservation(
+        id=str(uuid.uuid4()),
         user_id=user_id,
         seat_id=seat_id,
         date=date,
         time_slot_id=time_slot_id,
-        status="待确认"
+        status=models.ReservationStatus.RESERVED
     )
     db.add(db_reservation)
+    record_reservation_changes(db, [ReservationChange(
+        db_reservation.id, user_id, date, seat_id, time_slot_id, None, models.ReservationStatus.RESERVED
+    )])
     db.commit()
     db.refresh(db_reservation)
     return db_reservation
@@ -512,20 +589,26 @@ def get_reservation(db: Session, reservation_id: str) -> Optional[models.Reserva
     return db.query(models.Reservation).filter(models.Reservation.id == reservation_id).first()
 
 
-def get_user_reservations(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[models.Reservation]:
+def get_user_reservations(
+    db: Session,
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = 100
+) -> Tuple[List[models.Reservation], Optional[str]]:
     """
-    获取用户的所有预约
+    获取用户的预约（游标分页，按创建时间倒序）
     
     Args:
         db: 数据库会话
         user_id: 用户ID
-        skip: 跳过的记录数
+        cursor: 上一页返回的游标，为None时从第一页开始
         limit: 返回的最大记录数
         
     Returns:
-        预约对象列表
+        (预约对象列表, 下一页游标)
     """
-    return db.query(models.Reservation).filter(models.Reservation.user_id == user_id).offset(skip).limit(limit).all()
+    query = db.query(models.Reservation).filter(models.Reservation.user_id == user_id)
+    return keyset_page(query, models.Reservation.created_at, models.Reservation.id, cursor, limit)
 
 
 def get_recent_reservations(db: Session, user_id: int, limit: int = 5) -> List[models.Reservation]:
@@ -547,23 +630,33 @@ def get_recent_reservations(db: Session, user_id: int, limit: int = 5) -> List[m
         .all()
 
 
-def update_reservation_status(db: Session, reservation_id: str, status: str) -> Optional[models.Reservation]:
+def update_reservation_status(
+    db: Session, reservation_id: str, status: models.ReservationStatus
+) -> Optional[models.Reservation]:
     """
     更新预约状态
     
     Args:
         db: 数据库会话
         reservation_id: 预约ID
-        status: 新状态 ("待确认", "已确认", "已取消")
+        status: 新状态
         
     Returns:
         更新后的预约对象，如果预约不存在则返回None
+        
+    Raises:
+        ValueError: 如果状态转换不被允许
     """
     db_reservation = db.query(models.Reservation).filter(models.Reservation.id == reservation_id).first()
     if not db_reservation:
         return None
         
+    old_status = db_reservation.status
     db_reservation.status = status
+    record_reservation_changes(db, [ReservationChange(
+        db_reservation.id, db_reservation.user_id, db_reservation.date, db_reservation.seat_id,
+        db_reservation.time_slot_id, old_status, db_reservation.status
+    )])
     db_reservation.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(db_reservation)
@@ -587,12 +680,503 @@ def is_seat_reserved(db: Session, seat_id: int, date: str, time_slot_id: str) ->
         models.Reservation.seat_id == seat_id,
         models.Reservation.date == date,
         models.Reservation.time_slot_id == time_slot_id,
-        models.Reservation.status.in_(["待确认", "已确认"])
+        models.Reservation.status.in_(models.RESERVATION_ACTIVE_STATUSES)
     ).first()
     
     return reservation is not None
 
 
+# 批量查询时每条 SQL 的最大键数量，避免超出 SQLite 参数个数限制
+BULK_CHUNK_SIZE = 300
+
+
+def find_reserved_slots(db: Session, keys: List[Tuple[int, date_type, str]]) -> set:
+    """
+    批量检查 (座位ID, 日期, 时间段ID) 是否已有有效预约
+    
+    Args:
+        db: 数据库会话
+        keys: (座位ID, 日期, 时间段ID) 列表
+        
+    Returns:
+        已被预约的 (座位ID, 日期, 时间段ID) 集合
+    """
+    reservation = models.Reservation
+    reserved = set()
+    keys = list(keys)
+    for start in range(0, len(keys), BULK_CHUNK_SIZE):
+        chunk = keys[start:start + BULK_CHUNK_SIZE]
+        rows = db.query(reservation.seat_id, reservation.date, reservation.time_slot_id).filter(
+            reservation.status.in_(models.RESERVATION_ACTIVE_STATUSES),
+            tuple_(reservation.seat_id, reservation.date, reservation.time_slot_id).in_(chunk),
+        )
+        reserved.update((row.seat_id, row.date, row.time_slot_id) for row in rows)
+    return reserved
+
+
+def insert_reservations(db: Session, rows: List[Dict[str, Any]]) -> set:
+    """
+    批量插入预约（executemany），与已有有效预约冲突的行会被忽略，
+    并在同一事务中更新签到汇总（由调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        rows: 预约字段字典列表，需包含 id、user_id、seat_id、date、time_slot_id、status
+        
+    Returns:
+        实际插入成功的预约ID集合
+    """
+    if not rows:
+        return set()
+    now = datetime.now()
+    rows = [{"created_at": now, "updated_at": now, **row} for row in rows]
+    # 唯一索引冲突（例如并发请求抢先插入）的行由 OR IGNORE 跳过
+    db.execute(sqlite_insert(models.Reservation).prefix_with("OR IGNORE"), rows)
+
+    ids = [row["id"] for row in rows]
+    inserted = set()
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        inserted.update(
+            row.id for row in db.query(models.Reservation.id).filter(
+                models.Reservation.id.in_(ids[start:start + BULK_CHUNK_SIZE])
+            )
+        )
+    record_reservation_changes(db, [
+        ReservationChange(
+            row["id"], row["user_id"], row["date"], row["seat_id"], row["time_slot_id"], None, row["status"]
+        )
+        for row in rows if row["id"] in inserted
+    ])
+    return inserted
+
+
+def change_reservations_status(
+    db: Session, reservations: List[Any], status: models.ReservationStatus
+) -> set:
+    """
+    批量修改预约状态：一条 UPDATE ... WHERE (id, version) IN (...)，
+    读取之后被其他请求修改过的预约（版本号已变化）不会被覆盖，
+    并在同一事务中更新签到汇总（由调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        reservations: 已通过校验的预约行（需包含 id、user_id、version、date、seat_id、time_slot_id、status）
+        status: 新状态
+        
+    Returns:
+        实际修改成功的预约ID集合
+    """
+    reservation = models.Reservation
+    changed = set()
+    for start in range(0, len(reservations), BULK_CHUNK_SIZE):
+        chunk = reservations[start:start + BULK_CHUNK_SIZE]
+        result = db.execute(
+            update(reservation)
+            .where(
+                tuple_(reservation.id, reservation.version).in_([(row.id, row.version) for row in chunk]),
+                reservation.status.in_(models.transition_sources(status)),
+            )
+            .values(status=status, version=reservation.version + 1, updated_at=datetime.now())
+            .returning(reservation.id)
+            .execution_options(synchronize_session=False)
+        )
+        changed.update(row.id for row in result)
+    record_reservation_changes(db, [
+        ReservationChange(row.id, row.user_id, row.date, row.seat_id, row.time_slot_id, row.status, status)
+        for row in reservations if row.id in changed
+    ])
+    return changed
+
+
+def checkin_reservations(db: Session, reservations: List[Any]) -> set:
+    """
+    批量签到：将可以签到的预约改为"已签到"（由调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        reservations: 已通过校验的预约行（需包含 id、user_id、version、date、seat_id、time_slot_id、status）
+        
+    Returns:
+        签到成功的预约ID集合
+    """
+    return change_reservations_status(db, reservations, models.ReservationStatus.CHECKED_IN)
+
+
+def release_no_show_reservations(db: Session, now: datetime, grace_minutes: int) -> List[Any]:
+    """
+    释放未签到的预约：时间段开始超过 grace_minutes 分钟仍为"已预约"的预约改为"已取消"，
+    并在同一事务中更新签到汇总（由调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        now: 当前时间
+        grace_minutes: 宽限分钟数
+        
+    Returns:
+        被释放的预约行列表（包含 id、user_id、date、seat_id、time_slot_id）
+    """
+    reservation = models.Reservation
+    today = now.date()
+    cutoff = now - timedelta(minutes=grace_minutes)
+    # 今天已经过了宽限期的时间段（时间格式为 HH:MM，可以直接按字符串比较）
+    due_slots = []
+    if cutoff.date() == today:
+        due_slots = [
+            slot.id for slot in
+            db.query(models.TimeSlot.id).filter(models.TimeSlot.start_time <= cutoff.strftime("%H:%M"))
+        ]
+
+    # 一条 UPDATE ... RETURNING：按 (status, date) 索引做范围扫描，
+    # 已释放或已签到的历史预约不会被扫到；与签到并发时不会重复计数
+    released = db.execute(
+        update(reservation)
+        .where(
+            reservation.status == models.ReservationStatus.RESERVED,
+            reservation.date <= today,
+            or_(reservation.date < today, reservation.time_slot_id.in_(due_slots)),
+            # 时间段开始后才创建的预约（例如候补分配）同样从创建时起给足宽限期
+            reservation.created_at <= cutoff,
+        )
+        .values(status=models.ReservationStatus.CANCELLED, version=reservation.version + 1, updated_at=datetime.now())
+        .returning(
+            reservation.id, reservation.user_id, reservation.date, reservation.seat_id, reservation.time_slot_id
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+    record_reservation_changes(db, [
+        ReservationChange(
+            row.id, row.user_id, row.date, row.seat_id, row.time_slot_id,
+            models.ReservationStatus.RESERVED, models.ReservationStatus.CANCELLED,
+        )
+        for row in released
+    ])
+    return released
+
+
+# ==================== 循环预约规则相关操作 ====================
+
+def create_reservation_rule(
+    db: Session,
+    user_id: int,
+    seat_id: int,
+    time_slot_id: str,
+    weekdays: List[int],
+    start_date: date_type,
+    end_date: date_type
+) -> models.ReservationRule:
+    """
+    创建循环预约规则（不展开，由调用方调用 expand_reservation_rule）
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        seat_id: 座位ID
+        time_slot_id: 时间段ID
+        weekdays: 星期几列表（0表示周一）
+        start_date: 开始日期
+        end_date: 结束日期
+        
+    Returns:
+        新创建的规则对象
+    """
+    db_rule = models.ReservationRule(
+        user_id=user_id,
+        seat_id=seat_id,
+        time_slot_id=time_slot_id,
+        weekdays=",".join(str(day) for day in sorted(set(weekdays))),
+        start_date=start_date,
+        end_date=end_date,
+    )
+    db.add(db_rule)
+    db.flush()
+    return db_rule
+
+
+def expand_reservation_rule(db: Session, rule: models.ReservationRule, until: date_type) -> Tuple[int, int]:
+    """
+    将循环预约规则展开到指定日期（不含已展开的部分，由调用方提交事务）
+    
+    先按 (座位, 日期, 时间段) 集合一次性检查冲突，再分块批量插入
+    
+    Args:
+        db: 数据库会话
+        rule: 规则对象
+        until: 展开到的日期（含）
+        
+    Returns:
+        (新建的预约数, 冲突跳过的日期数)
+    """
+    start = max(rule.start_date, date_type.today())
+    if rule.materialized_until is not None:
+        start = max(start, rule.materialized_until + timedelta(days=1))
+    end = min(rule.end_date, until)
+    if start > end:
+        return 0, 0
+
+    weekdays = set(rule.weekday_list)
+    dates = [
+        start + timedelta(days=offset)
+        for offset in range((end - start).days + 1)
+        if (start + timedelta(days=offset)).weekday() in weekdays
+    ]
+    keys = [(rule.seat_id, day, rule.time_slot_id) for day in dates]
+    reserved = find_reserved_slots(db, keys)
+
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": rule.user_id,
+            "seat_id": seat_id,
+            "date": day,
+            "time_slot_id": time_slot_id,
+            "status": models.ReservationStatus.RESERVED,
+            "rule_id": rule.id,
+        }
+        for seat_id, day, time_slot_id in keys
+        if (seat_id, day, time_slot_id) not in reserved
+    ]
+    created = 0
+    for chunk_start in range(0, len(rows), BULK_CHUNK_SIZE):
+        created += len(insert_reservations(db, rows[chunk_start:chunk_start + BULK_CHUNK_SIZE]))
+
+    rule.materialized_until = end
+    rule.updated_at = datetime.utcnow()
+    return created, len(keys) - created
+
+
+def expand_due_rules(db: Session, horizon_days: int) -> int:
+    """
+    将所有有效规则展开到 今天+horizon_days 的滚动窗口（每条规则单独提交）
+    
+    Args:
+        db: 数据库会话
+        horizon_days: 提前展开的天数
+        
+    Returns:
+        新建的预约数
+    """
+    until = date_type.today() + timedelta(days=horizon_days)
+    rule = models.ReservationRule
+    due_rules = db.query(rule).filter(
+        rule.is_active == True,
+        or_(rule.materialized_until.is_(None), rule.materialized_until < until),
+        or_(rule.materialized_until.is_(None), rule.materialized_until < rule.end_date),
+    ).all()
+    created = 0
+    for db_rule in due_rules:
+        created += expand_reservation_rule(db, db_rule, until)[0]
+        db.commit()
+    return created
+
+
+def get_user_reservation_rules(db: Session, user_id: int) -> List[models.ReservationRule]:
+    """
+    获取用户的循环预约规则
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        
+    Returns:
+        规则对象列表
+    """
+    return db.query(models.ReservationRule).filter(
+        models.ReservationRule.user_id == user_id
+    ).order_by(models.ReservationRule.created_at.desc()).all()
+
+
+def deactivate_reservation_rule(db: Session, rule: models.ReservationRule) -> int:
+    """
+    停用循环预约规则，并取消由它生成的、今天之后尚未签到的预约
+    
+    Args:
+        db: 数据库会话
+        rule: 规则对象
+        
+    Returns:
+        取消的预约数
+    """
+    reservation = models.Reservation
+    future = db.query(
+        reservation.id, reservation.user_id, reservation.version, reservation.date, reservation.seat_id,
+        reservation.time_slot_id, reservation.status
+    ).filter(
+        reservation.rule_id == rule.id,
+        reservation.date > date_type.today(),
+        reservation.status.in_(models.RESERVATION_CANCELLABLE_STATUSES),
+    ).all()
+    cancelled = change_reservations_status(db, future, models.ReservationStatus.CANCELLED)
+    # 空出的座位分配给候补用户
+    assign_waitlist(db, [(row.date, row.seat_id, row.time_slot_id) for row in future if row.id in cancelled])
+    rule.is_active = False
+    rule.updated_at = datetime.utcnow()
+    db.commit()
+    return len(cancelled)
+
+
+# ==================== 候补相关操作 ====================
+
+def create_waitlist_entry(
+    db: Session,
+    user_id: int,
+    date: date_type,
+    time_slot_id: str,
+    room_id: Optional[int] = None,
+    feature: Optional[str] = None
+) -> models.WaitlistEntry:
+    """
+    登记候补
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        date: 日期
+        time_slot_id: 时间段ID
+        room_id: 房间ID，为空表示任意房间
+        feature: 要求的座位特性，为空表示不要求
+        
+    Returns:
+        新创建的候补对象
+    """
+    db_entry = models.WaitlistEntry(
+        user_id=user_id,
+        date=date,
+        time_slot_id=time_slot_id,
+        room_id=room_id,
+        feature=feature,
+        status="等待中",
+        created_at=datetime.now(),
+        updated_at=datetime.now(),
+    )
+    db.add(db_entry)
+    db.commit()
+    db.refresh(db_entry)
+    return db_entry
+
+
+def get_waiting_entry(db: Session, user_id: int, date: date_type, time_slot_id: str) -> Optional[models.WaitlistEntry]:
+    """
+    获取用户在某个日期、时间段正在等待的候补
+    
+    Returns:
+        候补对象，如果不存在则返回None
+    """
+    waitlist = models.WaitlistEntry
+    return db.query(waitlist).filter(
+        waitlist.date == date,
+        waitlist.time_slot_id == time_slot_id,
+        waitlist.status == "等待中",
+        waitlist.user_id == user_id,
+    ).first()
+
+
+def get_user_waitlist_entries(db: Session, user_id: int) -> List[models.WaitlistEntry]:
+    """
+    获取用户的候补列表
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        
+    Returns:
+        候补对象列表
+    """
+    return db.query(models.WaitlistEntry).filter(
+        models.WaitlistEntry.user_id == user_id
+    ).order_by(models.WaitlistEntry.created_at.desc()).all()
+
+
+def cancel_waitlist_entry(db: Session, entry: models.WaitlistEntry) -> models.WaitlistEntry:
+    """
+    取消候补
+    """
+    entry.status = "已取消"
+    entry.updated_at = datetime.now()
+    db.commit()
+    db.refresh(entry)
+    return entry
+
+
+def assign_waitlist(
+    db: Session,
+    freed: List[Tuple[date_type, int, str]],
+    now: Optional[datetime] = None
+) -> List[models.WaitlistEntry]:
+    """
+    把空出的座位分配给候补用户：每个 (日期, 座位, 时间段) 分配给最早登记、
+    房间和座位特性都符合、且该时间段还没有有效预约的候补。
+    与取消/释放在同一事务中执行（由调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        freed: 空出的 (日期, 座位ID, 时间段ID) 列表
+        now: 当前时间，已经结束的时间段不再分配
+        
+    Returns:
+        分配成功的候补对象列表
+    """
+    if not freed:
+        return []
+    # 会话关闭了 autoflush，先写入调用方对预约状态的修改，唯一索引才能看到座位已空出
+    db.flush()
+    now = now or datetime.now()
+    waitlist = models.WaitlistEntry
+    reservation = models.Reservation
+    slot_end_times = dict(db.query(models.TimeSlot.id, models.TimeSlot.end_time))
+    seats = {
+        seat.id: seat
+        for seat in db.query(models.Seat.id, models.Seat.room_id, models.Seat.features).filter(
+            models.Seat.id.in_({int(seat_id) for _, seat_id, _ in freed if seat_id is not None})
+        )
+    }
+
+    assigned = []
+    for reservation_date, seat_id, time_slot_id in freed:
+        end_time = slot_end_times.get(time_slot_id)
+        if reservation_date < now.date() or (
+            reservation_date == now.date() and end_time is not None and end_time <= now.strftime("%H:%M")
+        ):
+            continue
+        seat = seats.get(int(seat_id)) if seat_id is not None else None
+        if seat is None:
+            continue
+
+        # 按 ix_waitlist_queue 索引顺序取队首，不扫描整个队列
+        entry = db.query(waitlist).filter(
+            waitlist.date == reservation_date,
+            waitlist.time_slot_id == time_slot_id,
+            waitlist.status == "等待中",
+            or_(waitlist.room_id.is_(None), waitlist.room_id == seat.room_id),
+            or_(waitlist.feature.is_(None), waitlist.feature.in_(seat.features or [])),
+            ~exists().where(
+                reservation.user_id == waitlist.user_id,
+                reservation.date == waitlist.date,
+                reservation.time_slot_id == waitlist.time_slot_id,
+                reservation.status.in_(models.RESERVATION_ACTIVE_STATUSES),
+            ),
+        ).order_by(waitlist.created_at, waitlist.id).first()
+        if entry is None:
+            continue
+
+        reservation_id = str(uuid.uuid4())
+        inserted = insert_reservations(db, [{
+            "id": reservation_id,
+            "user_id": entry.user_id,
+            "seat_id": int(seat_id),
+            "date": reservation_date,
+            "time_slot_id": time_slot_id,
+            "status": models.ReservationStatus.RESERVED,
+        }])
+        if not inserted:
+            continue
+        entry.status = "已分配"
+        entry.reservation_id = reservation_id
+        entry.updated_at = datetime.now()
+        db.flush()
+        assigned.append(entry)
+    return assigned
+
+
 def get_time_slot(db: Session, time_slot_id: str) -> Optional[models.TimeSlot]:
     """
     通过ID获取时间段
@@ -711,27 +1295,19 @@ def get_reservation_stats(db: Session) -> List[Dict[str, Union[str, int]]]:
     Returns:
         统计数据列表，包含名称和总数
     """
-    # 计算不同状态的预约数量
-    result = []
-    
-    # 待确认预约数量
-    pending_count = db.query(models.Reservation).filter(models.Reservation.status == "待确认").count()
-    result.append({"name": "待确认预约", "total": pending_count})
-    
-    # 已确认预约数量
-    confirmed_count = db.query(models.Reservation).filter(models.Reservation.status == "已确认").count()
-    result.append({"name": "已确认预约", "total": confirmed_count})
-    
-    # 已取消预约数量
-    cancelled_count = db.query(models.Reservation).filter(models.Reservation.status == "已取消").count()
-    result.append({"name": "已取消预约", "total": cancelled_count})
-    
-    # 总预约数量
-    total_count = db.query(models.Reservation).count()
-    result.append({"name": "总预约数", "total": total_count})
-    
-    return result
-
+    # 一次分组查询统计各状态的预约数量
+    counts = dict(
+        db.query(models.Reservation.status, func.count()).group_by(models.Reservation.status).all()
+    )
+    status = models.ReservationStatus
+    # 新预约直接是已预约（RESERVED），已确认包括已预约和已签到；待确认、已确认只出现在旧数据中
+    confirmed = sum(counts.get(s, 0) for s in (status.CONFIRMED, status.RESERVED, status.CHECKED_IN))
+    return [
+        {"name": "待确认预约", "total": counts.get(status.PENDING, 0)},
+        {"name": "已确认预约", "total": confirmed},
+        {"name": "已取消预约", "total": counts.get(status.CANCELLED, 0)},
+        {"name": "总预约数", "total": sum(counts.values())},
+    ]
 
 def is_admin(db: Session, user_id: int) -> bool:
     """
@@ -745,4 +1321,220 @@ def is_admin(db: Session, user_id: int) -> bool:
         如果用户是管理员返回True，否则返回False
     """
     user = db.query(models.User).filter(models.User.id == user_id).first()
-    return user is not None and user.is_admin 
\ No newline at end of file
+    return user is not None and user.is_admin 
+
+
+# ==================== 签到汇总相关操作 ====================
+
+# 会话中写入过预约变更事件时，session.info 中带有该标记
+RESERVATION_CHANGES_KEY = "reservation_changes"
+
+
+class ReservationChange(NamedTuple):
+    """一条预约状态变化，新建预约的 old_status 为 None"""
+    reservation_id: str
+    user_id: int
+    date: date_type
+    seat_id: int
+    time_slot_id: str
+    old_status: Optional[models.ReservationStatus]
+    new_status: Optional[models.ReservationStatus]
+
+
+def record_reservation_changes(db: Session, changes: List[ReservationChange]) -> None:
+    """
+    记录预约状态变化：在同一事务中写入变更事件表 reservation_events，
+    并增量更新签到汇总表（由调用方提交事务）
+    
+    Args:
+        db: 数据库会话
+        changes: 预约状态变化列表
+    """
+    if not changes:
+        return
+
+    # 提交后通知进程内的投影（如座位占用位图）读取新的变更事件
+    db.info[RESERVATION_CHANGES_KEY] = True
+    db.execute(insert(models.ReservationEvent), [
+        {
+            "reservation_id": change.reservation_id,
+            "user_id": change.user_id,
+            "date": change.date,
+            "seat_id": change.seat_id,
+            "time_slot_id": change.time_slot_id,
+            "old_status": change.old_status,
+            "new_status": change.new_status,
+            "created_at": datetime.now(),
+        }
+        for change in changes
+    ])
+
+    # 座位被删除后预约的 seat_id 为空，这些预约不计入任何房间的汇总
+    seat_ids = {int(change.seat_id) for change in changes if change.seat_id is not None}
+    seat_to_room = dict(
+        db.query(models.Seat.id, models.Seat.room_id).filter(models.Seat.id.in_(seat_ids)).all()
+    ) if seat_ids else {}
+
+    # 按 (日期, 房间, 时间段) 合并计数增量
+    deltas = {}
+    for change in changes:
+        if change.seat_id is None:
+            continue
+        room_id = seat_to_room.get(int(change.seat_id))
+        if room_id is None:
+            continue
+        old_status, new_status = change.old_status, change.new_status
+        delta = deltas.setdefault((change.date, room_id, change.time_slot_id), [0, 0, 0])
+        delta[0] += (new_status in models.RESERVATION_ACTIVE_STATUSES) - (old_status in models.RESERVATION_ACTIVE_STATUSES)
+        delta[1] += (new_status == models.ReservationStatus.CHECKED_IN) - (old_status == models.ReservationStatus.CHECKED_IN)
+        delta[2] += (new_status == models.ReservationStatus.CANCELLED) - (old_status == models.ReservationStatus.CANCELLED)
+    if not deltas:
+        return
+
+    rollup = models.CheckinRollup
+    stmt = sqlite_insert(rollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[rollup.date, rollup.room_id, rollup.time_slot_id],
+        set_={
+            "total": rollup.total + stmt.excluded.total,
+            "checked_in": rollup.checked_in + stmt.excluded.checked_in,
+            "cancelled": rollup.cancelled + stmt.excluded.cancelled,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    now = datetime.utcnow()
+    db.execute(stmt, [
+        {
+            "date": reservation_date,
+            "room_id": room_id,
+            "time_slot_id": time_slot_id,
+            "total": total,
+            "checked_in": checked_in,
+            "cancelled": cancelled,
+            "updated_at": now,
+        }
+        for (reservation_date, room_id, time_slot_id), (total, checked_in, cancelled) in deltas.items()
+    ])
+
+
+def rebuild_checkin_rollup(db: Session) -> int:
+    """
+    根据预约表和归档表全量重建签到汇总表
+    
+    Args:
+        db: 数据库会话
+        
+    Returns:
+        汇总表的行数
+    """
+    # 已归档的历史预约同样计入汇总
+    reservation = union_all(*(
+        select(model.date, model.seat_id, model.time_slot_id, model.status)
+        for model in (models.Reservation, models.ReservationArchive)
+    )).subquery().c
+    rollup = models.CheckinRollup
+    summary = (
+        select(
+            reservation.date,
+            models.Seat.room_id,
+            reservation.time_slot_id,
+            func.sum(case((reservation.status.in_(models.RESERVATION_ACTIVE_STATUSES), 1), else_=0)),
+            func.sum(case((reservation.status == models.ReservationStatus.CHECKED_IN, 1), else_=0)),
+            func.sum(case((reservation.status == models.ReservationStatus.CANCELLED, 1), else_=0)),
+            literal(datetime.utcnow()),
+        )
+        .join(models.Seat, models.Seat.id == reservation.seat_id)
+        .where(models.Seat.room_id.is_not(None), reservation.time_slot_id.is_not(None))
+        .group_by(reservation.date, models.Seat.room_id, reservation.time_slot_id)
+    )
+    db.query(rollup).delete()
+    db.execute(
+        insert(rollup).from_select(
+            ["date", "room_id", "time_slot_id", "total", "checked_in", "cancelled", "updated_at"],
+            summary,
+        )
+    )
+    db.commit()
+    return db.query(rollup).count()
+
+
+# ==================== 预约归档相关操作 ====================
+
+# reservations 与 reservation_archive 共有的字段
+ARCHIVE_COLUMNS = (
+    "id", "user_id", "seat_id", "date", "time_slot_id", "status", "rule_id", "version", "created_at", "updated_at",
+)
+
+
+def archive_reservations(db: Session, before: date_type) -> int:
+    """
+    将预约日期早于 before 的预约移入归档表，按 BULK_CHUNK_SIZE 分批，每批一个事务，
+    避免长时间持有写锁
+    
+    Args:
+        db: 数据库会话
+        before: 归档截止日期（不含）
+        
+    Returns:
+        归档的预约数
+    """
+    reservation = models.Reservation
+    archived = 0
+    while True:
+        ids = [
+            row.id for row in
+            db.query(reservation.id).filter(reservation.date < before).limit(BULK_CHUNK_SIZE)
+        ]
+        if not ids:
+            break
+        db.execute(
+            insert(models.ReservationArchive).from_select(
+                [*ARCHIVE_COLUMNS, "archive_month", "archived_at"],
+                select(
+                    *(getattr(reservation, column) for column in ARCHIVE_COLUMNS),
+                    func.strftime("%Y-%m", reservation.date),
+                    literal(datetime.utcnow()),
+                ).where(reservation.id.in_(ids)),
+            ).prefix_with("OR REPLACE")
+        )
+        db.execute(delete(reservation).where(reservation.id.in_(ids)))
+        db.commit()
+        archived += len(ids)
+    return archived
+
+
+# ==================== 预约变更事件相关操作 ====================
+
+def get_reservation_events(db: Session, after: int = 0, limit: int = 100) -> List[models.ReservationEvent]:
+    """
+    读取序号大于 after 的预约变更事件（按序号升序）
+    
+    Args:
+        db: 数据库会话
+        after: 已经处理到的事件序号
+        limit: 返回的最大记录数
+        
+    Returns:
+        事件对象列表
+    """
+    return db.query(models.ReservationEvent).filter(
+        models.ReservationEvent.seq > after
+    ).order_by(models.ReservationEvent.seq).limit(limit).all()
+
+
+def prune_reservation_events(db: Session, before: datetime) -> int:
+    """
+    删除 before 之前的变更事件
+    
+    Returns:
+        删除的事件数
+    """
+    event = models.ReservationEvent
+    # 序号与时间同向增长：找到第一个要保留的事件，删除它之前的所有事件（按主键范围删除）
+    first_kept = db.query(event.seq).filter(event.created_at >= before).order_by(event.seq).limit(1).scalar()
+    query = db.query(event)
+    if first_kept is not None:
+        query = query.filter(event.seq < first_kept)
+    deleted = query.delete(synchronize_session=False)
+    db.commit()
+    return deleted
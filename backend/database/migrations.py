@@ -0,0 +1,269 @@
+"""
+Schema migrations for the seat booking system.
+
+create_all 只会创建缺失的表，不会给已有的表补索引或字段，
+因此对已有数据库的结构变更都登记在这里，按版本号顺序执行，
+当前版本记录在 SQLite 的 PRAGMA user_version 中。
+"""
+import ast
+import json
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .connection import Base
+from .models import RESERVATION_STATUS_LABELS, ReservationStatus
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+# (版本号, 描述, 迁移函数)
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """
+    注册一个迁移函数
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def create_index(conn: Connection, table_name: str, index_name: str):
+    """
+    按模型中声明的索引定义创建索引（已存在则跳过）
+    """
+    table = Base.metadata.tables[table_name]
+    index = next(index for index in table.indexes if index.name == index_name)
+    index.create(bind=conn, checkfirst=True)
+
+
+def run_migrations(engine: Engine):
+    """
+    执行所有尚未执行的迁移
+    """
+    with engine.begin() as conn:
+        current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version <= current:
+                continue
+            logger.info("执行数据库迁移 %s: %s", version, description)
+            func(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+
+
+def stamp_migrations(engine: Engine):
+    """
+    将数据库标记为已执行全部迁移（用于刚由 create_all 建好的新数据库）
+    """
+    latest = max((m[0] for m in MIGRATIONS), default=0)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"PRAGMA user_version = {latest}")
+
+
+def has_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    """
+    检查表中是否已有某个字段
+    """
+    return any(column["name"] == column_name for column in inspect(conn).get_columns(table_name))
+
+
+def check_indexes(engine: Engine) -> list:
+    """
+    检查数据库中是否缺少模型声明的索引，缺少时输出警告
+
+    Returns:
+        缺少的索引名列表
+    """
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(
+            f"{table.name}.{index.name}"
+            for index in table.indexes
+            if index.name not in existing
+        )
+    if missing:
+        logger.warning("数据库缺少以下索引，相关查询会退化为全表扫描: %s", ", ".join(missing))
+    return missing
+
+
+# ==================== 迁移列表 ====================
+
+@migration(1, "reservations (created_at, id) 索引，用于游标分页")
+def add_reservation_created_at_index(conn: Connection):
+    create_index(conn, "reservations", "ix_reservations_created_at_id")
+
+
+@migration(2, "reservations (seat_id, date, time_slot_id) 有效预约唯一索引")
+def add_reservation_active_slot_unique_index(conn: Connection):
+    # 已有的重复预约只保留最早的一条，其余标记为已取消，否则唯一索引无法建立
+    # （此时状态仍是迁移 8 之前的中文名称）
+    active = "'待确认', '已确认', '已预约', '已签到'"
+    conn.exec_driver_sql(f"""
+        UPDATE reservations SET status = '已取消', updated_at = CURRENT_TIMESTAMP
+        WHERE status IN ({active}) AND EXISTS (
+            SELECT 1 FROM reservations AS earlier
+            WHERE earlier.seat_id = reservations.seat_id
+              AND earlier.date = reservations.date
+              AND earlier.time_slot_id = reservations.time_slot_id
+              AND earlier.status IN ({active})
+              AND (earlier.created_at < reservations.created_at
+                   OR (earlier.created_at = reservations.created_at AND earlier.id < reservations.id))
+        )
+    """)
+    create_index(conn, "reservations", "ux_reservations_active_seat_slot")
+
+
+@migration(3, "reservations 按用户查询的复合索引")
+def add_reservation_user_indexes(conn: Connection):
+    create_index(conn, "reservations", "ix_reservations_user_created")
+    create_index(conn, "reservations", "ix_reservations_user_date_status")
+
+
+@migration(4, "reservations (seat_id, date, status) 覆盖索引，用于签到统计")
+def add_reservation_seat_date_status_index(conn: Connection):
+    create_index(conn, "reservations", "ix_reservations_seat_date_status")
+
+
+@migration(5, "根据已有预约生成签到汇总表 checkin_rollups")
+def populate_checkin_rollup(conn: Connection):
+    crud.rebuild_checkin_rollup(Session(bind=conn))
+
+
+@migration(6, "reservations 增加 rule_id 字段，关联循环预约规则")
+def add_reservation_rule_id(conn: Connection):
+    if not has_column(conn, "reservations", "rule_id"):
+        conn.exec_driver_sql("ALTER TABLE reservations ADD COLUMN rule_id VARCHAR REFERENCES reservation_rules (id)")
+    create_index(conn, "reservations", "ix_reservations_rule_date")
+
+
+@migration(7, "reservations (status, date, time_slot_id) 索引，用于释放未签到预约")
+def add_reservation_status_date_index(conn: Connection):
+    create_index(conn, "reservations", "ix_reservations_status_date")
+
+
+def rebuild_reservation_status_table(conn: Connection, table_name: str):
+    """
+    重建表，把中文状态名称转换为整数状态码
+    SQLite 不支持修改字段类型，只能新建表、复制数据、删除旧表
+    """
+    inspector = inspect(conn)
+    if not inspector.has_table(table_name):
+        return
+    table = Base.metadata.tables[table_name]
+    existing = {column["name"] for column in inspector.get_columns(table_name)}
+    columns = [column.name for column in table.columns if column.name in existing]
+    legacy = f"{table_name}_legacy"
+
+    # 旧表的索引会和新表的索引重名，先删除
+    for index in inspector.get_indexes(table_name):
+        conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{index["name"]}"')
+    # 改名时不改写其他表中指向它的外键
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+    conn.exec_driver_sql(f'ALTER TABLE {table_name} RENAME TO {legacy}')
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+    table.create(bind=conn)
+
+    # 已经是整数的保留，未知的状态按已取消处理
+    status_case = "CASE WHEN typeof(status) = 'integer' THEN status {} ELSE {} END".format(
+        " ".join(f"WHEN status = '{label}' THEN {int(status)}" for status, label in RESERVATION_STATUS_LABELS.items()),
+        int(ReservationStatus.CANCELLED),
+    )
+    select_columns = ", ".join(status_case if column == "status" else column for column in columns)
+    conn.exec_driver_sql(
+        f'INSERT INTO {table_name} ({", ".join(columns)}) SELECT {select_columns} FROM {legacy}'
+    )
+    conn.exec_driver_sql(f"DROP TABLE {legacy}")
+
+
+@migration(8, "预约状态改为整数状态码")
+def convert_reservation_status_to_int(conn: Connection):
+    rebuild_reservation_status_table(conn, "reservations")
+    rebuild_reservation_status_table(conn, "reservation_archive")
+    # 之前的迁移按中文状态生成的汇总已经不准确，重新生成
+    crud.rebuild_checkin_rollup(Session(bind=conn))
+
+
+@migration(9, "reservations 增加 version 字段，用于乐观锁")
+def add_reservation_version(conn: Connection):
+    for table_name in ("reservations", "reservation_archive"):
+        if inspect(conn).has_table(table_name) and not has_column(conn, table_name, "version"):
+            conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+def parse_legacy_features(raw) -> list:
+    """
+    解析旧格式的座位特性 "['靠窗', '电源插座']"，已经是 JSON 的原样解析；
+    既不是列表也不是 JSON 的非空值（例如 "靠窗"）作为单个特性保留
+    """
+    if raw is None or not str(raw).strip():
+        return []
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            features = parse(raw)
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(features, (list, tuple)):
+            return [str(feature) for feature in features]
+        if isinstance(features, str):
+            return [features] if features.strip() else []
+    return [str(raw).strip()]
+
+
+@migration(11, "座位特性改为 JSON 数组存储")
+def convert_seat_features_to_json(conn: Connection):
+    # SQLite 的字段类型只是亲和性，原来的 VARCHAR 字段可以直接存 JSON 文本，只需转换数据
+    rows = conn.exec_driver_sql("SELECT id, features FROM seats").fetchall()
+    if rows:
+        conn.exec_driver_sql(
+            "UPDATE seats SET features = ? WHERE id = ?",
+            [(json.dumps(parse_legacy_features(raw), ensure_ascii=False), seat_id) for seat_id, raw in rows],
+        )
+
+
+@migration(12, "seats 增加座位图行列字段，按座位编号生成初始位置")
+def add_seat_grid_position(conn: Connection):
+    for column in ("grid_row", "grid_col"):
+        if not has_column(conn, "seats", column):
+            conn.exec_driver_sql(f"ALTER TABLE seats ADD COLUMN {column} INTEGER")
+    create_index(conn, "seats", "ix_seats_room_grid")
+
+    # 编号形如 "A1" 的按字母和数字定位，其余的座位（包括编号重复的）按编号顺序排在这些座位下方，每行 10 个
+    rows = conn.exec_driver_sql(
+        "SELECT id, room_id, seat_number FROM seats ORDER BY room_id, seat_number, id"
+    ).fetchall()
+    positions = {}
+    unplaced = {}
+    next_row = {}
+    taken = set()
+    for seat_id, room_id, seat_number in rows:
+        row, col = crud.seat_grid_position(seat_number)
+        if row is None or (room_id, row, col) in taken:
+            unplaced.setdefault(room_id, []).append(seat_id)
+        else:
+            positions[seat_id] = (row, col)
+            taken.add((room_id, row, col))
+            next_row[room_id] = max(next_row.get(room_id, 0), row + 1)
+    for room_id, seat_ids in unplaced.items():
+        first_row = next_row.get(room_id, 0)
+        for i, seat_id in enumerate(seat_ids):
+            positions[seat_id] = (first_row + i // 10, i % 10)
+    if positions:
+        conn.exec_driver_sql(
+            "UPDATE seats SET grid_row = ?, grid_col = ? WHERE id = ?",
+            [(row, col, seat_id) for seat_id, (row, col) in positions.items()],
+        )
+
+
+@migration(13, "删除 seats (is_available, room_id, id) 索引，可用座位改由内存位图计算")
+def drop_seat_available_room_index(conn: Connection):
+    # 原迁移 10 创建了该索引，已执行过的数据库需要删除；版本号 10 不再使用
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_seats_available_room")
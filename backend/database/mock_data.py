@@ -133,35 +133,35 @@ def create_mock_seats(db: Session):
         "seat_number": "A1",
         "room_id": 1,
         "is_available": 1,
-        "features": "['靠窗', '电源插座', '安静区']",
+        "features": ["靠窗", "电源插座", "安静区"],
         "description": "靠窗座位，采光良好"
     },
     {
         "seat_number": "B2",
         "room_id": 2,
         "is_available": 1,
-        "features": "['靠近书架', '电源插座']",
+        "features": ["靠近书架", "电源插座"],
         "description": "靠近计算机科学书架"
     },
     {
         "seat_number": "C3",
         "room_id": 1,
         "is_available": 0,
-        "features": "['靠窗', '大桌面']",
+        "features": ["靠窗", "大桌面"],
         "description": "三人小组讨论座位"
     },
     {
         "seat_number": "D4",
         "room_id": 2,
         "is_available": 2,
-        "features": "['隔间', '电源插座', '网络接口']",
+        "features": ["隔间", "电源插座", "网络接口"],
         "description": "独立隔间，适合长时间学习"
     },
     {
         "seat_number": "E5",
         "room_id": 1,
         "is_available":1,
-        "features": "['隔间', '电源插座']",
+        "features": ["隔间", "电源插座"],
         "description": "安静独立空间"
     }
     ]
@@ -282,7 +282,7 @@ def create_mock_reservations(db: Session):
                 seat_id=reservation["seatId"],
                 date=reservation["date"],
                 time_slot_id=reservation["timeSlotId"],
-                status=reservation["status"],
+                status=models.ReservationStatus.from_label(reservation["status"]),
                 created_at=reservation["createdAt"],
                 updated_at=reservation["updatedAt"]
             )
@@ -2,13 +2,86 @@
 Database models for the seat booking system.
 """
 from datetime import datetime
+import enum
 import uuid
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Date, Index, JSON, text
+from sqlalchemy.orm import relationship, validates
+from sqlalchemy.types import TypeDecorator
 
 from .connection import Base
 
 
+class ReservationStatus(enum.IntEnum):
+    """预约状态：数据库中存整数，接口返回中文名称（label）"""
+    PENDING = 0      # 待确认
+    CONFIRMED = 1    # 已确认
+    RESERVED = 2     # 已预约
+    CHECKED_IN = 3   # 已签到
+    CANCELLED = 4    # 已取消
+
+    @property
+    def label(self) -> str:
+        return RESERVATION_STATUS_LABELS[self]
+
+    @classmethod
+    def from_label(cls, label: str) -> "ReservationStatus":
+        for status, status_label in RESERVATION_STATUS_LABELS.items():
+            if status_label == label:
+                return status
+        raise ValueError(f"未知的预约状态: {label}")
+
+
+RESERVATION_STATUS_LABELS = {
+    ReservationStatus.PENDING: "待确认",
+    ReservationStatus.CONFIRMED: "已确认",
+    ReservationStatus.RESERVED: "已预约",
+    ReservationStatus.CHECKED_IN: "已签到",
+    ReservationStatus.CANCELLED: "已取消",
+}
+
+# 允许的状态转换，所有修改预约状态的地方都按这张表检查
+RESERVATION_TRANSITIONS = {
+    ReservationStatus.PENDING: (ReservationStatus.CONFIRMED, ReservationStatus.RESERVED, ReservationStatus.CANCELLED),
+    ReservationStatus.CONFIRMED: (ReservationStatus.RESERVED, ReservationStatus.CANCELLED),
+    ReservationStatus.RESERVED: (ReservationStatus.CHECKED_IN, ReservationStatus.CANCELLED),
+    ReservationStatus.CHECKED_IN: (),
+    ReservationStatus.CANCELLED: (),
+}
+
+
+def can_transition(old: ReservationStatus, new: ReservationStatus) -> bool:
+    """
+    检查预约状态能否从 old 变为 new
+    """
+    return new in RESERVATION_TRANSITIONS[old]
+
+
+def transition_sources(new: ReservationStatus) -> tuple:
+    """
+    可以变为 new 的状态，用于批量 UPDATE 的 WHERE 条件
+    """
+    return tuple(old for old, targets in RESERVATION_TRANSITIONS.items() if new in targets)
+
+
+# 占用座位的预约状态（已取消的预约不占用座位）
+RESERVATION_ACTIVE_STATUSES = (
+    ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.RESERVED, ReservationStatus.CHECKED_IN,
+)
+# 可以取消的预约状态
+RESERVATION_CANCELLABLE_STATUSES = transition_sources(ReservationStatus.CANCELLED)
+
+
+class ReservationStatusType(TypeDecorator):
+    """预约状态列：存为整数，读取为 ReservationStatus"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else int(ReservationStatus(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else ReservationStatus(value)
+
 class User(Base):
     """用户模型"""
     __tablename__ = "users"
@@ -53,8 +126,10 @@ class Seat(Base):
     room_id = Column(Integer, ForeignKey("rooms.id"))
     seat_number = Column(String, index=True)
     is_available = Column(Integer, default=1) # 1表示可用，0表示维护中
-    features = Column(String)  # 例如："靠窗"
+    features = Column(JSON, default=list)  # 例如：["靠窗", "电源插座"]
     description = Column(String, nullable=True)
+    grid_row = Column(Integer, nullable=True)  # 座位图中的行号，从 0 开始
+    grid_col = Column(Integer, nullable=True)  # 座位图中的列号，从 0 开始
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -65,6 +140,11 @@ class Seat(Base):
     # 关系：一个座位可以有多个预约
     reservations = relationship("Reservation", back_populates="seat")
 
+    __table_args__ = (
+        # 房间座位图：按房间过滤并按行列排序
+        Index("ix_seats_room_grid", "room_id", "grid_row", "grid_col", "id"),
+    )
+
 
 class Booking(Base):
     """预订模型"""
@@ -111,7 +191,10 @@ class Reservation(Base):
     seat_id = Column(Integer, ForeignKey("seats.id"))
     date = Column(Date, nullable=False)           # 预约日期
     time_slot_id = Column(String, ForeignKey("time_slots.id"))
-    status = Column(String, default="待确认")     # 待确认, 已确认, 已取消
+    status = Column(ReservationStatusType, nullable=False, default=ReservationStatus.PENDING)
+    rule_id = Column(String, ForeignKey("reservation_rules.id"), nullable=True)  # 由循环规则生成时的规则ID
+    # 乐观锁版本号，每次修改加一；UPDATE 带上 version 条件，并发修改时只有一个能成功
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -120,4 +203,143 @@ class Reservation(Base):
     # 关系：一个预约属于一个座位
     seat = relationship("Seat", back_populates="reservations")
     # 关系：一个预约属于一个时间段
-    time_slot = relationship("TimeSlot", back_populates="reservations") 
\ No newline at end of file
+    time_slot = relationship("TimeSlot", back_populates="reservations")
+
+    @validates("status")
+    def validate_status(self, key, status):
+        status = ReservationStatus(status)
+        if self.status is not None and status != self.status and not can_transition(self.status, status):
+            raise ValueError(f"预约状态不允许从{self.status.label}变为{status.label}")
+        return status
+
+    __mapper_args__ = {"version_id_col": version}
+
+    __table_args__ = (
+        # 游标分页按 (created_at, id) 排序
+        Index("ix_reservations_created_at_id", "created_at", "id"),
+        # 用户预约列表 (/user, /recent)：按用户过滤并按创建时间倒序
+        Index("ix_reservations_user_created", user_id, created_at.desc(), id.desc()),
+        # 今日可签到 (/today-checkin)：按用户、日期、状态过滤
+        Index("ix_reservations_user_date_status", "user_id", "date", "status"),
+        # 签到统计：按座位关联、按日期范围过滤，只读索引即可完成聚合
+        Index("ix_reservations_seat_date_status", "seat_id", "date", "status"),
+        # 停用循环规则时查找其未来的预约
+        Index("ix_reservations_rule_date", "rule_id", "date"),
+        # 释放未签到预约：按状态等值 + 日期范围扫描，已处理过的行不会再被扫到
+        Index("ix_reservations_status_date", "status", "date", "time_slot_id"),
+        # 同一座位同一天同一时间段只能有一个有效预约
+        Index(
+            "ux_reservations_active_seat_slot",
+            "seat_id", "date", "time_slot_id",
+            unique=True,
+            sqlite_where=text(
+                "status IN ({})".format(", ".join(str(int(status)) for status in RESERVATION_ACTIVE_STATUSES))
+            ),
+        ),
+    )
+
+
+
+class ReservationArchive(Base):
+    """已归档的历史预约，字段与 reservations 相同，按归档月份 archive_month 分区"""
+    __tablename__ = "reservation_archive"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer)
+    seat_id = Column(Integer)
+    date = Column(Date, nullable=False)
+    time_slot_id = Column(String)
+    status = Column(ReservationStatusType)
+    rule_id = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archive_month = Column(String, nullable=False)  # 预约日期所在月份，例如："2025-03"
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # 按月份整体查询或清理一个分区
+        Index("ix_reservation_archive_month", "archive_month", "date"),
+        # 用户历史预约：与 reservations 的 ix_reservations_user_created 相同
+        Index("ix_reservation_archive_user_created", user_id, created_at.desc(), id.desc()),
+    )
+
+
+class ReservationRule(Base):
+    """循环预约规则模型，按滚动窗口逐步展开为预约"""
+    __tablename__ = "reservation_rules"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    seat_id = Column(Integer, ForeignKey("seats.id"))
+    time_slot_id = Column(String, ForeignKey("time_slots.id"))
+    weekdays = Column(String, nullable=False)          # 例如："0,1,2,3,4"（0表示周一）
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    materialized_until = Column(Date, nullable=True)   # 已展开到的日期
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 定时任务查找需要继续展开的规则
+        Index("ix_reservation_rules_active_materialized", "is_active", "materialized_until"),
+    )
+
+    @property
+    def weekday_list(self):
+        return [int(day) for day in self.weekdays.split(",") if day != ""]
+
+
+class CheckinRollup(Base):
+    """签到汇总模型，按 (日期, 房间, 时间段) 增量维护"""
+    __tablename__ = "checkin_rollups"
+
+    date = Column(Date, primary_key=True)
+    room_id = Column(Integer, ForeignKey("rooms.id"), primary_key=True)
+    time_slot_id = Column(String, ForeignKey("time_slots.id"), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)       # 有效预约数（不含已取消）
+    checked_in = Column(Integer, nullable=False, default=0)  # 已签到数
+    cancelled = Column(Integer, nullable=False, default=0)   # 已取消数
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class WaitlistEntry(Base):
+    """候补模型：座位被取消或释放时按登记顺序自动分配给候补用户"""
+    __tablename__ = "waitlist_entries"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(Integer, ForeignKey("users.id"))
+    date = Column(Date, nullable=False)
+    time_slot_id = Column(String, ForeignKey("time_slots.id"))
+    room_id = Column(Integer, ForeignKey("rooms.id"), nullable=True)  # 为空表示任意房间
+    feature = Column(String, nullable=True)                           # 为空表示不要求座位特性
+    status = Column(String, default="等待中")     # 等待中, 已分配, 已取消
+    reservation_id = Column(String, ForeignKey("reservations.id"), nullable=True)  # 分配到的预约
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 队列：同一 (日期, 时间段) 中等待的候补按登记顺序取出，索引查找而不是扫描
+        Index("ix_waitlist_queue", "date", "time_slot_id", "status", "created_at", "id"),
+        # 用户的候补列表
+        Index("ix_waitlist_user_created", "user_id", "created_at"),
+    )
+
+
+class ReservationEvent(Base):
+    """预约变更事件（outbox），与预约的修改在同一事务中写入，只追加不修改"""
+    __tablename__ = "reservation_events"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)  # 事件序号，单调递增
+    reservation_id = Column(String, nullable=False)
+    user_id = Column(Integer)
+    date = Column(Date, nullable=False)
+    seat_id = Column(Integer)
+    time_slot_id = Column(String)
+    old_status = Column(ReservationStatusType, nullable=True)  # 新建预约时为空
+    new_status = Column(ReservationStatusType, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # 删除旧事件后序号也不会被重新使用
+    __table_args__ = {"sqlite_autoincrement": True}
@@ -0,0 +1,57 @@
+"""
+Keyset (cursor) pagination helpers.
+
+游标是最后一条记录 (created_at, id) 的不透明编码，下一页从该位置之后继续，
+不需要像 offset 那样重新扫描跳过的行。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    """
+    将 (created_at, id) 编码为游标字符串
+    """
+    raw = json.dumps([created_at.isoformat(), id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    解析游标字符串
+
+    Raises:
+        ValueError: 如果游标格式不正确
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), str(id)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("无效的分页游标") from exc
+
+
+def keyset_page(query, created_at_column, id_column, cursor: Optional[str], limit: int):
+    """
+    按 (created_at, id) 降序取一页数据
+
+    Returns:
+        (当前页的行, 下一页游标；没有下一页时为 None)
+    """
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_at_column, id_column) < tuple_(created_at, id))
+    rows = (
+        query.order_by(created_at_column.desc(), id_column.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
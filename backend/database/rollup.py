@@ -0,0 +1,27 @@
+"""
+重建签到汇总表（checkin_rollups）
+
+汇总表平时随预约的创建、取消、签到增量更新，
+数据不一致时（例如手动修改过预约表）在 backend 路径下执行：
+
+    python -m database.rollup
+"""
+from . import create_tables, crud
+from .connection import SessionLocal
+
+
+def rebuild():
+    """
+    全量重建签到汇总表
+    """
+    create_tables()
+    db = SessionLocal()
+    try:
+        rows = crud.rebuild_checkin_rollup(db)
+        print(f"签到汇总表已重建，共 {rows} 行")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    rebuild()
@@ -178,6 +178,12 @@ class ReservationCreate(BaseModel):
     date: date
     timeSlotId: str
 
+    @field_validator('seatId')
+    def validate_seat_id(cls, v):
+        if not v.isdigit():
+            raise ValueError("座位ID必须为数字")
+        return v
+
 
 class ReservationResponse(BaseModel):
     """预约响应模型"""
@@ -188,7 +194,8 @@ class ReservationResponse(BaseModel):
     userId: str
     date: str
     timeSlot: str
-    status: str  # "待确认" | "已确认" | "已取消"
+    status: str  # 状态名称："待确认" | "已确认" | "已预约" | "已签到" | "已取消"
+    version: Optional[int] = None  # 版本号，取消或签到时可带上，数据已变化时返回 409
     createdAt: datetime
     updatedAt: datetime
     
@@ -202,6 +209,109 @@ class ReservationDetailResponse(ReservationResponse):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ReservationBatchCreate(BaseModel):
+    """批量创建预约模型"""
+    items: List[ReservationCreate] = Field(..., min_length=1, max_length=100)
+
+
+class ReservationBatchItemResult(BaseModel):
+    """批量创建中单个预约的结果"""
+    index: int                     # 在请求 items 中的位置
+    result: str                    # "created" | "conflict" | "duplicate" | "not_found"
+    reservation: Optional[ReservationResponse] = None
+    detail: Optional[str] = None
+
+
+class ReservationBatchResponse(BaseModel):
+    """批量创建预约响应模型"""
+    created: int
+    results: List[ReservationBatchItemResult]
+
+
+class ReservationBatchCheckin(BaseModel):
+    """批量签到模型"""
+    ids: List[str] = Field(..., min_length=1, max_length=200)
+
+
+class ReservationCheckinResult(BaseModel):
+    """批量签到中单个预约的结果"""
+    id: str
+    result: str                   # "checked_in" | "not_found" | "forbidden" | "invalid_status" | "conflict"
+    status: Optional[str] = None  # 预约当前状态
+    detail: Optional[str] = None
+
+
+class ReservationBatchCheckinResponse(BaseModel):
+    """批量签到响应模型"""
+    checkedIn: int
+    results: List[ReservationCheckinResult]
+
+
+class BookingTicketResponse(BaseModel):
+    """抢座模式排队凭证响应模型"""
+    ticketId: str
+    status: str  # "queued" | "created" | "conflict" | "failed"
+    reservation: Optional[ReservationResponse] = None  # 创建成功时的预约
+    detail: Optional[str] = None
+
+
+class ReservationRuleCreate(BaseModel):
+    """创建循环预约规则模型"""
+    seatId: str
+    timeSlotId: str
+    weekdays: List[int] = Field(..., min_length=1)  # 0表示周一，6表示周日
+    startDate: date
+    endDate: date
+
+    @field_validator('seatId')
+    def validate_seat_id(cls, v):
+        if not v.isdigit():
+            raise ValueError("座位ID必须为数字")
+        return v
+
+    @field_validator('weekdays')
+    def validate_weekdays(cls, v):
+        if any(day < 0 or day > 6 for day in v):
+            raise ValueError("星期必须在0-6之间")
+        return v
+
+    @field_validator('endDate')
+    def validate_end_date(cls, v, info):
+        start_date = info.data.get('startDate')
+        if start_date and v < start_date:
+            raise ValueError("结束日期不能早于开始日期")
+        if start_date and (v - start_date).days > 366:
+            raise ValueError("循环预约最长为一年")
+        return v
+
+
+class ReservationRuleResponse(BaseModel):
+    """循环预约规则响应模型"""
+    id: str
+    seatId: str
+    timeSlotId: str
+    weekdays: List[int]
+    startDate: date
+    endDate: date
+    materializedUntil: Optional[date] = None
+    isActive: bool
+    createdAt: datetime
+
+
+class ReservationRuleResult(BaseModel):
+    """创建或停用循环预约规则的结果"""
+    rule: ReservationRuleResponse
+    created: int = 0    # 本次展开新建的预约数
+    conflicts: int = 0  # 因冲突跳过的日期数
+    cancelled: int = 0  # 停用时取消的预约数
+
+
+class ReservationPage(BaseModel):
+    """预约分页响应模型"""
+    items: List[ReservationResponse]
+    next_cursor: Optional[str] = None  # 没有下一页时为 None
+
+
 class ReservationStatItem(BaseModel):
     """预约统计项模型"""
     name: str
@@ -210,6 +320,49 @@ class ReservationStatItem(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ReservationEventResponse(BaseModel):
+    """预约变更事件响应模型"""
+    seq: int
+    reservationId: str
+    userId: Optional[str] = None
+    seatId: Optional[str] = None
+    date: date
+    timeSlotId: Optional[str] = None
+    oldStatus: Optional[str] = None  # 新建预约时为空
+    newStatus: str
+    createdAt: datetime
+
+
+class ReservationEventPage(BaseModel):
+    """预约变更事件分页响应模型"""
+    items: List[ReservationEventResponse]
+    lastSeq: int  # 下次读取时作为 after 传入
+
+
+# ==================== 候补相关模型 ====================
+
+class WaitlistCreate(BaseModel):
+    """登记候补模型"""
+    date: date
+    timeSlotId: str
+    roomId: Optional[int] = None    # 为空表示任意房间
+    feature: Optional[str] = None   # 为空表示不要求座位特性
+
+
+class WaitlistEntryResponse(BaseModel):
+    """候补响应模型"""
+    id: str
+    userId: str
+    date: date
+    timeSlotId: str
+    roomId: Optional[int] = None
+    feature: Optional[str] = None
+    status: str
+    reservationId: Optional[str] = None  # 已分配时的预约ID
+    createdAt: datetime
+    updatedAt: datetime
+
+
 # ==================== 时间段相关模型 ====================
 
 class TimeSlotBase(BaseModel):
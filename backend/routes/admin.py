@@ -1,15 +1,23 @@
 """
 Admin routes for the seat booking system.
 """
-from typing import Dict, Any
-from fastapi import APIRouter, Depends
+import csv
+import io
+import json
+from typing import Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
-from database.connection import get_db
+from sqlalchemy import func, case, select, union_all
+from database.connection import get_db, SessionLocal
+from database import crud
+from database.schemas import ReservationEventPage
+from services.occupancy import occupancy_index
 from auth.dependencies import get_current_user_id
 from mock_data.data import MOCK_SEATS, MOCK_USERS_LIST, MOCK_CHECKIN_STATS
 import database.models as models   
-from datetime import date
+from datetime import date, timedelta
+from settings import settings
 
 router = APIRouter()
 
@@ -34,24 +42,234 @@ async def get_dashboard_stats(
     # 从签到统计数据中计算总体签到率
     # 获取当前日期（UTC时间）
     today = date.today()
-    # 查询今日预约统计
+    # 查询今日预约统计（读取签到汇总表，每个房间和时间段一行）
     stats = db.query(
-        func.count(models.Reservation.id).label("total_reservations"),
-        func.coalesce(func.sum(
-            case(
-                (models.Reservation.status == "已签到", 1),
-                else_=0
-            )
-        ), 0).label("total_checkins")
-    ).filter(models.Reservation.date == today).first()
+        func.coalesce(func.sum(models.CheckinRollup.total), 0).label("total_reservations"),
+        func.coalesce(func.sum(models.CheckinRollup.checked_in), 0).label("total_checkins"),
+    ).filter(models.CheckinRollup.date == today).first()
     total_reservations = stats.total_reservations if stats else 0
     total_checkins = stats.total_checkins if stats else 0
     # 计算签到率百分比
     checkin_rate = 0
     if total_reservations > 0:
         checkin_rate = round((total_checkins / total_reservations) * 100)
+    # 今天任一时间段有有效预约的座位数（由占用位图按位或得到）
+    today_reserved_seats = bin(occupancy_index.occupied_any_slot(db, today)).count("1")
     return {
         "totalSeats": total_seats,
         "totalUsers": total_users,
-        "todayCheckinRate": checkin_rate
+        "todayCheckinRate": checkin_rate,
+        "todayReservedSeats": today_reserved_seats,
     }
+
+
+@router.post("/checkin-rollup/rebuild", response_model=Dict[str, Any])
+async def rebuild_checkin_rollup(
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    根据预约表全量重建签到汇总表
+    """
+    if not crud.is_admin(db, current_user_id):
+        raise HTTPException(status_code=403, detail="仅管理员可以重建签到汇总表")
+
+    rows = crud.rebuild_checkin_rollup(db)
+    return {"rows": rows}
+
+
+@router.get("/occupancy/check", response_model=Dict[str, Any])
+async def check_occupancy_index(
+    repair: bool = False,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    比对座位占用位图与数据库中的有效预约，repair 为 true 且不一致时重新加载
+    """
+    if not crud.is_admin(db, current_user_id):
+        raise HTTPException(status_code=403, detail="仅管理员可以检查座位占用索引")
+
+    mismatches = occupancy_index.check(db)
+    repaired = False
+    if mismatches and repair:
+        occupancy_index.load(db)
+        repaired = True
+    return {"consistent": not mismatches, "mismatches": mismatches, "repaired": repaired}
+
+
+@router.post("/reservations/archive", response_model=Dict[str, Any])
+async def archive_reservations(
+    days: int = Query(settings.ARCHIVE_AFTER_DAYS, ge=1),
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    将 days 天之前的预约移入归档表
+    """
+    if not crud.is_admin(db, current_user_id):
+        raise HTTPException(status_code=403, detail="仅管理员可以归档预约")
+
+    rows = crud.archive_reservations(db, date.today() - timedelta(days=days))
+    return {"archived": rows}
+
+
+@router.get("/reservations/events", response_model=ReservationEventPage)
+async def get_reservation_events(
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    读取序号大于 after 的预约变更事件，下游按 lastSeq 继续增量读取
+    """
+    if not crud.is_admin(db, current_user_id):
+        raise HTTPException(status_code=403, detail="仅管理员可以读取预约变更事件")
+
+    events = crud.get_reservation_events(db, after, limit)
+    items = [
+        {
+            "seq": event.seq,
+            "reservationId": event.reservation_id,
+            "userId": str(event.user_id) if event.user_id is not None else None,
+            "seatId": str(event.seat_id) if event.seat_id is not None else None,
+            "date": event.date,
+            "timeSlotId": event.time_slot_id,
+            "oldStatus": event.old_status.label if event.old_status is not None else None,
+            "newStatus": event.new_status.label,
+            "createdAt": event.created_at,
+        }
+        for event in events
+    ]
+    return {"items": items, "lastSeq": events[-1].seq if events else after}
+
+
+# 导出时每页读取的行数，内存占用与总行数无关
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FIELDS = [
+    "id", "userId", "date", "timeSlot", "room", "location", "seatNumber", "status", "createdAt", "updatedAt",
+]
+
+
+def reservation_export_query(date_from: Optional[date], date_to: Optional[date], after_id: Optional[str] = None):
+    """
+    导出查询：预约（查询旧日期时合并归档表）关联座位、房间、时间段名称，只取需要的列
+
+    按预约ID分页，返回 ID 大于 after_id 的前 EXPORT_BATCH_SIZE 行。归档时预约ID不变，
+    所以两张表合并后 ID 仍然唯一。
+    """
+    archived_before = date.today() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    sources = [models.Reservation]
+    if date_from is None or date_from < archived_before:
+        sources.append(models.ReservationArchive)
+    selects = []
+    for model in sources:
+        stmt = select(
+            model.id, model.user_id, model.seat_id, model.date, model.time_slot_id,
+            model.status, model.created_at, model.updated_at,
+        )
+        if date_from is not None:
+            stmt = stmt.where(model.date >= date_from)
+        if date_to is not None:
+            stmt = stmt.where(model.date <= date_to)
+        if after_id is not None:
+            stmt = stmt.where(model.id > after_id)
+        # 每张表按主键顺序只取一页，合并后再取一页
+        selects.append(stmt.order_by(model.id).limit(EXPORT_BATCH_SIZE))
+    if len(selects) > 1:
+        reservation = union_all(*(select(stmt.subquery()) for stmt in selects)).subquery().c
+    else:
+        reservation = selects[0].subquery().c
+
+    return (
+        select(
+            reservation.id, reservation.user_id, reservation.date,
+            models.TimeSlot.start_time, models.TimeSlot.end_time,
+            models.Room.name, models.Room.location, models.Seat.seat_number,
+            reservation.status, reservation.created_at, reservation.updated_at,
+        )
+        .outerjoin(models.Seat, models.Seat.id == reservation.seat_id)
+        .outerjoin(models.Room, models.Room.id == models.Seat.room_id)
+        .outerjoin(models.TimeSlot, models.TimeSlot.id == reservation.time_slot_id)
+        .order_by(reservation.id)
+        .limit(EXPORT_BATCH_SIZE)
+    )
+
+
+def structure_export_row(row):
+    return {
+        "id": row.id,
+        "userId": str(row.user_id),
+        "date": row.date.isoformat(),
+        "timeSlot": f"{row.start_time}-{row.end_time}" if row.start_time else "",
+        "room": row.name or "",
+        "location": row.location or "",
+        "seatNumber": row.seat_number or "",
+        "status": row.status.label,
+        "createdAt": row.created_at.isoformat() if row.created_at else "",
+        "updatedAt": row.updated_at.isoformat() if row.updated_at else "",
+    }
+
+
+def stream_reservation_export(date_from: Optional[date], date_to: Optional[date], export_format: str):
+    """
+    按页读取并输出，每页输出一次
+
+    每页在独立的短事务中读取，输出期间不持有数据库连接：SQLite 读事务持有的共享锁
+    会阻塞其他请求提交，导出很慢（客户端下载慢）时也不能影响预约写入
+    """
+    if export_format == "csv":
+        # 带 BOM，Excel 才能正确识别 UTF-8 中文
+        buffer = io.StringIO()
+        buffer.write("\ufeff")
+        csv.writer(buffer).writerow(EXPORT_FIELDS)
+        yield buffer.getvalue()
+    after_id = None
+    while True:
+        # 请求的数据库会话在响应开始前就会关闭，导出使用独立的会话
+        db = SessionLocal()
+        try:
+            rows = db.execute(reservation_export_query(date_from, date_to, after_id)).all()
+        finally:
+            db.close()
+        if not rows:
+            break
+        buffer = io.StringIO()
+        if export_format == "csv":
+            writer = csv.writer(buffer)
+            writer.writerows(structure_export_row(row).values() for row in rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(structure_export_row(row), ensure_ascii=False))
+                buffer.write("\n")
+        yield buffer.getvalue()
+        if len(rows) < EXPORT_BATCH_SIZE:
+            break
+        after_id = rows[-1].id
+
+
+@router.get("/reservations/export")
+async def export_reservations(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    流式导出预约（CSV 或 NDJSON），内存占用与导出行数无关
+    """
+    if not crud.is_admin(db, current_user_id):
+        raise HTTPException(status_code=403, detail="仅管理员可以导出预约")
+
+    if export_format == "csv":
+        media_type, filename = "text/csv; charset=utf-8", "reservations.csv"
+    else:
+        media_type, filename = "application/x-ndjson", "reservations.ndjson"
+    return StreamingResponse(
+        stream_reservation_export(date_from, date_to, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
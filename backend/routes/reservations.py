@@ -3,177 +3,200 @@ Reservation routes for the seat booking system.
 """
 
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Header
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, and_, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime, timedelta, date
+from contextlib import contextmanager
+import asyncio
+import uuid
 
 from database.connection import get_db
 from database import crud
+from database.pagination import keyset_page
 from database.schemas import (
+    BookingTicketResponse,
     ReservationCreate,
+    ReservationBatchCreate,
+    ReservationBatchResponse,
+    ReservationBatchCheckin,
+    ReservationBatchCheckinResponse,
     ReservationResponse,
     ReservationDetailResponse,
+    ReservationPage,
+    ReservationRuleCreate,
+    ReservationRuleResponse,
+    ReservationRuleResult,
     ReservationStatItem,
 )
 from auth.dependencies import get_current_user_id
 from mock_data.data import MOCK_RESERVATIONS, MOCK_RESERVATION_STATS, MOCK_CHECKIN_STATS
+from services.booking_queue import booking_queue, BookingQueueFull
+from services.idempotency import idempotency_store
+from services.reference_cache import reference_cache
+from settings import settings
 
 from database import models
 
 router = APIRouter()
 
 
-@router.get("/user", response_model=List[ReservationResponse])
-async def get_user_reservations(
-    current_user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)
-):
+def reservation_rows_query(db: Session):
     """
-    获取当前用户的所有预约
+    预约列表查询：只取 ReservationResponse 需要的列
     """
-    print("🌳 def get_user_reservations")
-
-    # 返回模拟数据
-    # 查询数据库中的预约数据
-    reservations_current_user = (
-        db.query(models.Reservation)
-        .filter(models.Reservation.user_id == current_user_id)
-        .all()
+    return db.query(
+        models.Reservation.id,
+        models.Reservation.seat_id,
+        models.Reservation.user_id,
+        models.Reservation.date,
+        models.Reservation.time_slot_id,
+        models.Reservation.status,
+        models.Reservation.version,
+        models.Reservation.created_at,
+        models.Reservation.updated_at,
     )
-    print(reservations_current_user[0] if len(reservations_current_user) > 0 else None)
 
-    start_time = [
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in reservations_current_user
-    ]
 
-    end_time = [
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in reservations_current_user
-    ]
+def structure_reservation_data(db: Session, reservation):
+    # 座位号、位置、时间段通过进程内缓存查找，不再逐行查询
+    reference_cache.ensure(db, reservation.seat_id, reservation.time_slot_id)
+    return {
+        "id": reservation.id,
+        "seatId": str(reservation.seat_id),
+        "seatNumber": reference_cache.seat_number(reservation.seat_id),
+        "location": reference_cache.location(reservation.seat_id),
+        "userId": str(reservation.user_id),
+        "date": reservation.date.strftime("%Y-%m-%d"),
+        "timeSlot": reference_cache.time_slot(reservation.time_slot_id),
+        "status": reservation.status.label,
+        "version": reservation.version,
+        "createdAt": reservation.created_at,
+        "updatedAt": reservation.updated_at,
+    }
 
-    seats = [
-        db.query(models.Seat).filter(models.Seat.id == reservation.seat_id).first()
-        for reservation in reservations_current_user
-    ]
 
-    rooms = [
-        db.query(models.Room).filter(models.Room.id == seat.room_id).first()
-        for seat in seats
-    ]
+def reservation_page(
+    db: Session,
+    query,
+    cursor: Optional[str],
+    limit: int,
+    created_at_column=models.Reservation.created_at,
+    id_column=models.Reservation.id,
+):
+    """
+    对预约查询按 (created_at, id) 降序做游标分页
+    """
+    try:
+        rows, next_cursor = keyset_page(query, created_at_column, id_column, cursor, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {
+        "items": [structure_reservation_data(db, row) for row in rows],
+        "next_cursor": next_cursor,
+    }
 
-    response_data = [
-        {
-            "id": reservation.id,
-            "seatId": str(reservation.seat_id),
-            "seatNumber": f"{seat.seat_number}",  # 模拟座位号
-            "location": f"{room.name}({room.location})",  # 模拟位置
-            "userId": str(reservation.user_id),
-            "date": reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-            # "timeSlot": (
-            #     f"{reservation.time_slot_id}:00-{int(reservation.time_slot_id)+1}:00"
-            #     if reservation.time_slot_id.isdigit()
-            #     else "09:00-10:00"
-            # ),
-            "timeSlot": f"{st[0]}-{et[0]}",
-            "status": reservation.status,
-            "createdAt": datetime.fromisoformat(reservation.created_at.isoformat()),
-            "updatedAt": datetime.fromisoformat(reservation.updated_at.isoformat()),
-        }
-        for st, et, seat, room, reservation in zip(
-            start_time, end_time, seats, rooms, reservations_current_user
-        )
-    ]
 
-    return response_data
-    # return [r for r in MOCK_RESERVATIONS if r["userId"] == str(current_user_id)]
+def reservation_history_rows(db: Session, user_id, date_from: Optional[date], date_to: Optional[date]):
+    """
+    用户的预约与归档预约合并查询（UNION ALL），日期条件下推到两张表各自的查询中
 
+    Returns:
+        (查询, created_at 列, id 列)
+    """
+    selects = []
+    for model in (models.Reservation, models.ReservationArchive):
+        stmt = select(
+            model.id, model.seat_id, model.user_id, model.date, model.time_slot_id,
+            model.status, model.version, model.created_at, model.updated_at,
+        ).where(model.user_id == user_id)
+        if date_from is not None:
+            stmt = stmt.where(model.date >= date_from)
+        if date_to is not None:
+            stmt = stmt.where(model.date <= date_to)
+        selects.append(stmt)
+    history = union_all(*selects).subquery()
+    return db.query(history), history.c.created_at, history.c.id
 
-@router.get("/recent", response_model=List[ReservationResponse])
-async def get_recent_reservations(
-    limit: int = 5,
-    current_user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_db),
-):
+
+VERSION_CONFLICT_DETAIL = "预约已被其他操作修改，请刷新后重试"
+
+
+def check_reservation_version(reservation, version: Optional[int]):
     """
-    获取用户最近的预约
+    客户端带了版本号时，与当前版本不一致说明它看到的是旧数据
     """
+    if version is not None and version != reservation.version:
+        raise HTTPException(status_code=409, detail=VERSION_CONFLICT_DETAIL)
 
-    sorted_reservations = (
-        db.query(models.Reservation)
-        .filter(models.Reservation.user_id == current_user_id)
-        .order_by(models.Reservation.created_at.desc())
-        .limit(limit)
-        .all()
-    )
 
-    start_time = [
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in sorted_reservations
-    ]
+@contextmanager
+def reservation_version_guard(db: Session):
+    """
+    包住对单个预约的修改：UPDATE 带 version 条件，读取之后被并发请求修改过时返回 409
+    提交之前的 flush（例如分配候补时）也可能发现冲突，所以要包住整个修改过程
+    """
+    try:
+        yield
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=VERSION_CONFLICT_DETAIL)
 
-    end_time = [
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in sorted_reservations
-    ]
 
-    seats = [
-        db.query(models.Seat).filter(models.Seat.id == reservation.seat_id).first()
-        for reservation in sorted_reservations
-    ]
+def commit_reservation_change(db: Session):
+    """
+    提交对单个预约的修改，读取之后被并发请求修改过时返回 409
+    """
+    with reservation_version_guard(db):
+        db.commit()
 
-    rooms = [
-        db.query(models.Room).filter(models.Room.id == seat.room_id).first()
-        for seat in seats
-    ]
 
-    # print(sorted_reservations)
-    # reservation = sorted_reservations[0]
-    # 转换为符合 ReservationResponse 的格式
-    response_data = [
-        {
-            "id": reservation.id,
-            "seatId": str(reservation.seat_id),
-            "seatNumber": f"{seat.seat_number}",  # 模拟座位号
-            "location": f"{room.name}({room.location})",  # 模拟位置
-            "userId": str(reservation.user_id),
-            "date": reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-            # "timeSlot": (
-            #     f"{reservation.time_slot_id}:00-{int(reservation.time_slot_id)+1}:00"
-            #     if reservation.time_slot_id.isdigit()
-            #     else "09:00-10:00"
-            # ),
-            "timeSlot": f"{st[0]}-{et[0]}",
-            "status": reservation.status,
-            "createdAt": datetime.fromisoformat(reservation.created_at.isoformat()),
-            "updatedAt": datetime.fromisoformat(reservation.updated_at.isoformat()),
-        }
-        for st, et, seat, room, reservation in zip(
-            start_time, end_time, seats, rooms, sorted_reservations
-        )
-    ]
-    # print("❌")
-    # print(response_data[0])
+@router.get("/user", response_model=ReservationPage)
+async def get_user_reservations(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    获取当前用户的预约（游标分页，按创建时间倒序）
+    查询的起始日期早于归档窗口时，同时查询归档表
+    """
+    archived_before = date.today() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    if date_from is not None and date_from < archived_before:
+        query, created_at_column, id_column = reservation_history_rows(db, current_user_id, date_from, date_to)
+        return reservation_page(db, query, cursor, limit, created_at_column, id_column)
 
-    # # 返回模拟数据，按创建时间降序排列并限制数量
-    # user_reservations = [
-    #     r for r in MOCK_RESERVATIONS if r["userId"] == str(current_user_id)
-    # ]
+    query = reservation_rows_query(db).filter(
+        models.Reservation.user_id == current_user_id
+    )
+    if date_from is not None:
+        query = query.filter(models.Reservation.date >= date_from)
+    if date_to is not None:
+        query = query.filter(models.Reservation.date <= date_to)
+    return reservation_page(db, query, cursor, limit)
 
-    # sorted_reservations = sorted(
-    #     user_reservations, key=lambda x: x["createdAt"], reverse=True
-    # )
-    # print(MOCK_RESERVATIONS[0])
 
-    return response_data
+@router.get("/recent", response_model=ReservationPage)
+async def get_recent_reservations(
+    cursor: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=200),
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    获取用户最近的预约
+    """
+    query = reservation_rows_query(db).filter(
+        models.Reservation.user_id == current_user_id
+    )
+    return reservation_page(db, query, cursor, limit)
 
 
 @router.get("/today-checkin", response_model=List[ReservationResponse])
@@ -183,213 +206,68 @@ async def get_today_checkin_reservations(
     """
     获取今日可签到的预约
     """
-    # 返回模拟今日可签到的预约
-    today = "2023-11-10"  # 为了确保有测试数据
-    today = datetime.now().strftime("%Y-%m-%d")
-    # today_reservations = [
-    #     r
-    #     for r in MOCK_RESERVATIONS
-    #     if r["userId"] == str(current_user_id)
-    #     and r["date"] == today
-    #     and r["status"] == "已预约"
-    # ]
+    today = date.today()
     today_reservations = (
-        db.query(models.Reservation)
+        reservation_rows_query(db)
         .filter(
             models.Reservation.user_id == current_user_id,
             models.Reservation.date == today,
-            models.Reservation.status == "已预约",
+            models.Reservation.status == models.ReservationStatus.RESERVED,
         )
         .all()
     )
+    return [structure_reservation_data(db, reservation) for reservation in today_reservations]
 
-    start_time = [
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in today_reservations
-    ]
 
-    end_time = [
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in today_reservations
-    ]
-
-    response_data = [
-        {
-            "id": reservation.id,
-            "seatId": str(reservation.seat_id),
-            "seatNumber": f"S{reservation.seat_id}",  # 模拟座位号
-            "location": "预约位置",  # 模拟位置
-            "userId": str(reservation.user_id),
-            "date": reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-            # "timeSlot": (
-            #     f"{reservation.time_slot_id}:00-{int(reservation.time_slot_id)+1}:00"
-            #     if reservation.time_slot_id.isdigit()
-            #     else "09:00-10:00"
-            # ),
-            "timeSlot": f"{st[0]}-{et[0]}",
-            "status": reservation.status,
-            "createdAt": datetime.fromisoformat(reservation.created_at.isoformat()),
-            "updatedAt": datetime.fromisoformat(reservation.updated_at.isoformat()),
-        }
-        for st, et, reservation in zip(start_time, end_time, today_reservations)
-    ]
-
-    # return today_reservations
-    return response_data
-
-
-@router.get("/all/recent", response_model=List[ReservationResponse])
+@router.get("/all/recent", response_model=ReservationPage)
 async def get_all_recent_reservations(
-    limit: int = 5,
+    cursor: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=200),
     current_user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
     """
     获取所有最近的预约（管理员用）
     """
-    # 返回模拟数据，按创建时间降序排列并限制数量
-    sorted_reservations = sorted(
-        MOCK_RESERVATIONS, key=lambda x: x["createdAt"], reverse=True
-    )
-    sorted_reservations = (
-        db.query(models.Reservation)
-        .order_by(models.Reservation.created_at.desc())
-        .limit(limit)
-        .all()
-    )
-
-    start_time = [
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in sorted_reservations
-    ]
-
-    end_time = [
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-        for reservation in sorted_reservations
-    ]
-
-    seats = [
-        db.query(models.Seat).filter(models.Seat.id == reservation.seat_id).first()
-        for reservation in sorted_reservations
-    ]
-
-    rooms = [
-        db.query(models.Room).filter(models.Room.id == seat.room_id).first()
-        for seat in seats
-    ]
-
-    response_data = [
-        {
-            "id": reservation.id,
-            "seatId": str(reservation.seat_id),
-            "seatNumber": f"{seat.seat_number}",  # 模拟座位号
-            "location": f"{room.name}({room.location})",  # 模拟位置
-            "userId": str(reservation.user_id),
-            "date": reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-            # "timeSlot": (
-            #     f"{reservation.time_slot_id}:00-{int(reservation.time_slot_id)+1}:00"
-            #     if reservation.time_slot_id.isdigit()
-            #     else "09:00-10:00"
-            # ),
-            "timeSlot": f"{st[0]}-{et[0]}",
-            "status": reservation.status,
-            "createdAt": datetime.fromisoformat(reservation.created_at.isoformat()),
-            "updatedAt": datetime.fromisoformat(reservation.updated_at.isoformat()),
-        }
-        for st, et, seat, room, reservation in zip(
-            start_time, end_time, seats, rooms, sorted_reservations
-        )
-    ]
-    # print("❌")
-    # print(response_data[0])
-
-    # return sorted_reservations[:limit]
-    return response_data
+    return reservation_page(db, reservation_rows_query(db), cursor, limit)
 
 
 @router.get("/checkin-stats", response_model=List)
 async def get_checkin_stats(
-    current_user_id: int = Depends(get_current_user_id), db: Session = Depends(get_db)
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    room_id: Optional[int] = None,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
 ):
     """
-    获取签到统计数据
-    """
-    # 返回模拟数据
-
-    # checkin_stats = (
-    #     db.query(
-    #         models.Room.name.label("location"),  # 获取房间名称作为 location
-    #         func.count(models.Reservation.id).label("total"),  # 统计每个位置的预约总数
-    #         func.sum(
-    #             func.case([(models.Reservation.status == "已签到", 1)], 0)  # 默认值为 0
-    #         ).label(
-    #             "checkedIn"
-    #         ),  # 统计每个位置的已签到数量
-    #     )
-    #     .join(
-    #         models.Seat, models.Reservation.seat_id == models.Seat.id
-    #     )  # 关联 seats 表
-    #     .join(models.Room, models.Seat.room_id == models.Room.id)  # 关联 rooms 表
-    #     .group_by(models.Room.name)  # 按房间名称分组
-    #     .all()
-    # )
-
-    # 第一步：查询所有预约记录
-    reservations = db.query(
-        models.Reservation.id, models.Reservation.seat_id, models.Reservation.status
-    ).all()
-
-    # 第二步：获取 seat_id 对应的 room_id
-    seat_to_room = {
-        seat.id: seat.room_id
-        for seat in db.query(models.Seat.id, models.Seat.room_id).all()
-    }
-
-    # 第三步：获取 room_id 对应的 location 信息
-    room_to_location = {
-        room.id: room.name for room in db.query(models.Room.id, models.Room.name).all()
-    }
-
-    # 初始化统计数据，确保所有 location 都有默认值
-    stats = {
-        location: {"total": 0, "checkedIn": 0} for location in room_to_location.values()
-    }
-
-    # 第四步：统计每个 location 的预约总数和已签到数量
-    for reservation in reservations:
-        seat_id = reservation.seat_id
-        room_id = seat_to_room.get(seat_id)
-        location = room_to_location.get(room_id)
-
-        if location not in stats:
-            stats[location] = {"total": 0, "checkedIn": 0}
-
-        stats[location]["total"] += 1
-        if reservation.status == "已签到":
-            stats[location]["checkedIn"] += 1
+    获取签到统计数据（按房间分组，可按日期范围和房间过滤）
+    """
+    # 读取增量维护的签到汇总表，不再扫描预约表；
+    # 日期条件放在 JOIN 条件里，没有预约的房间也会以 0 返回
+    rollup = models.CheckinRollup
+    rollup_join = [rollup.room_id == models.Room.id]
+    if date_from:
+        rollup_join.append(rollup.date >= date_from)
+    if date_to:
+        rollup_join.append(rollup.date <= date_to)
+
+    query = (
+        db.query(
+            models.Room.name.label("location"),
+            func.coalesce(func.sum(rollup.total), 0).label("total"),
+            func.coalesce(func.sum(rollup.checked_in), 0).label("checkedIn"),
+        )
+        .outerjoin(rollup, and_(*rollup_join))
+        .group_by(models.Room.id, models.Room.name)
+    )
+    if room_id is not None:
+        query = query.filter(models.Room.id == room_id)
 
-    # 转换为列表格式
-    response_data = [
-        {"name": location, "total": data["total"], "checkedIn": data["checkedIn"]}
-        for location, data in stats.items()
+    return [
+        {"name": row.location, "total": row.total, "checkedIn": row.checkedIn}
+        for row in query.all()
     ]
-    # response_data = [
-    #     {
-    #         "name": response.location,
-    #         "total": response.total,
-    #         "checkedIn": response.checkedIn,
-    #     }
-    #     for response in checkin_stats
-    # ]
-    return response_data
 
 
 @router.get("/stats", response_model=List[ReservationStatItem])
@@ -410,6 +288,7 @@ async def get_reservation_stats(
             models.Seat, models.Reservation.seat_id == models.Seat.id
         )  # 关联 seats 表
         .join(models.Room, models.Seat.room_id == models.Room.id)  # 关联 rooms 表
+        .filter(models.Reservation.status != models.ReservationStatus.CANCELLED)  # 已取消的预约不计入
         .group_by(models.Room.name)  # 按房间名称分组
         .all()
     )
@@ -427,134 +306,336 @@ async def get_reservation_stats(
 )
 async def create_reservation(
     reservation: ReservationCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    print("🌳 def create_reservation")
     """
     创建新预约
+    带 Idempotency-Key 请求头时，重试的请求直接返回第一次的结果
     """
+    return await idempotency_store.run(
+        idempotency_key,
+        (str(current_user_id), "create_reservation"),
+        reservation.model_dump_json(),
+        status.HTTP_201_CREATED,
+        lambda: insert_reservation(reservation, current_user_id, db),
+        ReservationResponse,
+    )
 
-    print(reservation)
-    for k, v in reservation:
-        print(k, v)
 
-    # print(reservation)
-    # for k, v in reservation:
-    #     print(k, v)
-    # 返回模拟新创建的预约
+def check_reservation_references(db: Session, seat_id, time_slot_id):
+    """
+    座位或时间段不存在时返回 404
+    """
+    unknown_seats, unknown_slots = reference_cache.unknown(db, [int(seat_id)], [time_slot_id])
+    if unknown_seats:
+        raise HTTPException(status_code=404, detail="座位不存在")
+    if unknown_slots:
+        raise HTTPException(status_code=404, detail="时间段不存在")
 
-    # # 确保 date 是一个 Python 的 date 对象
-    # reservation_date = (
-    #     reservation.date
-    #     if isinstance(reservation.date, datetime.date)
-    #     else datetime.strptime(reservation.date, "%Y-%m-%d").date()
-    # )
 
-    # 确保 date 是一个 Python 的 date 对象
-    reservation_date = (
-        reservation.date
-        if isinstance(reservation.date, date)
-        else datetime.strptime(reservation.date, "%Y-%m-%d").date()
-    )
+async def insert_reservation(reservation: ReservationCreate, current_user_id, db: Session):
+    """
+    创建新预约（由 create_reservation 调用）
+    """
+    # 抢座模式下也要先检查，不让不存在的座位进入队列
+    check_reservation_references(db, reservation.seatId, reservation.timeSlotId)
+    if settings.RUSH_MODE:
+        return await create_reservation_queued(reservation, current_user_id, db)
 
     # 创建新的预约对象
     new_reservation = models.Reservation(
-        user_id=str(current_user_id),
+        id=str(uuid.uuid4()),
+        user_id=current_user_id,
         seat_id=reservation.seatId,
-        date=reservation_date,  # 使用转换后的 date 对象
-        # time_slot_id=(
-        #     f"{reservation.timeSlotId}:00-{int(reservation.timeSlotId)+1}:00"
-        #     if reservation.timeSlotId.isdigit()
-        #     else "09:00-10:00"
-        # ),
+        date=reservation.date,
         time_slot_id=reservation.timeSlotId,
-        status="已预约",
+        status=models.ReservationStatus.RESERVED,
         created_at=datetime.now(),
         updated_at=datetime.now(),
     )
 
-    # seat = db.query(models.Seat).filter(models.Seat.id == reservation.seatId).first()
-    # seat.is_available = 2
-    # db.commit()
-    # db.refresh(seat)
-
-    # 保存到数据库
+    # 直接插入，由 (seat_id, date, time_slot_id) 唯一索引保证不会重复预约，
+    # 并发请求同一座位时只有一个能成功
     db.add(new_reservation)
-    db.commit()
+    crud.record_reservation_changes(db, [crud.ReservationChange(
+        new_reservation.id, new_reservation.user_id, new_reservation.date,
+        new_reservation.seat_id, new_reservation.time_slot_id,
+        None, new_reservation.status
+    )])
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="该座位在此时间段已被预约")
     db.refresh(new_reservation)
 
-    # 需要将post 的预约新添加信息提交到数据库
+    return structure_reservation_data(db, new_reservation)
 
-    st = (
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == new_reservation.time_slot_id)
-        .first()
-    )
 
-    et = (
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == new_reservation.time_slot_id)
-        .first()
-    )
+def structure_ticket_data(db: Session, ticket):
+    data = {"ticketId": ticket.id, "status": ticket.status, "reservation": None, "detail": None}
+    if ticket.status == "created":
+        row = reservation_rows_query(db).filter(models.Reservation.id == ticket.reservation_id).first()
+        data["reservation"] = structure_reservation_data(db, row) if row else None
+    elif ticket.status == "conflict":
+        data["detail"] = "该座位在此时间段已被预约"
+    elif ticket.status == "failed":
+        data["detail"] = "系统繁忙，请稍后重试"
+    return data
+
+
+async def create_reservation_queued(reservation: ReservationCreate, current_user_id, db: Session):
+    """
+    抢座模式：请求进入队列，等待最多 RUSH_WAIT_SECONDS 秒；
+    超时返回 202 和排队凭证，客户端通过 /tickets/{ticket_id} 查询结果
+    """
+    try:
+        ticket = booking_queue.submit(
+            int(current_user_id), int(reservation.seatId), reservation.date, reservation.timeSlotId
+        )
+    except BookingQueueFull:
+        raise HTTPException(status_code=503, detail="预约人数过多，请稍后重试", headers={"Retry-After": "1"})
+
+    try:
+        await asyncio.wait_for(asyncio.shield(ticket.future), settings.RUSH_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=jsonable_encoder(structure_ticket_data(db, ticket)),
+        )
+
+    data = structure_ticket_data(db, ticket)
+    if ticket.status == "conflict":
+        raise HTTPException(status_code=409, detail=data["detail"])
+    if data["reservation"] is None:
+        raise HTTPException(status_code=503, detail="系统繁忙，请稍后重试", headers={"Retry-After": "1"})
+    return data["reservation"]
 
-    seat = (
-        db.query(models.Seat).filter(models.Seat.id == new_reservation.seat_id).first()
+
+@router.get("/tickets/{ticket_id}", response_model=BookingTicketResponse)
+async def get_booking_ticket(
+    ticket_id: str,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    查询抢座模式下排队请求的处理结果
+    """
+    ticket = booking_queue.get_ticket(ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="排队凭证不存在或已过期")
+    if str(ticket.user_id) != str(current_user_id):
+        raise HTTPException(status_code=403, detail="无权查看此排队凭证")
+    return structure_ticket_data(db, ticket)
+
+
+@router.post(
+    "/batch", response_model=ReservationBatchResponse, status_code=status.HTTP_201_CREATED
+)
+async def create_reservations_batch(
+    batch: ReservationBatchCreate,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    批量创建预约（同一座位多个时间段或多天）
+    """
+    results = [None] * len(batch.items)
+    # 一次检查所有座位和时间段是否存在
+    unknown_seats, unknown_slots = reference_cache.unknown(
+        db, {int(item.seatId) for item in batch.items}, {item.timeSlotId for item in batch.items}
     )
+    keys = {}  # (座位ID, 日期, 时间段ID) -> 在 items 中第一次出现的位置
+    for index, item in enumerate(batch.items):
+        key = (int(item.seatId), item.date, item.timeSlotId)
+        if key[0] in unknown_seats or key[2] in unknown_slots:
+            detail = "座位不存在" if key[0] in unknown_seats else "时间段不存在"
+            results[index] = {"index": index, "result": "not_found", "detail": detail}
+        elif key in keys:
+            results[index] = {"index": index, "result": "duplicate", "detail": "与请求中的其他预约重复"}
+        else:
+            keys[key] = index
+
+    # 一次查询检查所有冲突
+    reserved = crud.find_reserved_slots(db, list(keys))
+
+    rows = []
+    for key, index in keys.items():
+        if key in reserved:
+            results[index] = {"index": index, "result": "conflict", "detail": "该座位在此时间段已被预约"}
+            continue
+        seat_id, reservation_date, time_slot_id = key
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "user_id": int(current_user_id),
+            "seat_id": seat_id,
+            "date": reservation_date,
+            "time_slot_id": time_slot_id,
+            "status": models.ReservationStatus.RESERVED,
+        })
+
+    # 一个事务内批量插入
+    inserted = crud.insert_reservations(db, rows)
+    db.commit()
 
-    room = db.query(models.Room).filter(models.Room.id == seat.room_id).first()
-
-    reservation_date = {
-        "id": new_reservation.id,
-        "seatId": str(new_reservation.seat_id),
-        "seatNumber": f"{seat.seat_number}",  # 模拟座位号
-        "location": f"{room.name}({room.location})",  # 模拟位置
-        "userId": str(current_user_id),
-        "date": new_reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-        # "timeSlot": (
-        #     f"{new_reservation.time_slot_id}:00-{int(new_reservation.time_slot_id)+1}:00"
-        #     if new_reservation.time_slot_id.isdigit()
-        #     else "09:00-10:00"
-        # ),
-        "timeSlot": f"{st[0]}-{et[0]}",
-        "status": new_reservation.status,
-        "createdAt": datetime.fromisoformat(new_reservation.created_at.isoformat()),
-        "updatedAt": datetime.fromisoformat(new_reservation.updated_at.isoformat()),
+    created = {
+        row.id: row
+        for row in reservation_rows_query(db).filter(models.Reservation.id.in_(inserted))
+    }
+    for row in rows:
+        index = keys[(row["seat_id"], row["date"], row["time_slot_id"])]
+        if row["id"] in created:
+            results[index] = {
+                "index": index,
+                "result": "created",
+                "reservation": structure_reservation_data(db, created[row["id"]]),
+            }
+        else:
+            results[index] = {"index": index, "result": "conflict", "detail": "该座位在此时间段已被预约"}
+
+    return {"created": len(created), "results": results}
+
+
+@router.post("/checkin/batch", response_model=ReservationBatchCheckinResponse)
+async def checkin_reservations_batch(
+    batch: ReservationBatchCheckin,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    批量签到（入口闸机、扫码终端排队上传的签到）
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    # 一次查询校验所有预约的归属和状态
+    rows = {
+        row.id: row
+        for row in db.query(
+            models.Reservation.id,
+            models.Reservation.user_id,
+            models.Reservation.date,
+            models.Reservation.seat_id,
+            models.Reservation.time_slot_id,
+            models.Reservation.status,
+            models.Reservation.version,
+        ).filter(models.Reservation.id.in_(ids))
     }
 
-    # new_reservation = {
-    #     "id": "999",  # 假设这是新生成的ID
-    #     "seatId": reservation.seatId,
-    #     "seatNumber": f"S{reservation.seatId}",  # 模拟座位号
-    #     "location": "新创建的预约位置",
-    #     "userId": str(current_user_id),
-    #     "date": str(reservation.date),
-    #     "timeSlot": (
-    #         f"{reservation.timeSlotId}:00-{int(reservation.timeSlotId)+1}:00"
-    #         if reservation.timeSlotId.isdigit()
-    #         else "09:00-10:00"
-    #     ),
-    #     "status": "已预约",
-    #     "createdAt": datetime.now(),
-    #     "updatedAt": datetime.now(),
-    # }
-    # return
-
-    print(reservation_date)
-    return reservation_date
+    results = {}
+    allowed = []
+    for reservation_id in ids:
+        row = rows.get(reservation_id)
+        if row is None:
+            results[reservation_id] = {"id": reservation_id, "result": "not_found"}
+        elif str(row.user_id) != str(current_user_id):
+            results[reservation_id] = {"id": reservation_id, "result": "forbidden"}
+        elif not models.can_transition(row.status, models.ReservationStatus.CHECKED_IN):
+            results[reservation_id] = {"id": reservation_id, "result": "invalid_status", "status": row.status.label}
+        else:
+            allowed.append(row)
+            results[reservation_id] = {
+                "id": reservation_id, "result": "checked_in", "status": models.ReservationStatus.CHECKED_IN.label,
+            }
+
+    # 一条 UPDATE 完成所有签到，校验之后被其他请求修改过的预约不会签到
+    checked_in = crud.checkin_reservations(db, allowed)
+    db.commit()
+    for row in allowed:
+        if row.id not in checked_in:
+            results[row.id] = {"id": row.id, "result": "conflict", "detail": VERSION_CONFLICT_DETAIL}
+
+    return {"checkedIn": len(checked_in), "results": [results[reservation_id] for reservation_id in ids]}
+
+
+def structure_rule_data(rule):
+    return {
+        "id": rule.id,
+        "seatId": str(rule.seat_id),
+        "timeSlotId": rule.time_slot_id,
+        "weekdays": rule.weekday_list,
+        "startDate": rule.start_date,
+        "endDate": rule.end_date,
+        "materializedUntil": rule.materialized_until,
+        "isActive": rule.is_active,
+        "createdAt": rule.created_at,
+    }
+
+
+@router.post(
+    "/rules", response_model=ReservationRuleResult, status_code=status.HTTP_201_CREATED
+)
+async def create_reservation_rule(
+    rule: ReservationRuleCreate,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    创建循环预约规则，并展开未来 RULE_EXPANSION_DAYS 天内的预约
+    """
+    check_reservation_references(db, rule.seatId, rule.timeSlotId)
+    db_rule = crud.create_reservation_rule(
+        db,
+        user_id=int(current_user_id),
+        seat_id=int(rule.seatId),
+        time_slot_id=rule.timeSlotId,
+        weekdays=rule.weekdays,
+        start_date=rule.startDate,
+        end_date=rule.endDate,
+    )
+    # 其余日期由定时任务按滚动窗口逐步展开
+    created, conflicts = crud.expand_reservation_rule(
+        db, db_rule, date.today() + timedelta(days=settings.RULE_EXPANSION_DAYS)
+    )
+    db.commit()
+    db.refresh(db_rule)
+    return {"rule": structure_rule_data(db_rule), "created": created, "conflicts": conflicts}
+
+
+@router.get("/rules", response_model=List[ReservationRuleResponse])
+async def get_reservation_rules(
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    获取当前用户的循环预约规则
+    """
+    return [
+        structure_rule_data(rule)
+        for rule in crud.get_user_reservation_rules(db, user_id=current_user_id)
+    ]
+
+
+@router.delete("/rules/{rule_id}", response_model=ReservationRuleResult)
+async def delete_reservation_rule(
+    rule_id: str,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    停用循环预约规则，并取消它在今天之后生成的预约
+    """
+    db_rule = db.query(models.ReservationRule).filter(models.ReservationRule.id == rule_id).first()
+    if not db_rule:
+        raise HTTPException(status_code=404, detail="循环预约规则不存在")
+    if str(db_rule.user_id) != str(current_user_id):
+        raise HTTPException(status_code=403, detail="无权操作此循环预约规则")
+
+    cancelled = crud.deactivate_reservation_rule(db, db_rule)
+    db.refresh(db_rule)
+    return {"rule": structure_rule_data(db_rule), "cancelled": cancelled}
 
 
 @router.delete("/{reservation_id}", response_model=ReservationResponse)
 async def cancel_reservation(
     reservation_id: str,
+    version: Optional[int] = None,
     current_user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
     """
     取消预约
     """
-    print("❌ 删除预约座位")
-    print("🌳 def cancel_reservation")
     # 从数据库中查找对应的预约
     reservation = (
         db.query(models.Reservation)
@@ -566,49 +647,28 @@ async def cancel_reservation(
         raise HTTPException(status_code=404, detail="预约不存在")
 
     # 验证预约是否属于当前用户
-    if str(reservation.user_id) != current_user_id:
-        print("current_user_id", current_user_id, type(current_user_id))  # str
-        print(
-            "reservation.user_id", reservation.user_id, type(reservation.user_id)
-        )  # int
+    if str(reservation.user_id) != str(current_user_id):
         raise HTTPException(status_code=403, detail="无权操作此预约")
 
-    # 删除预约记录
-    db.delete(reservation)
-    db.commit()
-
-    st = (
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-    )
-
-    et = (
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-    )
-
-    # 返回已取消的预约信息
-    cancelled_reservation = {
-        "id": reservation.id,
-        "seatId": str(reservation.seat_id),
-        "seatNumber": f"S{reservation.seat_id}",  # 模拟座位号
-        "location": "预约位置",  # 模拟位置
-        "userId": str(reservation.user_id),
-        "date": reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-        # "timeSlot": (
-        #     f"{reservation.time_slot_id}:00-{int(reservation.time_slot_id)+1}:00"
-        #     if reservation.time_slot_id.isdigit()
-        #     else "09:00-10:00"
-        # ),
-        "timeSlot": f"{st[0]}-{et[0]}",
-        "status": "已取消",
-        "createdAt": reservation.created_at.isoformat(),
-        "updatedAt": datetime.now().isoformat(),
-    }
+    check_reservation_version(reservation, version)
+    if not models.can_transition(reservation.status, models.ReservationStatus.CANCELLED):
+        raise HTTPException(status_code=400, detail="预约状态不允许取消")
+
+    with reservation_version_guard(db):
+        # 标记为已取消（保留记录用于统计），同一事务中更新签到汇总
+        crud.record_reservation_changes(db, [crud.ReservationChange(
+            reservation.id, reservation.user_id, reservation.date,
+            reservation.seat_id, reservation.time_slot_id,
+            reservation.status, models.ReservationStatus.CANCELLED
+        )])
+        reservation.status = models.ReservationStatus.CANCELLED
+        reservation.updated_at = datetime.now()
+        # 空出的座位在同一事务中分配给候补用户（会先 flush 取消的 UPDATE）
+        crud.assign_waitlist(db, [(reservation.date, reservation.seat_id, reservation.time_slot_id)])
+        db.commit()
+    db.refresh(reservation)
 
-    return cancelled_reservation
+    return structure_reservation_data(db, reservation)
 
 
 @router.get("/{reservation_id}", response_model=ReservationDetailResponse)
@@ -620,70 +680,55 @@ async def get_reservation(
     """
     获取预约详情
     """
+    reservation = (
+        reservation_rows_query(db)
+        .filter(models.Reservation.id == str(reservation_id))
+        .first()
+    )
+    if not reservation:
+        # 历史预约可能已经归档
+        archive = models.ReservationArchive
+        reservation = db.query(
+            archive.id, archive.seat_id, archive.user_id, archive.date, archive.time_slot_id,
+            archive.status, archive.version, archive.created_at, archive.updated_at,
+        ).filter(archive.id == str(reservation_id)).first()
 
-    print("🌳 def get_reservation")
-    print("reservation_id", reservation_id)
-    # 查找对应的预约
-    # reservation = next(
-    #     (r for r in MOCK_RESERVATIONS if r["id"] == reservation_id), None
-    # )
-
-    # if not reservation:
-    #     raise HTTPException(status_code=404, detail="预约不存在")
-
-    # # 验证预约是否属于当前用户
-    # if reservation["userId"] != str(current_user_id):
-    #     raise HTTPException(status_code=403, detail="无权查看此预约")
+    if not reservation:
+        raise HTTPException(status_code=404, detail="预约不存在")
 
     # 验证预约是否属于当前用户
     if str(reservation.user_id) != str(current_user_id):
-        print("current_user_id", current_user_id, type(current_user_id))
-        print("reservation.user_id", reservation.user_id, type(reservation.user_id))
         raise HTTPException(status_code=403, detail="无权操作此预约")
 
-    reservation = (
-        db.query(models.Reservation)
-        .filter((models.Reservation.id) == str(reservation_id))
-        .first()
-    )
-
-    return reservation
+    return structure_reservation_data(db, reservation)
 
 
 @router.post("/{reservation_id}/checkin", response_model=ReservationResponse)
 async def checkin_reservation(
     reservation_id: str,
+    version: Optional[int] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
     """
     签到
+    带 Idempotency-Key 请求头时，重试的请求直接返回第一次的结果
     """
-    # 查找对应的预约
-    print("🌳 def checkin_reservation")
-
-    print("reservation_id", reservation_id)
-    # reservation = next(
-    #     (r for r in MOCK_RESERVATIONS if r["id"] == reservation_id), None
-    # )
-
-    # if not reservation:
-    #     raise HTTPException(status_code=404, detail="预约不存在")
-
-    # if reservation["status"] != "已预约":
-    #     print("reservation_status", reservation["status"])
-    #     raise HTTPException(status_code=400, detail="预约状态不允许签到")
+    return await idempotency_store.run(
+        idempotency_key,
+        (str(current_user_id), "checkin_reservation"),
+        f"{reservation_id}:{version}",
+        status.HTTP_200_OK,
+        lambda: checkin_single_reservation(reservation_id, version, current_user_id, db),
+        ReservationResponse,
+    )
 
-    # 返回已签到的预约
-    # checked_in_reservation = {
-    #     **reservation,
-    #     "status": "已签到",
-    #     "checkinTime": datetime.now().isoformat(),
-    #     "updatedAt": datetime.now(),
-    # }
-    # print("MOCKED_RESERVATIONS")
-    # print(checked_in_reservation)
 
+async def checkin_single_reservation(reservation_id: str, version: Optional[int], current_user_id, db: Session):
+    """
+    签到（由 checkin_reservation 调用）
+    """
     # 从数据库中查找对应的预约
     reservation = (
         db.query(models.Reservation)
@@ -691,64 +736,32 @@ async def checkin_reservation(
         .first()
     )
 
-    print(reservation)
-
     if not reservation:
         raise HTTPException(status_code=404, detail="预约不存在")
 
     # 验证预约是否属于当前用户
     if str(reservation.user_id) != str(current_user_id):
-        print("current_user_id", current_user_id, type(current_user_id))
-        print("reservation.user_id", reservation.user_id, type(reservation.user_id))
         raise HTTPException(status_code=403, detail="无权操作此预约")
 
     # 验证预约状态是否允许签到
-    if reservation.status != "已预约":
+    check_reservation_version(reservation, version)
+    if not models.can_transition(reservation.status, models.ReservationStatus.CHECKED_IN):
         raise HTTPException(status_code=400, detail="预约状态不允许签到")
 
-    # 更新预约状态为 "已签到"
-    reservation.status = "已签到"
+    # 更新预约状态为 "已签到"，同一事务中更新签到汇总
+    crud.record_reservation_changes(db, [crud.ReservationChange(
+        reservation.id, reservation.user_id, reservation.date,
+        reservation.seat_id, reservation.time_slot_id,
+        reservation.status, models.ReservationStatus.CHECKED_IN
+    )])
+    reservation.status = models.ReservationStatus.CHECKED_IN
     reservation.updated_at = datetime.now()
 
     # 提交更改到数据库
-    db.commit()
+    commit_reservation_change(db)
     db.refresh(reservation)
 
-    st = (
-        db.query(models.TimeSlot.start_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-    )
-
-    et = (
-        db.query(models.TimeSlot.end_time)
-        .filter(models.TimeSlot.id == reservation.time_slot_id)
-        .first()
-    )
-
-    seat = db.query(models.Seat).filter(models.Seat.id == reservation.seat_id).first()
-
-    room = db.query(models.Room).filter(models.Room.id == seat.room_id).first()
-
     # 返回已签到的预约信息
-    checked_in_reservation = {
-        # **reservation,
-        "id": reservation.id,
-        "seatId": str(reservation.seat_id),
-        "seatNumber": f"{seat.seat_number}",  # 模拟座位号
-        "location": f"{room.name}({room.location})",  # 模拟位置
-        "userId": str(reservation.user_id),
-        "date": reservation.date.strftime("%Y-%m-%d"),  # 转换为字符串
-        # "timeSlot": (
-        #     f"{reservation.time_slot_id}:00-{int(reservation.time_slot_id)+1}:00"
-        #     if reservation.time_slot_id.isdigit()
-        #     else "09:00-10:00"
-        # ),
-        "timeSlot": f"{st[0]}-{et[0]}",
-        "status": reservation.status,
-        "checkinTime": datetime.now().isoformat(),
-        "createdAt": reservation.created_at.isoformat(),
-        "updatedAt": reservation.updated_at.isoformat(),
-    }
-    # print(checked_in_reservation)
+    checked_in_reservation = structure_reservation_data(db, reservation)
+    checked_in_reservation["checkinTime"] = datetime.now().isoformat()
     return checked_in_reservation
@@ -1,8 +1,10 @@
 """
 Room and Location routes for the seat booking system.
 """
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+import base64
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlalchemy.orm import Session
 
 from database.connection import get_db
@@ -11,6 +13,9 @@ from database.schemas import RoomCreate, RoomUpdate, RoomResponse
 from auth.dependencies import get_current_user_id
 from mock_data.data import MOCK_ROOMS, MOCK_LOCATIONS
 import database.models as models   
+from routes.seats import cached_json_response, make_etag
+from services.occupancy import occupancy_index
+from services.reference_cache import reference_cache
 
 router = APIRouter()
 
@@ -19,7 +24,9 @@ def create_room(room: RoomCreate, db: Session = Depends(get_db)):
     """
     创建新房间
     """
-    return crud.create_room(db=db, name=room.name, location=room.location, capacity=room.capacity)
+    db_room = crud.create_room(db=db, name=room.name, location=room.location, capacity=room.capacity)
+    reference_cache.put_room(db_room)
+    return db_room
 
 def structure_room_data(room):
     return {
@@ -63,6 +70,72 @@ def get_room(
     return structure_room_data(room)
 
 
+# 座位图中的状态码，每个座位占 2 位
+SEAT_MAP_STATUS_LABELS = ["可用", "已预约", "维护中"]
+SEAT_MAP_AVAILABLE, SEAT_MAP_RESERVED, SEAT_MAP_MAINTENANCE = range(3)
+
+
+def pack_seat_map_status(codes: List[int]) -> str:
+    """
+    把状态码按每个座位 2 位打包（第 i 个座位在第 i // 4 个字节的第 (i % 4) * 2 位），再做 base64 编码
+    """
+    packed = bytearray((len(codes) + 3) // 4)
+    for i, code in enumerate(codes):
+        packed[i // 4] |= code << (i % 4 * 2)
+    return base64.b64encode(bytes(packed)).decode()
+
+
+@router.get("/{room_id}/seat-map", response_model=dict)
+def get_room_seat_map(
+    room_id: int,
+    request: Request,
+    date: Optional[date] = None,
+    slot: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    获取房间座位图（列式数据）：ids / numbers / rows / cols 为按位置排序的平行数组，
+    status 为打包后的座位状态；指定 date 和 slot 时标出该时间段已被预约的座位
+    支持 If-None-Match：座位和该时间段的占用情况都没有变化时返回 304
+    """
+    if db.query(models.Room.id).filter(models.Room.id == room_id).first() is None:
+        raise HTTPException(status_code=404, detail="房间不存在")
+    reference_cache.ensure(db)
+
+    # 占用情况来自内存位图，ETag 只取本房间座位的占用位
+    occupied = occupancy_index.occupied(db, date, slot) if date is not None else 0
+    room_occupied = occupied & reference_cache.room_mask(room_id)
+    version = crud.get_seat_collection_version(db, room_id=room_id)
+    etag = make_etag(f"seat-map:{room_id}:{date}:{slot}:{version}:{room_occupied:x}")
+
+    def build():
+        seats = db.query(
+            models.Seat.id, models.Seat.seat_number, models.Seat.grid_row,
+            models.Seat.grid_col, models.Seat.is_available,
+        ).filter(models.Seat.room_id == room_id).order_by(
+            models.Seat.grid_row, models.Seat.grid_col, models.Seat.id
+        ).all()
+        codes = [
+            SEAT_MAP_MAINTENANCE if seat.is_available != 1
+            else SEAT_MAP_RESERVED if occupied >> seat.id & 1
+            else SEAT_MAP_AVAILABLE
+            for seat in seats
+        ]
+        return {
+            "roomId": room_id,
+            "date": date.isoformat() if date is not None else None,
+            "slot": slot,
+            "ids": [seat.id for seat in seats],
+            "numbers": [seat.seat_number for seat in seats],
+            "rows": [seat.grid_row for seat in seats],
+            "cols": [seat.grid_col for seat in seats],
+            "status": pack_seat_map_status(codes),
+            "statusLabels": SEAT_MAP_STATUS_LABELS,
+        }
+
+    return cached_json_response(request, etag, build)
+
+
 @router.put("/{room_id}", response_model=RoomResponse)
 def update_room(room_id: int, room: RoomUpdate, db: Session = Depends(get_db)):
     """
@@ -71,6 +144,7 @@ def update_room(room_id: int, room: RoomUpdate, db: Session = Depends(get_db)):
     db_room = crud.update_room(db, room_id=room_id, room_data=room.dict(exclude_unset=True))
     if db_room is None:
         raise HTTPException(status_code=404, detail="房间不存在")
+    reference_cache.put_room(db_room)
     return db_room
 
 
@@ -82,6 +156,8 @@ def delete_room(room_id: int, db: Session = Depends(get_db)):
     result = crud.delete_room(db, room_id=room_id)
     if not result:
         raise HTTPException(status_code=404, detail="房间不存在")
+    # 软删除不影响历史预约的显示，只刷新缓存中的房间信息
+    reference_cache.put_room(crud.get_room(db, room_id=room_id))
     return None
 
 
@@ -1,10 +1,12 @@
 """
 Seat routes for the seat booking system.
 """
+import hashlib
 import json
 from typing import List, Optional
 from datetime import datetime, date
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
 
 from database.connection import get_db
@@ -14,23 +16,54 @@ from auth.dependencies import get_current_user_id
 from sqlalchemy.orm import Session,joinedload
 from mock_data.data import MOCK_SEATS
 import database.models as models   
-import ast
+from services.occupancy import iter_bits, occupancy_index
+from services.reference_cache import reference_cache
+from services.seat_grid import seat_grid
+from itertools import islice
 router = APIRouter()
 
-def structure_seat_data(seat):
-    features = ast.literal_eval(seat.features)
+def structure_seat_data(seat, room_name: Optional[str] = None):
     return {
         "id": str(seat.id),
         "roomId": seat.room_id,
-        "location": seat.room.name,
+        "location": room_name if room_name is not None else seat.room.name,
         "number": seat.seat_number,
         "status": "可用" if seat.is_available == 1 else "维护中",
-        "features": features,
+        "features": seat.features or [],
         "description": seat.description,
+        "row": seat.grid_row,
+        "col": seat.grid_col,
         "createdAt": seat.created_at.isoformat(),
         "updatedAt": seat.updated_at.isoformat()
     }
 
+def normalize_features(value) -> List[str]:
+    """
+    请求中的座位特性：字符串列表，单个字符串视为只有一个特性，其他类型返回 422
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value.strip()] if value.strip() else []
+    if isinstance(value, list) and all(isinstance(feature, str) for feature in value):
+        return [feature.strip() for feature in value if feature.strip()]
+    raise HTTPException(status_code=422, detail="座位特性必须是字符串列表")
+
+
+def normalize_grid_position(data: dict, key: str, default: Optional[int]) -> Optional[int]:
+    """
+    请求中的座位图行号或列号：未给出时用 default，null 表示没有位置，其他非负整数以外的值返回 422
+    """
+    if key not in data:
+        return default
+    value = data[key]
+    if value is None:
+        return None
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    raise HTTPException(status_code=422, detail="座位图行号和列号必须是非负整数")
+
+
 @router.post("/", response_model=dict, status_code=status.HTTP_201_CREATED)
 def create_seat(
     data: dict,
@@ -54,56 +87,158 @@ def create_seat(
     }
     # print(new_seat)
     # print(data.get("status"))
+    # 没有指定座位图位置时按座位编号推出
+    grid_row, grid_col = crud.seat_grid_position(data.get("number"))
     new_seat = models.Seat(
         room_id=data.get("locationId"),
         seat_number=data.get("number"),
         is_available=1,
-        features=str(data.get("features")),
+        features=normalize_features(data.get("features")),
         description=data.get("description", ""),
+        grid_row=normalize_grid_position(data, "row", grid_row),
+        grid_col=normalize_grid_position(data, "col", grid_col),
     )
     db.add(new_seat)
     db.commit()
     db.refresh(new_seat)
+    reference_cache.put_seat(new_seat)
 
     return structure_seat_data(new_seat)
 
 
 
+def make_etag(version: str) -> str:
+    return '"' + hashlib.md5(version.encode()).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    请求的 If-None-Match 是否包含该 ETag（忽略弱校验前缀 W/）
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def cached_json_response(request: Request, etag: str, build) -> Response:
+    """
+    ETag 与请求一致时返回 304，否则调用 build 生成内容并带上 ETag
+    客户端每次都要用 If-None-Match 重新验证（no-cache），数据未变化时不需要查询和序列化列表
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
 @router.get("/", response_model=List[dict])
 def get_all_seats(
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """
     获取所有座位
+    支持 If-None-Match：座位和房间都没有变化时返回 304
     """
-    seats = db.query(models.Seat).all()
-    # 转换为字典列表
-    seat_list = [
-        structure_seat_data(seat)
-        for seat in seats
-    ]
-    # print(seat_list)
-    # print(MOCK_SEATS)
-    return seat_list
+    etag = make_etag("seats:" + crud.get_seat_collection_version(db))
+
+    def build():
+        # 一次查询关联房间，只取需要的列
+        rows = db.query(
+            models.Seat.id, models.Seat.room_id, models.Room.name.label("room_name"),
+            models.Seat.seat_number, models.Seat.is_available, models.Seat.features,
+            models.Seat.description, models.Seat.grid_row, models.Seat.grid_col,
+            models.Seat.created_at, models.Seat.updated_at,
+        ).join(models.Room, models.Seat.room_id == models.Room.id).order_by(models.Seat.id)
+        return [structure_seat_data(row, row.room_name) for row in rows]
+
+    return cached_json_response(request, etag, build)
 
 
 @router.get("/available", response_model=List[dict])
 def get_available_seats(
-    date: str,
+    date: date,
     timeSlotId: Optional[str] = None,
+    roomId: Optional[int] = None,
+    features: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db)
 ):
     """
-    获取可用座位
+    获取可用座位：未在维护中，且指定日期和时间段内没有有效预约
+    features 为逗号分隔的特性，例如 "靠窗,电源插座"，返回同时具有这些特性的座位
     """
-    # 返回状态为"可用"的座位\
-    seats = db.query(models.Seat).all()
-    seat_list = [
-        structure_seat_data(seat)
-        for seat in seats
+    # 用座位位图、特性倒排索引和占用位图计算可用座位，只按主键读取当前页的座位
+    reference_cache.ensure(db)
+    wanted = [feature.strip() for feature in (features or "").split(",") if feature.strip()]
+    free = (
+        reference_cache.seat_mask(roomId)
+        & reference_cache.feature_mask(wanted)
+        & ~occupancy_index.occupied(db, date, timeSlotId)
+    )
+    seat_ids = list(islice(iter_bits(free), skip, skip + limit))
+    if not seat_ids:
+        return []
+    seats = (
+        db.query(models.Seat)
+        .options(joinedload(models.Seat.room))
+        .filter(models.Seat.id.in_(seat_ids))
+        .order_by(models.Seat.id)
+        .all()
+    )
+    return [structure_seat_data(seat) for seat in seats]
+
+
+@router.get("/recommend", response_model=List[dict])
+def recommend_seats(
+    date: date,
+    timeSlotId: str,
+    features: Optional[str] = None,
+    nearSeatId: Optional[int] = None,
+    roomId: Optional[int] = None,
+    k: int = Query(5, ge=1, le=50),
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    推荐可预约的座位：距离 nearSeatId（默认为用户最常坐的座位）最近、且具有 features 中所有特性的 k 个座位
+    没有参照座位时从 roomId 房间的左上角开始；两者都没有时按座位ID返回
+    """
+    near = nearSeatId if nearSeatId is not None else crud.get_usual_seat(db, int(current_user_id))
+    reference_cache.ensure(db, seat_id=near)
+    origin = seat_grid.position(near) if near is not None else None
+    if origin is not None and roomId is not None and origin[0] != roomId:
+        origin = None
+    if origin is None and roomId is not None:
+        origin = (roomId, 0, 0)
+
+    wanted = [feature.strip() for feature in (features or "").split(",") if feature.strip()]
+    free = (
+        reference_cache.seat_mask(origin[0] if origin else None)
+        & reference_cache.feature_mask(wanted)
+        & ~occupancy_index.occupied(db, date, timeSlotId)
+    )
+    if origin is not None:
+        nearest = seat_grid.nearest(origin[0], origin[1], origin[2], free, k)
+    else:
+        nearest = [(None, seat_id) for seat_id in islice(iter_bits(free), k)]
+    if not nearest:
+        return []
+
+    seats = {
+        seat.id: seat
+        for seat in db.query(models.Seat).options(joinedload(models.Seat.room)).filter(
+            models.Seat.id.in_([seat_id for _, seat_id in nearest])
+        )
+    }
+    return [
+        {**structure_seat_data(seats[seat_id]), "distance": round(distance, 2) if distance is not None else None}
+        for distance, seat_id in nearest
+        if seat_id in seats
     ]
-    available_seats = [seat for seat in seat_list if seat["status"] == "可用"]
-    return available_seats
 
 
 @router.get("/{seat_id}", response_model=dict)
@@ -139,6 +274,7 @@ def update_seat_status(
     seat.updated_at = datetime.now()
     db.commit()
     db.refresh(seat)
+    reference_cache.put_seat(seat)
     return structure_seat_data(seat)
 
 
@@ -158,6 +294,7 @@ def delete_seat(
     # 在真实实现中，这里会从数据库中删除座位
     db.delete(seat)
     db.commit()
+    reference_cache.remove_seat(seat_id)
     # db.refresh(seat)
     # 对于模拟数据，我们只返回成功状态码
     return None 
\ No newline at end of file
@@ -1,8 +1,9 @@
 """
 Time Slots routes for the seat booking system.
 """
+from datetime import date
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 
 from database.connection import get_db
@@ -11,6 +12,8 @@ from database.schemas import TimeSlotCreate, TimeSlotUpdate, TimeSlotResponse
 from auth.dependencies import get_current_user_id
 from mock_data.data import MOCK_TIME_SLOTS
 import database.models as models
+from services.occupancy import occupancy_index
+from services.reference_cache import reference_cache, seat_bit
 
 router = APIRouter()
 
@@ -19,13 +22,15 @@ def create_time_slot(time_slot: TimeSlotCreate, db: Session = Depends(get_db)):
     """
     创建新时间段
     """
-    return crud.create_time_slot(
+    db_time_slot = crud.create_time_slot(
         db=db, 
         start_time=time_slot.start_time,
         end_time=time_slot.end_time,
         name=time_slot.name,
         description=time_slot.description
     )
+    reference_cache.put_time_slot(db_time_slot)
+    return db_time_slot
 
 def structure_time_slot_data(time_slot):
     return {
@@ -48,31 +53,25 @@ def get_all_time_slots(
 
 @router.get("/available", response_model=List[dict])
 def get_available_time_slots(
-    date: str,
-    seatId: Optional[str] = None,
+    date: date,
+    seatId: Optional[int] = Query(None, ge=1),
     db: Session = Depends(get_db)
 ):
     """
     获取可用时间段
-    根据日期和座位ID获取可用的时间段
+    指定座位时返回该座位未被预约的时间段，否则返回至少还有一个可用座位的时间段
     """
-    # 对于模拟数据，我们假设当前座位在指定日期的所有时间段都可用
-    # 如果需要，可以添加更复杂的逻辑来模拟某些时间段已被预约
-    
-    #首先获取该作为上所有reservation,seat_id和data相同,两个filter条件
-    print(seatId)
-    reservations= db.query(models.Reservation).filter(models.Reservation.seat_id == seatId).all()
-    #获取这些reservation的time_slot_id
-    time_slot_ids = [reservation.time_slot_id for reservation in reservations]
-    print("time_slot_ids",time_slot_ids)
-    #获取不在time_slot_ids中的时间段
-    available_time_slots = db.query(models.TimeSlot).filter(models.TimeSlot.id.notin_(time_slot_ids)).all()
-    # if seatId == "104":  # 假设这个座位在某些时间段已被预约
-    #     # 排除特定的小时时间段（例如下午的几个小时）
-    #     return [slot for slot in MOCK_TIME_SLOTS if slot["id"] not in ["5", "6", "7", "8"]]  # 排除13:00-17:00的时间段
-    
-    available_time_slots_list = [structure_time_slot_data(slot) for slot in available_time_slots]
-    return available_time_slots_list  # 返回所有时间段
+    reference_cache.ensure(db, seat_id=seatId)
+    # 只接受已存在的座位，位由 seat_bit 给出，避免按任意输入分配巨大的整数
+    if seatId is not None and seatId not in reference_cache.seats:
+        raise HTTPException(status_code=404, detail="座位不存在")
+    seats = seat_bit(seatId) if seatId is not None else reference_cache.seat_mask()
+    time_slots = sorted(reference_cache.time_slots.items(), key=lambda item: (item[1].start_time, item[0]))
+    return [
+        {"id": str(time_slot_id), "slot": slot.start_time + " - " + slot.end_time}
+        for time_slot_id, slot in time_slots
+        if seats & ~occupancy_index.occupied(db, date, time_slot_id)
+    ]
 
 
 @router.get("/{time_slot_id}", response_model=TimeSlotResponse)
@@ -98,6 +97,7 @@ def update_time_slot(time_slot_id: str, time_slot: TimeSlotUpdate, db: Session =
     )
     if db_time_slot is None:
         raise HTTPException(status_code=404, detail="时间段不存在")
+    reference_cache.put_time_slot(db_time_slot)
     return db_time_slot
 
 
@@ -109,4 +109,6 @@ def delete_time_slot(time_slot_id: str, db: Session = Depends(get_db)):
     result = crud.delete_time_slot(db, time_slot_id=time_slot_id)
     if not result:
         raise HTTPException(status_code=404, detail="时间段不存在")
+    # 软删除，历史预约仍需显示该时间段
+    reference_cache.put_time_slot(crud.get_time_slot(db, time_slot_id=time_slot_id))
     return None
@@ -0,0 +1,96 @@
+"""
+Waitlist routes for the seat booking system.
+"""
+from datetime import date
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from database.connection import get_db
+from database import crud
+from database.schemas import WaitlistCreate, WaitlistEntryResponse
+from auth.dependencies import get_current_user_id
+from services.reference_cache import reference_cache
+import database.models as models
+
+router = APIRouter()
+
+
+def structure_waitlist_data(entry):
+    return {
+        "id": entry.id,
+        "userId": str(entry.user_id),
+        "date": entry.date,
+        "timeSlotId": entry.time_slot_id,
+        "roomId": entry.room_id,
+        "feature": entry.feature,
+        "status": entry.status,
+        "reservationId": entry.reservation_id,
+        "createdAt": entry.created_at,
+        "updatedAt": entry.updated_at,
+    }
+
+
+@router.post("/", response_model=WaitlistEntryResponse, status_code=status.HTTP_201_CREATED)
+async def join_waitlist(
+    entry: WaitlistCreate,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    登记候补：有座位被取消或释放时自动分配预约
+    """
+    if entry.date < date.today():
+        raise HTTPException(status_code=400, detail="不能候补过去的日期")
+    reference_cache.ensure(db, time_slot_id=entry.timeSlotId)
+    if entry.timeSlotId not in reference_cache.time_slots:
+        raise HTTPException(status_code=404, detail="时间段不存在")
+    if entry.roomId is not None and entry.roomId not in reference_cache.rooms:
+        raise HTTPException(status_code=404, detail="房间不存在")
+    if crud.get_waiting_entry(db, int(current_user_id), entry.date, entry.timeSlotId):
+        raise HTTPException(status_code=409, detail="已在该时间段的候补队列中")
+
+    db_entry = crud.create_waitlist_entry(
+        db,
+        user_id=int(current_user_id),
+        date=entry.date,
+        time_slot_id=entry.timeSlotId,
+        room_id=entry.roomId,
+        feature=entry.feature,
+    )
+    return structure_waitlist_data(db_entry)
+
+
+@router.get("/", response_model=List[WaitlistEntryResponse])
+async def get_my_waitlist(
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    获取当前用户的候补列表
+    """
+    return [
+        structure_waitlist_data(entry)
+        for entry in crud.get_user_waitlist_entries(db, user_id=current_user_id)
+    ]
+
+
+@router.delete("/{entry_id}", response_model=WaitlistEntryResponse)
+async def cancel_waitlist(
+    entry_id: str,
+    current_user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    """
+    取消候补
+    """
+    db_entry = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.id == entry_id).first()
+    if not db_entry:
+        raise HTTPException(status_code=404, detail="候补不存在")
+    if str(db_entry.user_id) != str(current_user_id):
+        raise HTTPException(status_code=403, detail="无权操作此候补")
+    if db_entry.status != "等待中":
+        raise HTTPException(status_code=400, detail="候补状态不允许取消")
+
+    return structure_waitlist_data(crud.cancel_waitlist_entry(db, db_entry))
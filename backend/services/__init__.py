@@ -0,0 +1,3 @@
+"""
+In-process services for the seat booking system.
+"""
@@ -0,0 +1,168 @@
+"""
+Admission-controlled booking queue for rush mode.
+
+每天放号时大量创建预约的请求同时到达，SQLite 只有一个写入者，
+各请求各自提交事务会互相等待写锁，最终报 "database is locked"。
+抢座模式下请求先进入进程内队列（按座位分片），由固定数量的写入任务
+每次取出一批，用一个事务批量插入；队列满时直接拒绝（503），而不是让请求堆积在写锁上。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional
+
+from database import crud
+from database.connection import SessionLocal
+import database.models as models
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BookingQueueFull(Exception):
+    """排队请求数已达上限"""
+
+
+class BookingTicket:
+    """排队凭证：一个创建预约请求的处理状态"""
+
+    def __init__(self, user_id: int, seat_id: int, reservation_date: date, time_slot_id: str):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.seat_id = seat_id
+        self.date = reservation_date
+        self.time_slot_id = time_slot_id
+        self.status = "queued"  # queued | created | conflict | failed
+        self.reservation_id: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, status: str, reservation_id: Optional[str] = None):
+        self.status = status
+        self.reservation_id = reservation_id
+        if not self.future.done():
+            self.future.set_result(status)
+
+
+class BookingQueue:
+    """按座位分片的预约队列，每个分片一个写入任务"""
+
+    # 写入任务每次最多取出的请求数
+    BATCH_SIZE = crud.BULK_CHUNK_SIZE
+    # 处理完成的凭证保留多久，供客户端轮询
+    TICKET_TTL_SECONDS = 600
+
+    def __init__(self, writers: int, max_queued: int):
+        self.writers = max(1, writers)
+        self.max_queued = max_queued
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._tickets: "OrderedDict[str, BookingTicket]" = OrderedDict()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """
+        启动写入任务（需要在事件循环中调用；第一次提交请求时自动启动）
+        """
+        if self.running:
+            return
+        size = max(1, self.max_queued // self.writers)
+        self._queues = [asyncio.Queue(maxsize=size) for _ in range(self.writers)]
+        self._tasks = [asyncio.create_task(self._writer(queue)) for queue in self._queues]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._queues = []
+        for ticket in self._tickets.values():
+            if ticket.status == "queued":
+                ticket.resolve("failed")
+        self._tickets.clear()
+
+    def submit(self, user_id: int, seat_id: int, reservation_date: date, time_slot_id: str) -> BookingTicket:
+        """
+        提交一个创建预约请求
+
+        Raises:
+            BookingQueueFull: 如果该分片的队列已满
+        """
+        self.start()
+        self._prune()
+        ticket = BookingTicket(user_id, seat_id, reservation_date, time_slot_id)
+        try:
+            self._queues[seat_id % self.writers].put_nowait(ticket)
+        except asyncio.QueueFull:
+            raise BookingQueueFull()
+        self._tickets[ticket.id] = ticket
+        return ticket
+
+    def get_ticket(self, ticket_id: str) -> Optional[BookingTicket]:
+        return self._tickets.get(ticket_id)
+
+    def _prune(self):
+        deadline = time.monotonic() - self.TICKET_TTL_SECONDS
+        while self._tickets:
+            ticket = next(iter(self._tickets.values()))
+            if ticket.created_at > deadline or ticket.status == "queued":
+                break
+            self._tickets.popitem(last=False)
+
+    async def _writer(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                results = await asyncio.to_thread(self._write, batch)
+            except Exception:
+                logger.exception("抢座模式批量写入失败")
+                results = {}
+            for ticket in batch:
+                status, reservation_id = results.get(ticket.id, ("failed", None))
+                ticket.resolve(status, reservation_id)
+
+    @staticmethod
+    def _write(batch: List[BookingTicket]) -> Dict[str, tuple]:
+        """
+        一个事务批量插入，同一座位同一时间段先到先得
+
+        Returns:
+            凭证ID -> (结果, 预约ID)
+        """
+        rows = {
+            ticket.id: {
+                "id": str(uuid.uuid4()),
+                "user_id": ticket.user_id,
+                "seat_id": ticket.seat_id,
+                "date": ticket.date,
+                "time_slot_id": ticket.time_slot_id,
+                "status": models.ReservationStatus.RESERVED,
+            }
+            for ticket in batch
+        }
+        db = SessionLocal()
+        try:
+            inserted = crud.insert_reservations(db, list(rows.values()))
+            db.commit()
+        finally:
+            db.close()
+        return {
+            ticket_id: ("created", row["id"]) if row["id"] in inserted else ("conflict", None)
+            for ticket_id, row in rows.items()
+        }
+
+
+# 全局预约队列，RUSH_MODE 开启时创建预约的接口使用
+booking_queue = BookingQueue(settings.RUSH_WRITERS, settings.RUSH_QUEUE_SIZE)
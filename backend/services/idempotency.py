@@ -0,0 +1,128 @@
+"""
+Idempotency-Key support for retried POST requests.
+
+移动端网络不稳定时会重试创建预约、签到请求。带同一个 Idempotency-Key 的重复请求
+直接返回第一次的响应，不再访问预约表。响应保存在进程内，按 TTL 过期，条目数有上限（LRU）。
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from settings import settings
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.done = asyncio.Event()
+        # (状态码, 响应体, 额外响应头)，处理完成前为 None
+        self.response: Optional[Tuple[int, bytes, dict]] = None
+
+
+class IdempotencyStore:
+    """保存每个 Idempotency-Key 第一次请求的响应"""
+
+    # 相同的请求仍在处理时，重复请求最多等待的秒数
+    WAIT_SECONDS = 10
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+
+    def _get(self, key: tuple) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: tuple, entry: _Entry):
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def run(
+        self,
+        key: Optional[str],
+        scope: tuple,
+        fingerprint: str,
+        status_code: int,
+        handler: Callable[[], Awaitable],
+        response_model=None,
+    ):
+        """
+        执行 handler；带了 key 时保存响应，重复请求直接返回保存的响应
+
+        Args:
+            key: 请求头中的 Idempotency-Key，为空时直接执行
+            scope: 区分 key 的范围，例如 (用户ID, 接口)
+            fingerprint: 请求内容，同一个 key 用于不同的请求时返回 422
+            status_code: handler 正常返回时的状态码
+            handler: 实际处理请求的协程函数
+            response_model: 接口的响应模型，保存的响应与正常响应一样只包含模型中的字段
+        """
+        if not key:
+            return await handler()
+        cache_key = (*scope, key)
+
+        entry = self._get(cache_key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key 已用于其他请求")
+            if entry.response is None:
+                try:
+                    await asyncio.wait_for(entry.done.wait(), self.WAIT_SECONDS)
+                except asyncio.TimeoutError:
+                    raise HTTPException(status_code=409, detail="相同的请求正在处理中，请稍后重试")
+            if entry.response is not None:
+                return self._replay(entry.response)
+            # 第一次请求失败，没有保存响应，重新处理
+
+        entry = _Entry(fingerprint)
+        self._put(cache_key, entry)
+        try:
+            result = await handler()
+        except HTTPException as exc:
+            if exc.status_code >= 500:
+                self._entries.pop(cache_key, None)
+                raise
+            body = json.dumps({"detail": exc.detail}, ensure_ascii=False).encode()
+            entry.response = (exc.status_code, body, dict(exc.headers or {}))
+            raise
+        except BaseException:
+            self._entries.pop(cache_key, None)
+            raise
+        finally:
+            entry.done.set()
+
+        if isinstance(result, Response):
+            entry.response = (result.status_code, bytes(result.body), {})
+        else:
+            content = response_model.model_validate(result) if response_model else result
+            body = json.dumps(jsonable_encoder(content), ensure_ascii=False).encode()
+            entry.response = (status_code, body, {})
+        return result
+
+    @staticmethod
+    def _replay(response: Tuple[int, bytes, dict]) -> Response:
+        status_code, body, headers = response
+        return Response(
+            content=body,
+            status_code=status_code,
+            media_type=JSONResponse.media_type,
+            headers={**headers, "Idempotent-Replayed": "true"},
+        )
+
+
+# 全局 Idempotency-Key 响应缓存
+idempotency_store = IdempotencyStore(settings.IDEMPOTENCY_MAX_KEYS, settings.IDEMPOTENCY_TTL_SECONDS)
@@ -0,0 +1,198 @@
+"""
+In-memory seat occupancy index.
+
+每个 (日期, 时间段) 对应一个位图（Python int），第 i 位为 1 表示 ID 为 i 的座位
+已有有效预约。启动时从 reservations 加载今天及以后的有效预约，之后按序号读取
+reservation_events 中的变更事件增量更新：同一进程内的提交会把位图标记为过期，
+下次读取前补读事件；其他进程的修改由定时任务调用 sync 同步。
+
+可用座位 = reference_cache.seat_mask() & ~occupied(日期, 时间段)，
+check 用于与数据库比对，发现不一致时可以 load 重新加载。座位的位由 seat_bit 给出，
+ID 超出范围的座位不记录在位图中。
+"""
+import threading
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from database import crud
+import database.models as models
+from services.reference_cache import seat_bit
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """
+    按从小到大的顺序返回位图中为 1 的位序号
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class OccupancyIndex:
+    """座位占用位图"""
+
+    # 每次补读的事件数
+    SYNC_BATCH_SIZE = 1000
+
+    def __init__(self):
+        self._occupied: Dict[Tuple[date, str], int] = {}
+        self.last_seq = 0
+        self.loaded = False
+        self._stale = False
+        self._today: Optional[date] = None
+        self._lock = threading.RLock()
+
+    def load(self, db: Session):
+        """
+        从有效预约整体重建位图
+        """
+        with self._lock:
+            # 先记下事件序号再读预约：两次读取之间提交的修改会在 sync 时重放一遍，
+            # 同一座位同一时间段最多只有一个有效预约，按顺序重放结果不变
+            last_seq = db.query(func.coalesce(func.max(models.ReservationEvent.seq), 0)).scalar()
+            today = date.today()
+            occupied: Dict[Tuple[date, str], int] = {}
+            rows = db.query(
+                models.Reservation.date, models.Reservation.time_slot_id, models.Reservation.seat_id
+            ).filter(
+                models.Reservation.date >= today,
+                models.Reservation.status.in_(models.RESERVATION_ACTIVE_STATUSES),
+            )
+            for reservation_date, time_slot_id, seat_id in rows:
+                key = (reservation_date, str(time_slot_id))
+                occupied[key] = occupied.get(key, 0) | seat_bit(seat_id)
+            self._occupied, self.last_seq, self._today = occupied, last_seq, today
+            self.loaded, self._stale = True, False
+
+    def mark_stale(self):
+        """
+        同一进程内提交了预约修改，下次读取前需要补读变更事件
+        """
+        self._stale = True
+
+    def sync(self, db: Session) -> int:
+        """
+        读取 last_seq 之后的变更事件并更新位图
+
+        Returns:
+            应用的事件数
+        """
+        with self._lock:
+            if not self.loaded:
+                self.load(db)
+                return 0
+            self._stale = False
+            applied = 0
+            while True:
+                events = crud.get_reservation_events(db, self.last_seq, self.SYNC_BATCH_SIZE)
+                for change in events:
+                    self._apply(change.date, change.time_slot_id, change.seat_id, change.new_status)
+                applied += len(events)
+                if events:
+                    self.last_seq = events[-1].seq
+                if len(events) < self.SYNC_BATCH_SIZE:
+                    break
+            self._evict_past()
+            return applied
+
+    def _apply(self, reservation_date: date, time_slot_id, seat_id, status):
+        if reservation_date < date.today() or seat_id is None:
+            return
+        key = (reservation_date, str(time_slot_id))
+        bit = seat_bit(seat_id)
+        if not bit:
+            return
+        mask = self._occupied.get(key, 0)
+        mask = mask | bit if status in models.RESERVATION_ACTIVE_STATUSES else mask & ~bit
+        if mask:
+            self._occupied[key] = mask
+        else:
+            self._occupied.pop(key, None)
+
+    def _evict_past(self):
+        # 日期变化后丢弃已经过去的日期
+        today = date.today()
+        if self._today != today:
+            self._occupied = {key: mask for key, mask in self._occupied.items() if key[0] >= today}
+            self._today = today
+
+    def _ensure(self, db: Session):
+        if not self.loaded or self._stale:
+            self.sync(db)
+
+    # ==================== 查询 ====================
+
+    def occupied(self, db: Session, reservation_date: date, time_slot_id: Optional[str]) -> int:
+        """
+        某日期某时间段已被预约的座位位图，time_slot_id 为空时返回 0
+        """
+        if time_slot_id is None:
+            return 0
+        self._ensure(db)
+        return self._occupied.get((reservation_date, str(time_slot_id)), 0)
+
+    def occupied_any_slot(self, db: Session, reservation_date: date) -> int:
+        """
+        某日期任一时间段有有效预约的座位位图
+        """
+        self._ensure(db)
+        mask = 0
+        for (key_date, _), slot_mask in list(self._occupied.items()):
+            if key_date == reservation_date:
+                mask |= slot_mask
+        return mask
+
+    # ==================== 一致性检查 ====================
+
+    def check(self, db: Session) -> List[dict]:
+        """
+        与数据库中的有效预约比对（先补读变更事件）
+
+        检查期间有其他请求写入时可能出现短暂的不一致，可以重新检查确认
+
+        Returns:
+            不一致的 (日期, 时间段) 列表，包含位图中缺少和多出的座位ID
+        """
+        with self._lock:
+            self.sync(db)
+            expected: Dict[Tuple[date, str], int] = {}
+            rows = db.query(
+                models.Reservation.date, models.Reservation.time_slot_id, models.Reservation.seat_id
+            ).filter(
+                models.Reservation.date >= date.today(),
+                models.Reservation.status.in_(models.RESERVATION_ACTIVE_STATUSES),
+            )
+            for reservation_date, time_slot_id, seat_id in rows:
+                key = (reservation_date, str(time_slot_id))
+                expected[key] = expected.get(key, 0) | seat_bit(seat_id)
+
+            mismatches = []
+            for key in sorted(set(expected) | set(self._occupied)):
+                actual, wanted = self._occupied.get(key, 0), expected.get(key, 0)
+                if actual != wanted:
+                    mismatches.append({
+                        "date": key[0],
+                        "timeSlotId": key[1],
+                        "missing": list(iter_bits(wanted & ~actual)),
+                        "extra": list(iter_bits(actual & ~wanted)),
+                    })
+            return mismatches
+
+
+# 全局位图实例，在 app 的 lifespan 中加载
+occupancy_index = OccupancyIndex()
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_occupancy_stale(session: Session):
+    if session.info.pop(crud.RESERVATION_CHANGES_KEY, False):
+        occupancy_index.mark_stale()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_reservation_changes(session: Session):
+    session.info.pop(crud.RESERVATION_CHANGES_KEY, None)
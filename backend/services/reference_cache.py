@@ -0,0 +1,252 @@
+"""
+In-memory cache of reference data: rooms, seats and time slots.
+
+这三张表很小且很少变化，预约接口每次都要用它们拼出
+seatNumber / location / timeSlot，所以在进程内缓存一份，按字典查找。
+写接口修改这些表后需要调用 put_* / remove_* 同步缓存，每次变化 version 加一。
+
+座位按 ID 作为位序号，seat_mask 返回未在维护中的座位位图，feature_mask 由
+特性到座位位图的倒排索引求交集，与 services.occupancy 中的占用位图做位运算
+即可得到可预约的座位。ID 超过 MAX_SEAT_ID 的座位不进入位图（seat_bit 返回 0），
+避免个别很大的 ID 让所有位图占用大量内存。
+"""
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import database.models as models
+
+
+# 位图中的最大位序号，每个位图最多占用 MAX_SEAT_ID / 8 字节
+MAX_SEAT_ID = 1 << 20
+
+
+def seat_bit(seat_id) -> int:
+    """
+    座位在位图中对应的位，ID 不在 [0, MAX_SEAT_ID] 范围内时返回 0
+    """
+    seat_id = int(seat_id)
+    return 1 << seat_id if 0 <= seat_id <= MAX_SEAT_ID else 0
+
+
+class RoomInfo(NamedTuple):
+    name: str
+    location: str
+
+
+class SeatInfo(NamedTuple):
+    seat_number: str
+    room_id: int
+    is_available: bool = True
+    features: Tuple[str, ...] = ()
+    grid_row: Optional[int] = None
+    grid_col: Optional[int] = None
+
+
+class TimeSlotInfo(NamedTuple):
+    start_time: str
+    end_time: str
+
+
+class ReferenceCache:
+    """房间、座位、时间段的进程内缓存"""
+
+    # 兜底的整体重新加载间隔，用于同步其他进程的修改
+    MAX_AGE_SECONDS = 300
+
+    def __init__(self):
+        self.version = 0
+        self.rooms: Dict[int, RoomInfo] = {}
+        self.seats: Dict[int, SeatInfo] = {}
+        self.time_slots: Dict[str, TimeSlotInfo] = {}
+        self.loaded_at: Optional[float] = None
+        # 已确认数据库中也不存在的键，避免反复重新加载
+        self._missing = set()
+        # (version, room_id) -> 可用座位位图
+        self._masks: Dict[tuple, int] = {}
+        # 特性 -> 具有该特性的座位位图（倒排索引），以及生成它时的 version
+        self._feature_index: Dict[str, int] = {}
+        self._feature_index_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _bump(self, clear_missing: bool = True):
+        with self._lock:
+            self.version += 1
+            if clear_missing:
+                self._missing = set()
+            self._masks = {}
+
+    def load(self, db: Session):
+        """
+        从数据库整体加载
+        """
+        rooms = {
+            room.id: RoomInfo(room.name, room.location)
+            for room in db.query(models.Room.id, models.Room.name, models.Room.location)
+        }
+        seats = {
+            seat.id: SeatInfo(
+                seat.seat_number, seat.room_id, seat.is_available == 1, tuple(seat.features or ()),
+                seat.grid_row, seat.grid_col,
+            )
+            for seat in db.query(
+                models.Seat.id, models.Seat.seat_number, models.Seat.room_id,
+                models.Seat.is_available, models.Seat.features, models.Seat.grid_row, models.Seat.grid_col,
+            )
+        }
+        time_slots = {
+            slot.id: TimeSlotInfo(slot.start_time, slot.end_time)
+            for slot in db.query(
+                models.TimeSlot.id, models.TimeSlot.start_time, models.TimeSlot.end_time
+            )
+        }
+        self.rooms, self.seats, self.time_slots = rooms, seats, time_slots
+        self.loaded_at = time.monotonic()
+        # 重新加载不清空 _missing，否则交替查询不同的缺失键时每次都会整体重新加载；
+        # 写接口修改（put_* / remove_*）或缓存过期时才清空
+        self._bump(clear_missing=False)
+
+    def ensure(self, db: Session, seat_id=None, time_slot_id=None):
+        """
+        确保缓存中有给定的座位和时间段，缺失或过期时重新加载一次
+        """
+        self._ensure_keys(db, [("seat", seat_id), ("time_slot", time_slot_id)])
+
+    def unknown(self, db: Session, seat_ids: Iterable = (), time_slot_ids: Iterable = ()) -> Tuple[set, set]:
+        """
+        检查一组座位和时间段是否存在（缺失时最多重新加载一次）
+
+        Returns:
+            (不存在的座位ID集合, 不存在的时间段ID集合)
+        """
+        seat_ids, time_slot_ids = set(seat_ids), set(time_slot_ids)
+        self._ensure_keys(
+            db, [("seat", seat_id) for seat_id in seat_ids] + [("time_slot", slot) for slot in time_slot_ids]
+        )
+        return (
+            {seat_id for seat_id in seat_ids if not self._has("seat", seat_id)},
+            {slot for slot in time_slot_ids if not self._has("time_slot", slot)},
+        )
+
+    def _ensure_keys(self, db: Session, keys):
+        expired = (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > self.MAX_AGE_SECONDS
+        )
+        if expired:
+            self._missing = set()
+        missing = [
+            key for key in keys
+            if key[1] is not None and key not in self._missing and not self._has(*key)
+        ]
+        if expired or missing:
+            self.load(db)
+            self._missing.update(key for key in missing if not self._has(*key))
+
+    def _has(self, kind, key) -> bool:
+        if kind == "seat":
+            return self._seat_key(key) in self.seats
+        return str(key) in self.time_slots
+
+    @staticmethod
+    def _seat_key(seat_id):
+        try:
+            return int(seat_id)
+        except (TypeError, ValueError):
+            return seat_id
+
+    # ==================== 写接口同步 ====================
+
+    def put_room(self, room: models.Room):
+        self.rooms[room.id] = RoomInfo(room.name, room.location)
+        self._bump()
+
+    def remove_room(self, room_id: int):
+        self.rooms.pop(room_id, None)
+        self._bump()
+
+    def put_seat(self, seat: models.Seat):
+        self.seats[seat.id] = SeatInfo(
+            seat.seat_number, seat.room_id, seat.is_available == 1, tuple(seat.features or ()),
+            seat.grid_row, seat.grid_col,
+        )
+        self._bump()
+
+    def remove_seat(self, seat_id: int):
+        self.seats.pop(self._seat_key(seat_id), None)
+        self._bump()
+
+    def put_time_slot(self, time_slot: models.TimeSlot):
+        self.time_slots[time_slot.id] = TimeSlotInfo(time_slot.start_time, time_slot.end_time)
+        self._bump()
+
+    def remove_time_slot(self, time_slot_id: str):
+        self.time_slots.pop(time_slot_id, None)
+        self._bump()
+
+    # ==================== 座位位图 ====================
+
+    def seat_mask(self, room_id: Optional[int] = None) -> int:
+        """
+        未在维护中的座位位图（第 i 位表示 ID 为 i 的座位），可只取某个房间
+        """
+        key = (self.version, room_id)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = 0
+            for seat_id, seat in list(self.seats.items()):
+                if seat.is_available and (room_id is None or seat.room_id == room_id):
+                    mask |= seat_bit(seat_id)
+            self._masks[key] = mask
+        return mask
+
+    def room_mask(self, room_id: int) -> int:
+        """
+        房间内所有座位（包括维护中的）的位图
+        """
+        key = (self.version, "room", room_id)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = 0
+            for seat_id, seat in list(self.seats.items()):
+                if seat.room_id == room_id:
+                    mask |= seat_bit(seat_id)
+            self._masks[key] = mask
+        return mask
+
+    def feature_mask(self, features: Iterable[str]) -> int:
+        """
+        同时具有所有给定特性的座位位图，features 为空时返回 -1（所有位为 1）
+        """
+        index = self._feature_index
+        if self._feature_index_version != self.version:
+            index = {}
+            for seat_id, seat in list(self.seats.items()):
+                for feature in seat.features:
+                    index[feature] = index.get(feature, 0) | seat_bit(seat_id)
+            self._feature_index, self._feature_index_version = index, self.version
+        mask = -1
+        for feature in features:
+            mask &= index.get(feature, 0)
+        return mask
+
+    # ==================== 标签查找 ====================
+
+    def seat_number(self, seat_id) -> str:
+        seat = self.seats.get(self._seat_key(seat_id))
+        return seat.seat_number if seat else f"S{seat_id}"
+
+    def location(self, seat_id) -> str:
+        seat = self.seats.get(self._seat_key(seat_id))
+        room = self.rooms.get(seat.room_id) if seat else None
+        return f"{room.name}({room.location})" if room else "未知位置"
+
+    def time_slot(self, time_slot_id) -> str:
+        slot = self.time_slots.get(str(time_slot_id))
+        return f"{slot.start_time}-{slot.end_time}" if slot else "未知时间段"
+
+
+# 全局缓存实例，在 app 的 lifespan 中加载
+reference_cache = ReferenceCache()
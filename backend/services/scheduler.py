@@ -0,0 +1,80 @@
+"""
+Background scheduler for periodic reservation maintenance.
+
+在 app 的 lifespan 中启动，每隔 SCHEDULER_INTERVAL_SECONDS 秒执行一次：
+- 释放时间段开始后超过 NO_SHOW_GRACE_MINUTES 分钟仍未签到的预约，空出的座位分配给候补用户
+- 补齐循环预约规则的滚动窗口
+- 每天一次把 ARCHIVE_AFTER_DAYS 天之前的预约移入归档表
+数据库操作是同步的，放到线程中执行，避免阻塞事件循环。
+"""
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from database import crud
+from database.connection import SessionLocal
+from services.occupancy import occupancy_index
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationScheduler:
+    """预约维护定时任务"""
+
+    def __init__(self, interval_seconds: int):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._archived_on: Optional[date] = None
+
+    def tick(self, now: Optional[datetime] = None) -> int:
+        """
+        执行一次维护任务
+
+        Returns:
+            本次释放的预约数
+        """
+        now = now or datetime.now()
+        db = SessionLocal()
+        try:
+            released = crud.release_no_show_reservations(db, now, settings.NO_SHOW_GRACE_MINUTES)
+            crud.assign_waitlist(db, [(row.date, row.seat_id, row.time_slot_id) for row in released], now)
+            db.commit()
+            crud.expand_due_rules(db, settings.RULE_EXPANSION_DAYS)
+            # 同步其他进程写入的预约变更
+            occupancy_index.sync(db)
+            if self._archived_on != now.date():
+                crud.archive_reservations(db, now.date() - timedelta(days=settings.ARCHIVE_AFTER_DAYS))
+                crud.prune_reservation_events(db, now - timedelta(days=settings.EVENT_RETENTION_DAYS))
+                self._archived_on = now.date()
+            return len(released)
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                released = await asyncio.to_thread(self.tick)
+                if released:
+                    logger.info("释放了 %d 个未签到的预约", released)
+            except Exception:
+                logger.exception("预约维护任务执行失败")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# 全局定时任务实例，在 app 的 lifespan 中启动
+reservation_scheduler = ReservationScheduler(settings.SCHEDULER_INTERVAL_SECONDS)
@@ -0,0 +1,118 @@
+"""
+Spatial index of seat grid positions for nearest-seat recommendations.
+
+每个房间按 BUCKET_SIZE x BUCKET_SIZE 的格子把座位分桶，查找最近的座位时从起点
+所在的桶开始一圈一圈向外扩展，只检查这些桶中的座位，找够 k 个且下一圈不可能更近时停止。
+索引由 reference_cache 中的座位生成，缓存版本变化（座位增删改）后重新生成。
+"""
+import heapq
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from services.reference_cache import ReferenceCache, reference_cache
+
+
+class SeatGrid:
+    """房间内座位位置的分桶索引"""
+
+    # 每个桶覆盖的行数和列数
+    BUCKET_SIZE = 4
+
+    def __init__(self, cache: ReferenceCache):
+        self._cache = cache
+        self._version: Optional[int] = None
+        # room_id -> {(桶行, 桶列): [(行, 列, 座位ID), ...]}
+        self._buckets: Dict[int, Dict[Tuple[int, int], List[Tuple[int, int, int]]]] = {}
+        # room_id -> 桶坐标的范围 (最小行, 最大行, 最小列, 最大列)
+        self._extent: Dict[int, Tuple[int, int, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        if self._version == self._cache.version:
+            return
+        with self._lock:
+            version = self._cache.version
+            buckets: Dict[int, Dict[Tuple[int, int], List[Tuple[int, int, int]]]] = {}
+            for seat_id, seat in list(self._cache.seats.items()):
+                # 没有位置或位置不是整数（例如直接写入数据库的脏数据）的座位不参与推荐
+                if not isinstance(seat.grid_row, int) or not isinstance(seat.grid_col, int):
+                    continue
+                key = (seat.grid_row // self.BUCKET_SIZE, seat.grid_col // self.BUCKET_SIZE)
+                buckets.setdefault(seat.room_id, {}).setdefault(key, []).append(
+                    (seat.grid_row, seat.grid_col, seat_id)
+                )
+            extent = {
+                room_id: (
+                    min(key[0] for key in room), max(key[0] for key in room),
+                    min(key[1] for key in room), max(key[1] for key in room),
+                )
+                for room_id, room in buckets.items()
+            }
+            self._buckets, self._extent, self._version = buckets, extent, version
+
+    def position(self, seat_id: int) -> Optional[Tuple[int, int, int]]:
+        """
+        座位的 (房间ID, 行, 列)，不在缓存中或没有位置时返回 None
+        """
+        seat = self._cache.seats.get(seat_id)
+        if seat is None or not isinstance(seat.grid_row, int) or not isinstance(seat.grid_col, int):
+            return None
+        return seat.room_id, seat.grid_row, seat.grid_col
+
+    def nearest(self, room_id: int, row: int, col: int, candidates: int, k: int) -> List[Tuple[float, int]]:
+        """
+        房间内距离 (row, col) 最近的 k 个候选座位
+
+        Args:
+            room_id: 房间ID
+            row, col: 起点位置
+            candidates: 候选座位位图（第 i 位为 1 表示 ID 为 i 的座位可以推荐）
+            k: 返回的座位数
+
+        Returns:
+            按距离从近到远排列的 (距离, 座位ID) 列表
+        """
+        self._ensure()
+        buckets = self._buckets.get(room_id)
+        if not buckets or k <= 0:
+            return []
+        min_row, max_row, min_col, max_col = self._extent[room_id]
+        center_row, center_col = row // self.BUCKET_SIZE, col // self.BUCKET_SIZE
+        max_ring = max(
+            abs(center_row - min_row), abs(center_row - max_row),
+            abs(center_col - min_col), abs(center_col - max_col),
+        )
+
+        # 保留最近的 k 个（大根堆，堆顶是其中最远的）
+        best: List[Tuple[float, int]] = []
+        for ring in range(max_ring + 1):
+            for key in self._ring(center_row, center_col, ring):
+                for seat_row, seat_col, seat_id in buckets.get(key, ()):
+                    if not candidates >> seat_id & 1:
+                        continue
+                    item = (-math.hypot(seat_row - row, seat_col - col), -seat_id)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+            # 下一圈桶中的座位距离至少为 ring * BUCKET_SIZE + 1
+            if len(best) == k and -best[0][0] <= ring * self.BUCKET_SIZE:
+                break
+        return sorted((-distance, -seat_id) for distance, seat_id in best)
+
+    @staticmethod
+    def _ring(center_row: int, center_col: int, ring: int):
+        if ring == 0:
+            yield center_row, center_col
+            return
+        for bucket_col in range(center_col - ring, center_col + ring + 1):
+            yield center_row - ring, bucket_col
+            yield center_row + ring, bucket_col
+        for bucket_row in range(center_row - ring + 1, center_row + ring):
+            yield bucket_row, center_col - ring
+            yield bucket_row, center_col + ring
+
+
+# 全局索引实例，基于全局的 reference_cache
+seat_grid = SeatGrid(reference_cache)
@@ -11,7 +11,32 @@ class Settings:
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
     
     # 数据库设置
-    DATABASE_URL = "sqlite:///./app.db"
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+
+    # 循环预约规则只提前展开这么多天的预约
+    RULE_EXPANSION_DAYS = int(os.getenv("RULE_EXPANSION_DAYS", "14"))
+
+    # 后台定时任务
+    SCHEDULER_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_INTERVAL_SECONDS", "60"))
+    # 时间段开始后超过这么多分钟仍未签到的预约自动释放
+    NO_SHOW_GRACE_MINUTES = int(os.getenv("NO_SHOW_GRACE_MINUTES", "15"))
+    # 预约日期早于这么多天之前的预约移入归档表 reservation_archive
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+    # 预约变更事件 reservation_events 保留的天数，下游需要在此期限内读取
+    EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "30"))
+
+    # 抢座模式：创建预约请求先进入进程内队列，由固定数量的写入任务批量提交
+    RUSH_MODE = os.getenv("RUSH_MODE", "0") == "1"
+    # 写入任务数量（队列按座位分片，同一座位的请求由同一个任务按顺序处理）
+    RUSH_WRITERS = int(os.getenv("RUSH_WRITERS", "2"))
+    # 排队请求数上限，超过时返回 503
+    RUSH_QUEUE_SIZE = int(os.getenv("RUSH_QUEUE_SIZE", "5000"))
+    # 请求最多等待处理结果的秒数，超时返回排队凭证，客户端轮询结果
+    RUSH_WAIT_SECONDS = float(os.getenv("RUSH_WAIT_SECONDS", "3"))
+
+    # Idempotency-Key 响应缓存：保留时间和最多保存的 key 数量
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
 
 
 # 创建设置实例
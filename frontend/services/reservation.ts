@@ -19,6 +19,17 @@ export interface Reservation {
   updatedAt: string
 }
 
+// 预约分页结果
+export interface ReservationPage {
+  items: Reservation[]
+  next_cursor: string | null
+}
+
+// 重试请求时使用的 Idempotency-Key 请求头
+function idempotencyHeaders(idempotencyKey?: string) {
+  return idempotencyKey ? { headers: { "Idempotency-Key": idempotencyKey } } : {}
+}
+
 // 创建预约请求
 export interface CreateReservationRequest {
   seatId: string
@@ -33,14 +44,23 @@ export const reservationService = {
   /**
    * 获取用户的所有预约
    */
-  getUserReservations: () => {
-    return api.get<Reservation[]>("/reservations/user")
+  getUserReservations: async () => {
+    // 按游标逐页取完
+    const reservations: Reservation[] = []
+    let cursor: string | null = null
+    do {
+      const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : ""
+      const page: ReservationPage = await api.get<ReservationPage>(`/reservations/user${query}`)
+      reservations.push(...page.items)
+      cursor = page.next_cursor
+    } while (cursor)
+    return reservations
   },
 
   /**
    * 创建新预约
    */
-  createReservation: (data: CreateReservationRequest) => {
+  createReservation: (data: CreateReservationRequest, idempotencyKey?: string) => {
     // 如果日期是Date对象，转换为ISO字符串
     // 如果日期是Date对象，转换为本地日期字符串（YYYY-MM-DD格式）
     const formattedData = {
@@ -48,7 +68,8 @@ export const reservationService = {
       // date: data.date instanceof Date ? data.date.toISOString().split("T")[0] : data.date,
       date: data.date instanceof Date ? formatDateToString(data.date) : data.date,
     }
-    return api.post<Reservation>("/reservations", formattedData)
+    // 重试同一次预约时带上相同的 Idempotency-Key，服务端返回第一次的结果
+    return api.post<Reservation>("/reservations", formattedData, idempotencyHeaders(idempotencyKey))
   },
 
   /**
@@ -68,15 +89,17 @@ export const reservationService = {
   /**
    * 获取最近的预约
    */
-  getRecentReservations: (limit = 5) => {
-    return api.get<Reservation[]>(`/reservations/recent?limit=${limit}`)
+  getRecentReservations: async (limit = 5) => {
+    const page = await api.get<ReservationPage>(`/reservations/recent?limit=${limit}`)
+    return page.items
   },
 
   /**
    * 获取所有最近的预约（管理员用）
    */
-  getAllRecentReservations: (limit = 5) => {
-    return api.get<Reservation[]>(`/reservations/all/recent?limit=${limit}`)
+  getAllRecentReservations: async (limit = 5) => {
+    const page = await api.get<ReservationPage>(`/reservations/all/recent?limit=${limit}`)
+    return page.items
   },
 
   /**
@@ -89,8 +112,8 @@ export const reservationService = {
   /**
    * 签到
    */
-  checkin: (id: string) => {
-    return api.post<Reservation>(`/reservations/${id}/checkin`)
+  checkin: (id: string, idempotencyKey?: string) => {
+    return api.post<Reservation>(`/reservations/${id}/checkin`, undefined, idempotencyHeaders(idempotencyKey))
   },
 
   /**
@@ -11,6 +11,43 @@ export interface Seat {
   status: SeatStatus
   features: string[]
   description?: string
+  row?: number | null
+  col?: number | null
+}
+
+// 房间座位图（列式数据），用 decodeSeatMap 转换为座位列表
+export interface SeatMap {
+  roomId: number
+  date: string | null
+  slot: string | null
+  ids: number[]
+  numbers: string[]
+  rows: (number | null)[]
+  cols: (number | null)[]
+  status: string // base64，每个座位 2 位，对应 statusLabels 中的下标
+  statusLabels: SeatStatus[]
+}
+
+export interface SeatMapCell {
+  id: string
+  number: string
+  row: number | null
+  col: number | null
+  status: SeatStatus
+}
+
+/**
+ * 把座位图的列式数据转换为座位列表
+ */
+export const decodeSeatMap = (map: SeatMap): SeatMapCell[] => {
+  const packed = Uint8Array.from(atob(map.status), (c) => c.charCodeAt(0))
+  return map.ids.map((id, i) => ({
+    id: String(id),
+    number: map.numbers[i],
+    row: map.rows[i],
+    col: map.cols[i],
+    status: map.statusLabels[(packed[i >> 2] >> ((i & 3) * 2)) & 3],
+  }))
 }
 
 // 创建座位请求
@@ -69,6 +106,27 @@ export const seatService = {
     return api.delete(`/seats/${id}`)
   },
 
+  /**
+   * 推荐距离参照座位（默认为最常坐的座位）最近的可用座位
+   */
+  recommendSeats: (date: string, timeSlotId: string, features: string[] = [], nearSeatId?: string, k = 5) => {
+    const params = new URLSearchParams({ date, timeSlotId, k: String(k) })
+    if (features.length > 0) params.set("features", features.join(","))
+    if (nearSeatId) params.set("nearSeatId", nearSeatId)
+    return api.get<(Seat & { distance: number | null })[]>(`/seats/recommend?${params.toString()}`)
+  },
+
+  /**
+   * 获取房间座位图，指定日期和时间段时标出已被预约的座位
+   */
+  getSeatMap: (roomId: string, date?: string, slot?: string) => {
+    const params = new URLSearchParams()
+    if (date) params.set("date", date)
+    if (slot) params.set("slot", slot)
+    const query = params.toString()
+    return api.get<SeatMap>(`/rooms/${roomId}/seat-map${query ? `?${query}` : ""}`)
+  },
+
   /**
    * 获取座位详情
    */
@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pytest
+
+# 进程内测试使用独立的临时数据库，避免改动 backend/app.db
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import app
+from auth.dependencies import get_current_user_id
+from database import Base, engine, create_tables
+from database.connection import SessionLocal
+import database.models as models
+
+TEST_USER_ID = "1"
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(bind=engine)
+    create_tables()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(db):
+    app.dependency_overrides[get_current_user_id] = lambda: TEST_USER_ID
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def seed(db):
+    """
+    一个用户、一个房间、一个座位、一个时间段
+    """
+    user = models.User(id=1, name="张三", email="user@example.com", hashed_password="password123")
+    room = models.Room(id=1, name="图书馆一楼", location="主校区", capacity=50)
+    seat = models.Seat(id=1, room_id=1, seat_number="A1", is_available=1, features=["靠窗"])
+    time_slot = models.TimeSlot(id="1", start_time="08:00", end_time="10:00", name="上午场次1")
+    db.add_all([user, room, seat, time_slot])
+    db.commit()
+    return {"user": user, "room": room, "seat": seat, "time_slot": time_slot}
+
+
+def make_admin(db, user_id=1):
+    db.query(models.User).filter(models.User.id == user_id).update({"is_admin": True})
+    db.commit()
+
+
+def add_reservations(db, count, seat_id=1, time_slot_id="1", user_id=1, status=models.ReservationStatus.RESERVED, start_day=0):
+    start = date.today() + timedelta(days=start_day)
+    now = datetime.now()
+    reservations = [
+        models.Reservation(
+            user_id=user_id,
+            seat_id=seat_id,
+            date=start + timedelta(days=i),
+            time_slot_id=time_slot_id,
+            status=status,
+            created_at=now + timedelta(seconds=i),
+            updated_at=now + timedelta(seconds=i),
+        )
+        for i in range(count)
+    ]
+    db.add_all(reservations)
+    db.commit()
+    return reservations
+
+
+@pytest.fixture
+def count_queries():
+    """
+    统计执行的 SQL 语句数量
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+
+from conftest import add_reservations, make_admin
+import database.models as models
+
+
+def test_export_reservations(client, seed, db):
+    add_reservations(db, 3)
+    assert client.get("/api/admin/reservations/export").status_code == 403
+
+    db.query(models.User).filter(models.User.id == 1).update({"is_admin": True})
+    db.commit()
+    response = client.get("/api/admin/reservations/export?format=csv")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text.lstrip("\ufeff"))))
+    assert len(rows) == 3
+    assert (rows[0]["room"], rows[0]["seatNumber"], rows[0]["timeSlot"]) == ("图书馆一楼", "A1", "08:00-10:00")
+
+    response = client.get("/api/admin/reservations/export?format=ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert lines[0]["status"] == "已预约"
+    assert client.get("/api/admin/reservations/export?format=xml").status_code == 422
+
+
+def test_export_does_not_block_writes(seed, db, monkeypatch):
+    from sqlalchemy import text
+    from routes import admin
+
+    monkeypatch.setattr(admin, "EXPORT_BATCH_SIZE", 2)
+    reservations = add_reservations(db, 5)
+    chunks = admin.stream_reservation_export(None, None, "ndjson")
+    first = next(chunks)
+
+    # 导出进行中提交写入，不等待锁
+    db.execute(text("PRAGMA busy_timeout = 0"))
+    db.query(models.Reservation).filter(models.Reservation.id == reservations[0].id).update(
+        {"status": models.ReservationStatus.CANCELLED}
+    )
+    db.commit()
+
+    lines = [json.loads(line) for chunk in [first, *chunks] for line in chunk.splitlines()]
+    assert sorted(line["id"] for line in lines) == sorted(r.id for r in reservations)
+
+
+def test_reservation_events(client, seed, db):
+    created = [
+        client.post("/api/reservations/", json={"seatId": "1", "date": date, "timeSlotId": "1"}).json()
+        for date in ("2030-01-01", "2030-01-02")
+    ]
+    client.post(f"/api/reservations/{created[0]['id']}/checkin")
+    client.delete(f"/api/reservations/{created[1]['id']}")
+    assert client.get("/api/admin/reservations/events").status_code == 403
+
+    db.query(models.User).filter(models.User.id == 1).update({"is_admin": True})
+    db.commit()
+    page = client.get("/api/admin/reservations/events").json()
+    assert [(e["reservationId"], e["oldStatus"], e["newStatus"]) for e in page["items"]] == [
+        (created[0]["id"], None, "已预约"),
+        (created[1]["id"], None, "已预约"),
+        (created[0]["id"], "已预约", "已签到"),
+        (created[1]["id"], "已预约", "已取消"),
+    ]
+    assert page["lastSeq"] == page["items"][-1]["seq"]
+
+    after = page["items"][1]["seq"]
+    rest = client.get(f"/api/admin/reservations/events?after={after}&limit=1").json()
+    assert [e["newStatus"] for e in rest["items"]] == ["已签到"]
+    assert client.get(f"/api/admin/reservations/events?after={page['lastSeq']}").json() == {
+        "items": [], "lastSeq": page["lastSeq"],
+    }
+
+
+def test_archive_reservations_requires_admin(client, seed, db):
+    add_reservations(db, 2, start_day=-10)
+    assert client.post("/api/admin/reservations/archive?days=1").status_code == 403
+    assert db.query(models.Reservation).count() == 2
+
+    make_admin(db)
+    assert client.post("/api/admin/reservations/archive?days=1").json() == {"archived": 2}
+    assert db.query(models.Reservation).count() == 0
@@ -0,0 +1,451 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from conftest import add_reservations, make_admin
+import database.models as models
+
+
+def test_get_user_reservations(client, seed, db):
+    add_reservations(db, 3)
+    response = client.get("/api/reservations/user")
+    assert response.status_code == 200
+    data = response.json()["items"]
+    assert len(data) == 3
+    assert data[0]["seatNumber"] == "A1"
+    assert data[0]["location"] == "图书馆一楼(主校区)"
+    assert data[0]["timeSlot"] == "08:00-10:00"
+
+
+def test_get_user_reservations_query_count(client, seed, db, count_queries):
+    # 查询次数不随预约数量增长（第一次请求会加载座位/时间段缓存）
+    add_reservations(db, 1)
+    client.get("/api/reservations/user")
+    count_queries.clear()
+    client.get("/api/reservations/user")
+    single = len(count_queries)
+
+    add_reservations(db, 200, start_day=1)
+    count_queries.clear()
+    response = client.get("/api/reservations/user?limit=200")
+    assert len(response.json()["items"]) == 200
+    assert len(count_queries) == single == 1
+
+
+def test_reservation_cursor_pagination(client, seed, db):
+    add_reservations(db, 7)
+    seen = []
+    cursor = None
+    while True:
+        url = "/api/reservations/user?limit=3" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url).json()
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 7
+    created = [r["createdAt"] for r in client.get("/api/reservations/all/recent?limit=7").json()["items"]]
+    assert created == sorted(created, reverse=True)
+
+    response = client.get("/api/reservations/user?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+def test_reference_cache_follows_seat_writes(client, seed, db):
+    add_reservations(db, 1, seat_id=2)
+    response = client.post("/api/seats/", json={"number": "B7", "locationId": 1, "features": ["靠窗"]})
+    assert response.status_code == 201
+    assert response.json()["id"] == "2"
+    data = client.get("/api/reservations/user").json()["items"]
+    assert data[0]["seatNumber"] == "B7"
+    assert data[0]["location"] == "图书馆一楼(主校区)"
+
+
+def test_reference_cache_remembers_missing_keys(seed, db, count_queries):
+    from services.reference_cache import ReferenceCache
+
+    cache = ReferenceCache()
+    cache.load(db)
+    # 交替查询两个不存在的座位：每个只在第一次查询时重新加载
+    cache.ensure(db, seat_id=998)
+    cache.ensure(db, seat_id=999)
+    count_queries.clear()
+    cache.ensure(db, seat_id=998)
+    cache.ensure(db, seat_id=999, time_slot_id="missing")
+    cache.ensure(db, time_slot_id="missing")
+    assert len(count_queries) == 3  # 只有第一次查询 time_slot_id="missing" 时整体加载一次
+
+    # 写接口修改后重新确认
+    cache.remove_seat(1)
+    count_queries.clear()
+    cache.ensure(db, seat_id=998)
+    assert len(count_queries) == 3
+
+
+def test_create_reservation_conflict(client, seed, db):
+    payload = {"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"}
+    first = client.post("/api/reservations/", json=payload)
+    assert first.status_code == 201
+    assert client.post("/api/reservations/", json=payload).status_code == 409
+
+    # 取消后座位可以被重新预约
+    assert client.delete(f"/api/reservations/{first.json()['id']}").status_code == 200
+    assert client.post("/api/reservations/", json=payload).status_code == 201
+
+
+def test_reservation_indexes_present(db):
+    from database import engine, check_indexes
+
+    assert check_indexes(engine) == []
+
+
+def test_checkin_stats(client, seed, db):
+    add_reservations(db, 3)
+    add_reservations(db, 2, status=models.ReservationStatus.CHECKED_IN, start_day=10)
+    # 直接写入的预约需要重建汇总表（仅管理员）
+    assert client.post("/api/admin/checkin-rollup/rebuild").status_code == 403
+    make_admin(db)
+    assert client.post("/api/admin/checkin-rollup/rebuild").status_code == 200
+    stats = client.get("/api/reservations/checkin-stats").json()
+    assert stats == [{"name": "图书馆一楼", "total": 5, "checkedIn": 2}]
+
+    date_from = (date.today() + timedelta(days=10)).isoformat()
+    stats = client.get(f"/api/reservations/checkin-stats?date_from={date_from}").json()
+    assert stats == [{"name": "图书馆一楼", "total": 2, "checkedIn": 2}]
+    assert client.get("/api/reservations/checkin-stats?room_id=2").json() == []
+
+
+def test_checkin_rollup_follows_writes(client, seed, db):
+    today = date.today().isoformat()
+    created = [
+        client.post("/api/reservations/", json={"seatId": "1", "date": today, "timeSlotId": "1"}),
+        client.post("/api/reservations/", json={"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"}),
+    ]
+    client.post(f"/api/reservations/{created[0].json()['id']}/checkin")
+    cancelled = client.delete(f"/api/reservations/{created[1].json()['id']}")
+    assert cancelled.json()["status"] == "已取消"
+    assert client.delete(f"/api/reservations/{created[1].json()['id']}").status_code == 400
+
+    rollup = lambda: sorted(
+        (r.date, r.room_id, r.time_slot_id, r.total, r.checked_in, r.cancelled)
+        for r in db.query(models.CheckinRollup).all()
+    )
+    incremental = rollup()
+    assert incremental == [
+        (date.today(), 1, "1", 1, 1, 0),
+        (date(2030, 1, 1), 1, "1", 0, 0, 1),
+    ]
+    make_admin(db)
+    assert client.post("/api/admin/checkin-rollup/rebuild").status_code == 200
+    db.expire_all()
+    assert rollup() == incremental
+    assert client.get("/api/admin/dashboard-stats").json()["todayCheckinRate"] == 100
+
+
+def test_crud_reservation_status_vocabulary(seed, db):
+    from database import crud
+
+    reservation = crud.create_reservation(db, 1, 1, date(2030, 1, 1), "1")
+    assert reservation.status == models.ReservationStatus.RESERVED
+    add_reservations(db, 1, status=models.ReservationStatus.CHECKED_IN, start_day=1)
+    add_reservations(db, 1, status=models.ReservationStatus.CANCELLED, start_day=2)
+    assert crud.get_reservation_stats(db) == [
+        {"name": "待确认预约", "total": 0},
+        {"name": "已确认预约", "total": 2},
+        {"name": "已取消预约", "total": 1},
+        {"name": "总预约数", "total": 3},
+    ]
+
+
+def test_create_reservations_batch(client, seed, db, count_queries):
+    client.post("/api/reservations/", json={"seatId": "1", "date": "2030-01-02", "timeSlotId": "1"})
+    items = [{"seatId": "1", "date": f"2030-01-0{day}", "timeSlotId": "1"} for day in (1, 2, 3, 1)]
+    count_queries.clear()
+    response = client.post("/api/reservations/batch", json={"items": items})
+    assert response.status_code == 201
+    data = response.json()
+    assert data["created"] == 2
+    assert [r["result"] for r in data["results"]] == ["created", "conflict", "created", "duplicate"]
+    assert data["results"][0]["reservation"]["date"] == "2030-01-01"
+    inserts = [s for s in count_queries if s.startswith("INSERT OR IGNORE INTO reservations")]
+    assert len(inserts) == 1
+
+
+def test_reservations_for_unknown_seat_or_slot(client, seed, db):
+    items = [
+        {"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"},
+        {"seatId": "99", "date": "2030-01-01", "timeSlotId": "1"},
+        {"seatId": "1", "date": "2030-01-01", "timeSlotId": "9"},
+    ]
+    data = client.post("/api/reservations/batch", json={"items": items}).json()
+    assert data["created"] == 1
+    assert [(r["result"], r.get("detail")) for r in data["results"]] == [
+        ("created", None), ("not_found", "座位不存在"), ("not_found", "时间段不存在"),
+    ]
+
+    response = client.post("/api/reservations/", json={**items[1], "date": "2030-01-02"})
+    assert (response.status_code, response.json()["detail"]) == (404, "座位不存在")
+    response = client.post("/api/reservations/rules", json={
+        "seatId": "1", "timeSlotId": "9", "weekdays": [0],
+        "startDate": "2030-01-01", "endDate": "2030-01-31",
+    })
+    assert response.status_code == 404
+    assert db.query(models.Reservation).count() == 1
+
+
+def test_reservation_rule_rolling_expansion(client, seed, db):
+    from database import crud
+    from settings import settings
+
+    today = date.today()
+    client.post("/api/reservations/", json={
+        "seatId": "1", "date": (today + timedelta(days=2)).isoformat(), "timeSlotId": "1",
+    })
+    response = client.post("/api/reservations/rules", json={
+        "seatId": "1",
+        "timeSlotId": "1",
+        "weekdays": [0, 1, 2, 3, 4, 5, 6],
+        "startDate": today.isoformat(),
+        "endDate": (today + timedelta(days=60)).isoformat(),
+    })
+    assert response.status_code == 201
+    data = response.json()
+    window = settings.RULE_EXPANSION_DAYS
+    assert (data["created"], data["conflicts"]) == (window, 1)
+    assert data["rule"]["materializedUntil"] == (today + timedelta(days=window)).isoformat()
+
+    # 窗口向前滚动时只展开新增的日期
+    assert crud.expand_due_rules(db, window + 5) == 5
+
+    rule_id = data["rule"]["id"]
+    deleted = client.delete(f"/api/reservations/rules/{rule_id}").json()
+    assert deleted["rule"]["isActive"] is False
+    # 今天的预约保留，之后的全部取消
+    assert deleted["cancelled"] == window + 5 - 1
+
+
+def test_checkin_reservations_batch(client, seed, db, count_queries):
+    reservations = add_reservations(db, 3)
+    add_reservations(db, 1, user_id=2, start_day=5)
+    other = db.query(models.Reservation).filter(models.Reservation.user_id == 2).one()
+    ids = [r.id for r in reservations]
+    client.post(f"/api/reservations/{ids[2]}/checkin")
+
+    count_queries.clear()
+    response = client.post("/api/reservations/checkin/batch", json={
+        "ids": [ids[0], ids[1], ids[2], other.id, "missing"],
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["checkedIn"] == 2
+    assert [r["result"] for r in data["results"]] == [
+        "checked_in", "checked_in", "invalid_status", "forbidden", "not_found",
+    ]
+    assert len([s for s in count_queries if s.startswith("UPDATE reservations")]) == 1
+
+
+def test_reservations_of_deleted_seat(client, seed, db):
+    from datetime import datetime
+    from database import crud
+    from services.scheduler import ReservationScheduler
+
+    add_reservations(db, 3, start_day=-1)
+    db.query(models.Reservation).update({"created_at": datetime.now() - timedelta(days=3)})
+    db.commit()
+    # 删除座位后其预约的 seat_id 被置空
+    assert client.delete("/api/seats/1").status_code == 204
+    db.expire_all()
+    reservations = db.query(models.Reservation).order_by(models.Reservation.date).all()
+    assert {r.seat_id for r in reservations} == {None}
+
+    assert client.delete(f"/api/reservations/{reservations[2].id}").status_code == 200
+    # 昨天未签到的预约照常释放，定时任务不会因为空座位而中断
+    now = datetime.combine(date.today(), datetime.min.time()).replace(hour=8, minute=10)
+    assert ReservationScheduler(60).tick(now) == 1
+
+    # 没有对应座位的变化只写事件，不更新汇总表
+    crud.record_reservation_changes(db, [crud.ReservationChange(
+        "missing", 1, date.today(), 999, "1", None, models.ReservationStatus.RESERVED
+    )])
+    db.commit()
+    assert db.query(models.CheckinRollup).count() == 0
+
+
+def test_release_no_show_reservations(seed, db):
+    from datetime import datetime
+    from database import crud
+    from services.scheduler import ReservationScheduler
+
+    today = date.today()
+    add_reservations(db, 1, start_day=-1)
+    add_reservations(db, 2, start_day=0)
+    add_reservations(db, 1, status=models.ReservationStatus.CHECKED_IN, start_day=-2)
+    db.query(models.Reservation).update({"created_at": datetime.combine(today - timedelta(days=3), datetime.min.time())})
+    crud.rebuild_checkin_rollup(db)
+    db.commit()
+
+    # 08:00 开始的时间段，08:10 还在宽限期内，只释放昨天的预约
+    released = crud.release_no_show_reservations(db, datetime.combine(today, datetime.min.time()).replace(hour=8, minute=10), 15)
+    db.commit()
+    assert [r.date for r in released] == [today - timedelta(days=1)]
+
+    # 08:20 超过宽限期，释放今天的预约；明天和已签到的预约不受影响
+    assert ReservationScheduler(60).tick(datetime.combine(today, datetime.min.time()).replace(hour=8, minute=20)) == 1
+    db.expire_all()
+    statuses = sorted((r.date, r.status.label) for r in db.query(models.Reservation).all())
+    assert statuses == [
+        (today - timedelta(days=2), "已签到"),
+        (today - timedelta(days=1), "已取消"),
+        (today, "已取消"),
+        (today + timedelta(days=1), "已预约"),
+    ]
+    rollup = db.query(models.CheckinRollup).filter(models.CheckinRollup.date == today).one()
+    assert (rollup.total, rollup.cancelled) == (0, 1)
+
+
+def test_archive_reservations(client, seed, db):
+    from database import crud
+    from settings import settings
+
+    add_reservations(db, 3, start_day=-settings.ARCHIVE_AFTER_DAYS - 2)
+    add_reservations(db, 2, status=models.ReservationStatus.CHECKED_IN, start_day=0)
+    crud.rebuild_checkin_rollup(db)
+    before = client.get("/api/reservations/checkin-stats").json()
+
+    archived_before = date.today() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    assert crud.archive_reservations(db, archived_before) == 2
+    assert db.query(models.Reservation).count() == 3
+    assert db.query(models.ReservationArchive).filter(
+        models.ReservationArchive.archive_month == (archived_before - timedelta(days=2)).strftime("%Y-%m")
+    ).count() >= 1
+
+    # 默认只查热表，查询旧日期时合并归档表
+    assert len(client.get("/api/reservations/user").json()["items"]) == 3
+    old_from = (archived_before - timedelta(days=10)).isoformat()
+    items = client.get(f"/api/reservations/user?date_from={old_from}&limit=2").json()
+    assert len(items["items"]) == 2
+    rest = client.get(f"/api/reservations/user?date_from={old_from}&cursor={items['next_cursor']}").json()
+    assert len(rest["items"]) == 3
+    old_to = (archived_before - timedelta(days=1)).isoformat()
+    archived = client.get(f"/api/reservations/user?date_from={old_from}&date_to={old_to}").json()["items"]
+    assert len(archived) == 2
+    assert client.get(f"/api/reservations/{archived[0]['id']}").json()["seatNumber"] == "A1"
+
+    # 重建汇总表时包含归档的预约
+    make_admin(db)
+    assert client.post("/api/admin/checkin-rollup/rebuild").status_code == 200
+    assert client.get("/api/reservations/checkin-stats").json() == before
+
+
+def test_reservation_status_transitions(client, seed, db):
+    reservation = add_reservations(db, 1, status=models.ReservationStatus.CHECKED_IN)[0]
+    # 状态转换表统一检查，接口仍返回中文名称
+    with pytest.raises(ValueError):
+        reservation.status = models.ReservationStatus.CANCELLED
+    db.rollback()
+    assert client.delete(f"/api/reservations/{reservation.id}").status_code == 400
+    assert client.get(f"/api/reservations/{reservation.id}").json()["status"] == "已签到"
+    assert db.execute(text("SELECT typeof(status) FROM reservations")).scalar() == "integer"
+
+
+def test_reservation_version_conflicts(client, seed, db):
+    from database import crud
+    from sqlalchemy.orm.exc import StaleDataError
+
+    reservations = add_reservations(db, 2)
+    first = client.get(f"/api/reservations/{reservations[0].id}").json()
+    assert first["version"] == 1
+
+    # 客户端看到的版本已经过期
+    assert client.post(f"/api/reservations/{first['id']}/checkin").json()["version"] == 2
+    assert client.delete(f"/api/reservations/{first['id']}?version=1").status_code == 409
+
+    # 读取之后被其他请求修改：带 version 条件的 UPDATE 不会覆盖
+    stale = db.query(models.Reservation).filter(models.Reservation.id == reservations[1].id).one()
+    stale_row = db.query(
+        models.Reservation.id, models.Reservation.version, models.Reservation.date,
+        models.Reservation.seat_id, models.Reservation.time_slot_id, models.Reservation.status,
+    ).filter(models.Reservation.id == stale.id).one()
+    assert client.delete(f"/api/reservations/{stale.id}").status_code == 200
+    assert crud.checkin_reservations(db, [stale_row]) == set()
+    stale.status = models.ReservationStatus.CHECKED_IN
+    with pytest.raises(StaleDataError):
+        db.commit()
+
+
+def test_concurrent_cancel_returns_conflict(client, seed, db, monkeypatch):
+    from database import crud
+    from database.connection import SessionLocal
+
+    reservation = add_reservations(db, 1)[0]
+    record = crud.record_reservation_changes
+
+    def record_after_concurrent_update(session, changes):
+        # 路由读取预约之后、取消的 UPDATE 执行之前，另一个会话修改了这条预约
+        other = SessionLocal()
+        try:
+            other.query(models.Reservation).filter(models.Reservation.id == reservation.id).update(
+                {"version": models.Reservation.version + 1}, synchronize_session=False
+            )
+            other.commit()
+        finally:
+            other.close()
+        return record(session, changes)
+
+    monkeypatch.setattr(crud, "record_reservation_changes", record_after_concurrent_update)
+    response = client.delete(f"/api/reservations/{reservation.id}")
+    assert response.status_code == 409
+    db.expire_all()
+    assert db.get(models.Reservation, reservation.id).status == models.ReservationStatus.RESERVED
+
+
+def test_rush_mode_booking_queue(client, seed, db, monkeypatch):
+    import time
+    from settings import settings
+
+    monkeypatch.setattr(settings, "RUSH_MODE", True)
+    payload = {"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"}
+    first = client.post("/api/reservations/", json=payload)
+    assert first.status_code == 201
+    assert first.json()["status"] == "已预约"
+    assert client.post("/api/reservations/", json=payload).status_code == 409
+
+    # 等待超时时返回排队凭证，客户端轮询结果
+    monkeypatch.setattr(settings, "RUSH_WAIT_SECONDS", 0)
+    queued = client.post("/api/reservations/", json={**payload, "date": "2030-01-02"})
+    assert queued.status_code == 202
+    ticket_id = queued.json()["ticketId"]
+    for _ in range(50):
+        ticket = client.get(f"/api/reservations/tickets/{ticket_id}").json()
+        if ticket["status"] != "queued":
+            break
+        time.sleep(0.05)
+    assert ticket["status"] == "created"
+    assert ticket["reservation"]["date"] == "2030-01-02"
+
+
+def test_idempotency_key(client, seed, db, count_queries):
+    payload = {"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"}
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post("/api/reservations/", json=payload, headers=headers)
+    assert first.status_code == 201
+
+    # 重试返回第一次的结果，不访问预约表
+    count_queries.clear()
+    retry = client.post("/api/reservations/", json=payload, headers=headers)
+    assert (retry.status_code, retry.json()) == (201, first.json())
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert not [s for s in count_queries if "reservations" in s]
+    assert db.query(models.Reservation).count() == 1
+
+    other = {**payload, "date": "2030-01-02"}
+    assert client.post("/api/reservations/", json=other, headers=headers).status_code == 422
+    # 没有 key 的重复请求仍然冲突
+    assert client.post("/api/reservations/", json=payload).status_code == 409
+
+    reservation_id = first.json()["id"]
+    checkin_headers = {"Idempotency-Key": "checkin-1"}
+    assert client.post(f"/api/reservations/{reservation_id}/checkin", headers=checkin_headers).status_code == 200
+    retry = client.post(f"/api/reservations/{reservation_id}/checkin", headers=checkin_headers)
+    assert (retry.status_code, retry.json()["status"]) == (200, "已签到")
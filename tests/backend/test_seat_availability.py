@@ -0,0 +1,216 @@
+import base64
+import math
+import random
+from datetime import date, timedelta
+
+from conftest import add_reservations
+import database.models as models
+from database.migrations import parse_legacy_features
+from services.reference_cache import ReferenceCache, SeatInfo, reference_cache
+from services.seat_grid import SeatGrid
+
+
+def add_seats(db):
+    db.add_all([
+        models.Seat(id=2, room_id=1, seat_number="A2", is_available=1, features=["电源插座"]),
+        models.Seat(id=3, room_id=1, seat_number="A3", is_available=0, features=["靠窗"]),
+    ])
+    db.commit()
+    # 直接写入数据库的座位需要重新加载缓存（接口创建的座位会同步缓存）
+    reference_cache.load(db)
+
+
+def test_available_seats_by_date_and_slot(client, seed, db):
+    add_seats(db)
+    client.post("/api/reservations/", json={"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"})
+
+    numbers = lambda query: [seat["number"] for seat in client.get(f"/api/seats/available?{query}").json()]
+    assert numbers("date=2030-01-01&timeSlotId=1") == ["A2"]
+    assert numbers("date=2030-01-02&timeSlotId=1") == ["A1", "A2"]
+    assert numbers("date=2030-01-01") == ["A1", "A2"]
+    assert numbers("date=2030-01-02&timeSlotId=1&features=靠窗") == ["A1"]
+    assert numbers("date=2030-01-02&timeSlotId=1&features=电源插座") == ["A2"]
+    assert numbers("date=2030-01-02&timeSlotId=1&features=靠窗,电源插座") == []
+    assert numbers("date=2030-01-02&timeSlotId=1&roomId=2") == []
+    assert numbers("date=2030-01-02&timeSlotId=1&skip=1&limit=1") == ["A2"]
+    assert client.get("/api/seats/available?date=tomorrow").status_code == 422
+
+
+def test_occupancy_index_follows_writes(client, seed, db):
+    add_seats(db)
+    day = (date.today() + timedelta(days=1)).isoformat()
+    created = client.post("/api/reservations/", json={"seatId": "1", "date": day, "timeSlotId": "1"}).json()
+    assert [s["number"] for s in client.get(f"/api/seats/available?date={day}&timeSlotId=1").json()] == ["A2"]
+    assert client.get(f"/api/time-slots/available?date={day}&seatId=1").json() == []
+    assert client.get(f"/api/time-slots/available?date={day}").json() == [{"id": "1", "slot": "08:00 - 10:00"}]
+
+    client.delete(f"/api/reservations/{created['id']}")
+    assert [s["number"] for s in client.get(f"/api/seats/available?date={day}&timeSlotId=1").json()] == ["A1", "A2"]
+    assert client.get(f"/api/time-slots/available?date={day}&seatId=-1").status_code == 422
+    assert client.get(f"/api/time-slots/available?date={day}&seatId=2000000000").status_code == 404
+    assert client.get(f"/api/time-slots/available?date={day}&seatId=1").json() == [{"id": "1", "slot": "08:00 - 10:00"}]
+
+
+def test_occupancy_consistency_check(client, seed, db):
+    db.query(models.User).filter(models.User.id == 1).update({"is_admin": True})
+    db.commit()
+    client.post("/api/reservations/", json={"seatId": "1", "date": date.today().isoformat(), "timeSlotId": "1"})
+    assert client.get("/api/admin/dashboard-stats").json()["todayReservedSeats"] == 1
+    assert client.get("/api/admin/occupancy/check").json()["consistent"] is True
+
+    # 绕过变更事件直接写入的预约不会进入位图
+    add_reservations(db, 1, start_day=1)
+    check = client.get("/api/admin/occupancy/check?repair=true").json()
+    assert check["mismatches"] == [{
+        "date": (date.today() + timedelta(days=1)).isoformat(), "timeSlotId": "1", "missing": [1], "extra": [],
+    }]
+    assert check["repaired"] is True
+    assert client.get("/api/admin/occupancy/check").json()["consistent"] is True
+
+
+def test_occupancy_ignores_out_of_range_seat_ids(client, seed, db):
+    from database import crud
+    from services.occupancy import OccupancyIndex
+
+    index = OccupancyIndex()
+    day = date.today() + timedelta(days=1)
+    huge = (1 << 63) - 1
+    reservation, = add_reservations(db, 1, seat_id=1 << 40, start_day=1)
+    crud.record_reservation_changes(db, [crud.ReservationChange(
+        reservation.id, 1, day, huge, "1", None, models.ReservationStatus.RESERVED,
+    )])
+    db.commit()
+    index.load(db)
+    index.sync(db)
+    assert index.occupied(db, day, "1") == 0
+    assert index.check(db) == []
+
+    # 缓存中 ID 很大的座位也不进入位图
+    cache = ReferenceCache()
+    cache.seats = {1: SeatInfo("A1", 1, features=("靠窗",)), huge: SeatInfo("Z9", 1, features=("靠窗",))}
+    assert cache.seat_mask() == cache.room_mask(1) == cache.feature_mask(["靠窗"]) == 0b10
+
+
+def test_seat_features_json(client, seed, db):
+    assert parse_legacy_features("['靠窗', '电源插座']") == ["靠窗", "电源插座"]
+    assert parse_legacy_features('["靠窗"]') == ["靠窗"]
+    assert parse_legacy_features("靠窗") == ["靠窗"]
+    assert parse_legacy_features('"靠窗"') == ["靠窗"]
+    assert parse_legacy_features(" ") == []
+    assert parse_legacy_features(None) == []
+
+    add_seats(db)
+    assert client.get("/api/seats/1").json()["features"] == ["靠窗"]
+    create = lambda features: client.post("/api/seats/", json={"number": "C1", "locationId": 1, "features": features})
+    assert create("靠窗").json()["features"] == ["靠窗"]
+    assert create(["靠窗", "电源插座"]).json()["features"] == ["靠窗", "电源插座"]
+    assert create(None).json()["features"] == []
+    assert create({"靠窗": True}).status_code == 422
+    assert create(["靠窗", 1]).status_code == 422
+
+
+def test_seat_list_etag(client, seed, db, count_queries):
+    add_seats(db)
+    count_queries.clear()
+    response = client.get("/api/seats/")
+    assert [seat["location"] for seat in response.json()] == ["图书馆一楼"] * 3
+    selects = [s for s in count_queries if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 3  # 两次版本查询 + 一次列表查询，与座位数无关
+    etag = response.headers["ETag"]
+
+    count_queries.clear()
+    cached = client.get("/api/seats/", headers={"If-None-Match": f"W/{etag}"})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    assert len(count_queries) == 2
+
+    client.patch("/api/seats/2/status", json={"status": "维护中"})
+    changed = client.get("/api/seats/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_room_seat_map(client, seed, db):
+    add_seats(db)
+    client.post("/api/reservations/", json={"seatId": "2", "date": "2030-01-01", "timeSlotId": "1"})
+    response = client.get("/api/rooms/1/seat-map?date=2030-01-01&slot=1")
+    seat_map = response.json()
+    assert seat_map["ids"] == [1, 2, 3]
+    assert (seat_map["rows"], seat_map["cols"]) == ([None] * 3, [None] * 3)
+    # 可用(0)、已预约(1)、维护中(2)，每个座位 2 位
+    assert base64.b64decode(seat_map["status"]) == bytes([0b100100])
+    assert client.get("/api/rooms/1/seat-map").json()["status"] == base64.b64encode(bytes([0b100000])).decode()
+
+    etag = response.headers["ETag"]
+    assert client.get(
+        "/api/rooms/1/seat-map?date=2030-01-01&slot=1", headers={"If-None-Match": etag}
+    ).status_code == 304
+    client.post("/api/reservations/", json={"seatId": "1", "date": "2030-01-01", "timeSlotId": "1"})
+    assert client.get(
+        "/api/rooms/1/seat-map?date=2030-01-01&slot=1", headers={"If-None-Match": etag}
+    ).status_code == 200
+
+    created = client.post("/api/seats/", json={"number": "C4", "locationId": 1, "features": []}).json()
+    assert (created["row"], created["col"]) == (2, 3)
+    assert client.get("/api/rooms/9/seat-map").status_code == 404
+
+
+def test_recommend_nearest_free_seats(client, seed, db):
+    db.query(models.Seat).filter(models.Seat.id == 1).update({"grid_row": 0, "grid_col": 0})
+    db.add_all([
+        models.Seat(id=2, room_id=1, seat_number="A2", is_available=1, features=["电源插座"], grid_row=0, grid_col=1),
+        models.Seat(id=3, room_id=1, seat_number="A3", is_available=0, features=["靠窗"], grid_row=0, grid_col=2),
+        models.Seat(id=4, room_id=1, seat_number="B1", is_available=1, features=["靠窗"], grid_row=1, grid_col=0),
+        models.Seat(id=5, room_id=1, seat_number="F6", is_available=1, features=["靠窗"], grid_row=5, grid_col=5),
+        models.Seat(id=6, room_id=1, seat_number="J10", is_available=1, features=["靠窗"], grid_row=9, grid_col=9),
+    ])
+    db.commit()
+    reference_cache.load(db)
+    add_reservations(db, 2, seat_id=1)  # 最常坐的座位
+    client.post("/api/reservations/", json={"seatId": "4", "date": "2030-01-01", "timeSlotId": "1"})
+
+    recommend = lambda query: [
+        (seat["number"], seat["distance"])
+        for seat in client.get(f"/api/seats/recommend?date=2030-01-01&timeSlotId=1&{query}").json()
+    ]
+    assert recommend("features=靠窗&k=2") == [("A1", 0), ("F6", 7.07)]
+    assert recommend("k=2") == [("A1", 0), ("A2", 1)]
+    assert recommend("features=靠窗&nearSeatId=6&k=2") == [("J10", 0), ("F6", 5.66)]
+    assert recommend("features=靠窗,电源插座") == []
+
+
+def test_seat_grid_position_validation(client, seed, db):
+    for bad in ("front", -1, 1.5, True):
+        response = client.post("/api/seats/", json={"number": "B2", "locationId": 1, "row": bad})
+        assert response.status_code == 422
+    created = client.post("/api/seats/", json={"number": "B2", "locationId": 1, "row": None, "col": 4}).json()
+    assert (created["row"], created["col"]) == (None, 4)
+
+    # 直接写入数据库的非整数位置不参与推荐，也不影响其他座位
+    db.query(models.Seat).filter(models.Seat.id == 1).update({"grid_row": "front", "grid_col": 0})
+    db.add(models.Seat(id=9, room_id=1, seat_number="C1", is_available=1, features=[], grid_row=2, grid_col=0))
+    db.commit()
+    reference_cache.load(db)
+    response = client.get("/api/seats/recommend?date=2030-01-01&timeSlotId=1&nearSeatId=9&k=2")
+    assert response.status_code == 200
+    assert [seat["number"] for seat in response.json()] == ["C1"]
+    assert client.get("/api/seats/recommend?date=2030-01-01&timeSlotId=1&nearSeatId=1").status_code == 200
+
+
+def test_seat_grid_matches_linear_scan():
+    rng = random.Random(7)
+    cache = ReferenceCache()
+    cache.seats = {
+        seat_id: SeatInfo(f"S{seat_id}", 1, grid_row=rng.randrange(40), grid_col=rng.randrange(60))
+        for seat_id in range(1, 500)
+    }
+    grid = SeatGrid(cache)
+    candidates = sum(1 << seat_id for seat_id in cache.seats if rng.random() < 0.3)
+    for _ in range(20):
+        row, col = rng.randrange(40), rng.randrange(60)
+        expected = sorted(
+            (math.hypot(seat.grid_row - row, seat.grid_col - col), seat_id)
+            for seat_id, seat in cache.seats.items()
+            if candidates >> seat_id & 1
+        )[:7]
+        assert grid.nearest(1, row, col, candidates, 7) == expected
@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+from auth.dependencies import get_current_user_id
+from conftest import add_reservations
+from app import app
+from database import crud
+import database.models as models
+
+
+def test_waitlist_assigned_on_cancel(client, seed, db):
+    db.add(models.User(id=2, name="李四", email="other@example.com", hashed_password="password123"))
+    db.commit()
+    taken = add_reservations(db, 1, user_id=2, start_day=1)[0]
+    crud.rebuild_checkin_rollup(db)
+    day = (date.today() + timedelta(days=1)).isoformat()
+
+    assert client.post("/api/waitlist/", json={"date": day, "timeSlotId": "1", "feature": "电源插座"}).status_code == 201
+    assert client.post("/api/waitlist/", json={"date": day, "timeSlotId": "1"}).status_code == 409
+    # 第一条候补要求的特性不符合，取消后换成不限特性的候补
+    first = client.get("/api/waitlist/").json()[0]
+    assert client.delete(f"/api/waitlist/{first['id']}").json()["status"] == "已取消"
+    assert client.post("/api/waitlist/", json={"date": day, "timeSlotId": "1", "roomId": 1, "feature": "靠窗"}).status_code == 201
+
+    app.dependency_overrides[get_current_user_id] = lambda: "2"
+    assert client.delete(f"/api/reservations/{taken.id}").status_code == 200
+    app.dependency_overrides[get_current_user_id] = lambda: "1"
+
+    entry = client.get("/api/waitlist/").json()[0]
+    assert entry["status"] == "已分配"
+    reservation = client.get(f"/api/reservations/{entry['reservationId']}").json()
+    assert (reservation["seatId"], reservation["date"], reservation["status"]) == ("1", day, "已预约")
+    rollup = db.query(models.CheckinRollup).filter(models.CheckinRollup.date == date.today() + timedelta(days=1)).one()
+    assert (rollup.total, rollup.cancelled) == (1, 1)